@@ -0,0 +1,118 @@
+#! /usr/bin/python
+# 
+# benchmarks/continuation.py : what skipping lammps' per-run setup saves.
+# 
+# Copyright (C) 2012  Joe Jordan
+# <joe.jordan@imperial.ac.uk>
+# <tehwalrus@h2j9k.org>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or (at
+# your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
+#
+
+import sys, os, time
+# the pydem in this checkout, rather than any installed one.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+if __name__ == "__main__" and sys.argv[1:2] == ['-f']:
+  # pydem.dem imports lammps as it loads.
+  import fake_lammps
+  fake_lammps.install()
+  fake_lammps.lammps.model_setup = True
+import pydem.dem as l, pydem.granular as g
+
+def print_usage():
+  print """
+  continuation.py - times a run split into many short segments (as rendering
+  or callbacks split it), with and without continuation mode.
+  
+  USAGE:
+  
+  continuation.py [-f] [segments [timesteps_per_segment [x_limit]]]
+  
+  defaults: 200 segments of 10 timesteps, in a 2D box 100 wide. The setup saved
+  is lammps' own (neighbour lists, initial forces), so its size only shows
+  against a real lammps. With -f, lammps is replaced by the stand-in in
+  fake_lammps.py, whose setup is a token neighbour binning, and the setups done
+  in each mode are counted too.
+"""
+
+def build_system(x_limit):
+  inputs = {
+    'simulation_params' : {
+      'dimension' : 2,
+      'x_limit' : x_limit,
+      'y_limit' : x_limit / 2.0,
+      'max_particles_guess' : 100
+    },
+    'force_model_params' : {},
+    'element_generation_params' : {
+      'min_radius' : 0.5,
+      'max_radius' : 1.0,
+      'deposition_method' : g.DepositionMethod.GEOMETRIC_PACK,
+      'separation_scaling' : 1.0,
+      'seed' : 1
+    }
+  }
+  params = g.generate_params(inputs)
+  return {
+    'params' : params,
+    'elements' : g.generate_elements(inputs['element_generation_params'], params.json, [])
+  }
+
+def time_segments(continuation, segments, timesteps, x_limit):
+  system = build_system(x_limit)
+  system['params']['continuation'] = continuation
+  simulation = l.Simulation(system)
+  # the first run always does the setup; leave it out.
+  simulation.run_time(timesteps)
+  
+  # the stand-in counts its setups; a real lammps doesn't.
+  setups_before = getattr(simulation.lmp, 'setups', None)
+  
+  start = time.time()
+  for i in range(segments):
+    simulation.run_time(timesteps)
+  elapsed = time.time() - start
+  setups = None
+  if setups_before is not None:
+    setups = simulation.lmp.setups - setups_before
+  simulation.close()
+  return elapsed, setups, len(system['elements'])
+
+if __name__ == "__main__":
+  
+  if len(sys.argv) > 1 and sys.argv[1] in ['-h', '--help']:
+    print_usage()
+    exit()
+  
+  arguments = sys.argv[1:]
+  fake = arguments[0:1] == ['-f']
+  if fake:
+    arguments = arguments[1:]
+  
+  arguments = [int(a) for a in arguments[0:2]] + [float(a) for a in arguments[2:3]]
+  segments, timesteps, x_limit = arguments + [200, 10, 100.0][len(arguments):]
+  
+  with_setup, setups_with, count = time_segments(False, segments, timesteps, x_limit)
+  without_setup, setups_without, count = time_segments(True, segments, timesteps, x_limit)
+  
+  print count, "particles,", segments, "segments of", timesteps, "timesteps:"
+  print "  full setup every run:   %.3f s (%.2f ms per segment)" % (with_setup, 1000.0 * with_setup / segments)
+  print "  continuation runs:      %.3f s (%.2f ms per segment)" % (without_setup, 1000.0 * without_setup / segments)
+  print "  setup saved per segment: %.2f ms" % (1000.0 * (with_setup - without_setup) / segments)
+  if setups_with is not None:
+    print "  lammps setups:          %d with full setup, %d with continuation" % (setups_with, setups_without)
+  if fake:
+    print "  (fake_lammps' setup is a token neighbour binning; a real lammps also"
+    print "  evaluates the forces, so saves more.)"
@@ -0,0 +1,352 @@
+#
+# benchmarks/fake_lammps.py : an in-memory stand-in for the lammps module.
+#
+# Copyright (C) 2012  Joe Jordan
+# <joe.jordan@imperial.ac.uk>
+# <tehwalrus@h2j9k.org>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or (at
+# your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
+#
+#
+# The parts of the lammps library interface pydem.dem uses - command,
+# extract_atom/global/variable and the gather/scatter_atoms calls - over
+# numpy arrays, so the python side of pydem can be timed (or tried out)
+# without a lammps build. Per-atom arrays are laid out as lammps lays them out
+# (2d arrays as one contiguous block behind an array of row pointers), so
+# pydem's zero copy views work on them unchanged.
+#
+# Only the commands pydem sends are understood, and the physics is a token:
+# a run moves grains under gravity, with some damping, and stops them at the
+# walls - there are no collisions. fix pour is not simulated. Use it with
+#   import fake_lammps
+#   fake_lammps.install()     # before pydem.dem is imported
+#
+
+import ctypes, sys
+import numpy
+
+_double = ctypes.POINTER(ctypes.c_double)
+_double_rows = ctypes.POINTER(_double)
+_int = ctypes.POINTER(ctypes.c_int)
+
+def install():
+  """makes 'import lammps' (and so pydem.dem) use this module."""
+  module = sys.modules[__name__]
+  sys.modules['lammps'] = module
+  if 'pydem.dem' in sys.modules:
+    sys.modules['pydem.dem'].lammps = module
+
+class lammps(object):
+  """a fake lammps instance. Class attributes tune it:
+    reorder_on_run - shuffle the local atom order after every run, as lammps'
+                     atom sorting does, so pydem has to match atoms up by tag.
+    model_setup    - bin the atoms into neighbour cells at each run's setup,
+                     as a token of the setup cost continuation mode skips.
+  counts of what it was asked to do are kept in runs, setups and commands."""
+  
+  reorder_on_run = False
+  model_setup = False
+  
+  # the per-atom arrays, and how many doubles (or, for id, ints) per atom.
+  _per_atom = {'x' : 3, 'v' : 3, 'f' : 3, 'omega' : 3, 'rmass' : 1, 'radius' : 1, 'id' : 1}
+  
+  def __init__(self, name='', cmdargs=None, ptr=None, comm=None):
+    self._clear()
+  
+  def _clear(self):
+    self.nlocal = 0
+    self.nmax = 0
+    self.max_tag = 0
+    self.arrays = {}
+    self.pointers = {}
+    self._allocate(16)
+    self.regions = {}
+    self.groups = {}
+    self.variables = {}
+    self.fixes = {}
+    self.gravity = numpy.zeros(3)
+    self.dt = 1.0
+    self.step = 0
+    self.dimension = 3
+    self.box = numpy.array([[0.0, 1.0]] * 3)
+    self.rng = numpy.random.RandomState(1)
+    self.log = None
+    self.runs = 0
+    self.setups = 0
+    self.commands = 0
+  
+  def _allocate(self, nmax):
+    """(re)allocates the per-atom arrays, which moves them, as lammps' grow
+    does."""
+    arrays = {}
+    for name, width in lammps._per_atom.items():
+      shape = (nmax, width) if width > 1 else (nmax,)
+      arrays[name] = numpy.zeros(shape, dtype=numpy.int32 if name == 'id' else numpy.float64)
+      if name in self.arrays:
+        arrays[name][:self.nlocal] = self.arrays[name][:self.nlocal]
+    self.arrays = arrays
+    self.nmax = nmax
+    
+    self.pointers = {}
+    for name, array in arrays.items():
+      if name == 'id':
+        self.pointers[name] = (array.ctypes.data_as(_int), None)
+      elif array.ndim == 1:
+        self.pointers[name] = (array.ctypes.data_as(_double), None)
+      else:
+        rows = numpy.arange(nmax, dtype=numpy.uint64) * numpy.uint64(array.strides[0]) + numpy.uint64(array.ctypes.data)
+        # the row pointer array must live as long as the pointer to it.
+        self.pointers[name] = (rows.ctypes.data_as(_double_rows), rows)
+  
+  def _grow(self, n):
+    if n > self.nmax:
+      self._allocate(max(n, 2 * self.nmax))
+  
+  def _live(self, name):
+    return self.arrays[name][:self.nlocal]
+  
+  # the library interface:
+  
+  def command(self, line):
+    self.commands += 1
+    words = line.split()
+    if not words:
+      return
+    handler = getattr(self, '_command_' + words[0], None)
+    if handler is not None:
+      handler(words)
+  
+  def extract_global(self, name, type):
+    return {'nlocal' : self.nlocal, 'natoms' : self.nlocal, 'nmax' : self.nmax}[name]
+  
+  def get_natoms(self):
+    return self.nlocal
+  
+  def extract_atom(self, name, type):
+    return self.pointers[name][0]
+  
+  def extract_variable(self, name, group, type):
+    return self._evaluate(self.variables[name])
+  
+  def gather_atoms(self, name, type, count):
+    tags = self._live('id')
+    if len(tags) > 0 and tags.max() != self.nlocal:
+      raise Exception("gather_atoms needs atom IDs 1..N.")
+    return self._gathered(name, type, count, numpy.argsort(tags))
+  
+  def scatter_atoms(self, name, type, count, data):
+    self._scatter(name, count, numpy.argsort(self._live('id')), numpy.ctypeslib.as_array(data))
+  
+  def gather_atoms_subset(self, name, type, count, ndata, ids):
+    return self._gathered(name, type, count, self._local_of(numpy.ctypeslib.as_array(ids)[:ndata]))
+  
+  def scatter_atoms_subset(self, name, type, count, ndata, ids, data):
+    self._scatter(name, count, self._local_of(numpy.ctypeslib.as_array(ids)[:ndata]), numpy.ctypeslib.as_array(data))
+  
+  def close(self):
+    self._command_log(['log', 'none'])
+  
+  def _gathered(self, name, type, count, order):
+    values = self._live(name)[order]
+    if values.ndim == 2:
+      values = values[:, :count]
+    out = ((ctypes.c_int if type == 0 else ctypes.c_double) * (len(order) * count))()
+    numpy.ctypeslib.as_array(out)[:] = values.ravel()
+    return out
+  
+  def _scatter(self, name, count, order, values):
+    values = values[:len(order) * count]
+    array = self.arrays[name]
+    if array.ndim == 2:
+      array[order, :count] = values.reshape(-1, count)
+    else:
+      array[order] = values
+  
+  def _local_of(self, ids):
+    lookup = numpy.zeros(self.max_tag + 1, dtype=numpy.int64)
+    lookup[self._live('id')] = numpy.arange(self.nlocal)
+    return lookup[ids]
+  
+  # commands:
+  
+  def _command_clear(self, words):
+    log = self.log
+    self._clear()
+    self.log = log
+  
+  def _command_dimension(self, words):
+    self.dimension = int(words[1])
+  
+  def _command_region(self, words):
+    if words[2] == 'delete':
+      del self.regions[words[1]]
+    else:
+      self.regions[words[1]] = numpy.array([float(w) for w in words[3:9]]).reshape(3, 2)
+  
+  def _command_create_box(self, words):
+    self.box = self.regions[words[2]].copy()
+    self._grow(int(words[1]))
+  
+  def _command_create_atoms(self, words):
+    # create_atoms 1 random N seed region
+    count = int(words[3])
+    region = self.regions[words[5]]
+    self._grow(self.nlocal + count)
+    new = slice(self.nlocal, self.nlocal + count)
+    for name in self.arrays:
+      self.arrays[name][new] = 0
+    self.arrays['x'][new] = region[:, 0] + self.rng.random_sample((count, 3)) * (region[:, 1] - region[:, 0])
+    self.arrays['radius'][new] = 0.5
+    self.arrays['rmass'][new] = 4.0 / 3.0 * numpy.pi * 0.125
+    self.arrays['id'][new] = numpy.arange(self.max_tag + 1, self.max_tag + 1 + count)
+    self.max_tag += count
+    self.nlocal += count
+  
+  def _command_group(self, words):
+    if words[2] == 'delete':
+      del self.groups[words[1]]
+    elif words[2] == 'id':
+      ranges = [[int(i) for i in w.split(':')] for w in words[3:]]
+      tags = numpy.concatenate([numpy.arange(r[0], r[-1] + 1) for r in ranges])
+      self.groups[words[1]] = numpy.union1d(self.groups.get(words[1], numpy.zeros(0, dtype=numpy.int64)), tags)
+  
+  def _command_delete_atoms(self, words):
+    # delete_atoms group name [compress yes|no]; the survivors keep their
+    # order (lammps fills each hole from the end, which pydem copes with too.)
+    keep = ~numpy.in1d(self._live('id'), self.groups[words[2]])
+    n = int(keep.sum())
+    for name, array in self.arrays.items():
+      array[:n] = array[:self.nlocal][keep]
+    self.nlocal = n
+    if 'compress' not in words or words[words.index('compress') + 1] == 'yes':
+      self.arrays['id'][:n] = numpy.arange(1, n + 1)
+      self.max_tag = n
+  
+  def _command_fix(self, words):
+    self.fixes[words[1]] = words
+    if words[3] == 'gravity':
+      self.gravity = float(words[4]) * numpy.array([float(w) for w in words[6:9]])
+  
+  def _command_unfix(self, words):
+    self.fixes.pop(words[1], None)
+    if words[1] == 'grav':
+      self.gravity = numpy.zeros(3)
+  
+  def _command_timestep(self, words):
+    self.dt = float(words[1])
+  
+  def _command_variable(self, words):
+    self.variables[words[1]] = words[3]
+  
+  def _command_log(self, words):
+    if self.log is not None:
+      self.log.close()
+      self.log = None
+    if words[1] != 'none':
+      self.log = open(words[1], 'a' if 'append' in words else 'w')
+  
+  def _command_run(self, words):
+    steps = int(words[1])
+    options = dict(zip(words[2::2], words[3::2]))
+    if options.get('pre', 'yes') == 'yes':
+      self._setup()
+    self.runs += 1
+    done = self._run(steps)
+    if self.log is not None:
+      self.log.write("Loop time of %g on 1 procs for %d steps with %d atoms\n" % (0.0, done, self.nlocal))
+      if options.get('post', 'yes') == 'yes':
+        self.log.write("\nPair  time (%) = 0 (0)\nNeigh time (%) = 0 (0)\nComm  time (%) = 0 (0)\nOutpt time (%) = 0 (0)\nOther time (%) = 0 (0)\n")
+  
+  def _setup(self):
+    self.setups += 1
+    if not lammps.model_setup or self.nlocal == 0:
+      return
+    # the neighbour list build: atoms sorted into cells a diameter wide, and
+    # each cell's population counted.
+    x = self._live('x')
+    cell = 2.0 * self._live('radius').max()
+    cells = numpy.maximum(1, numpy.ceil((self.box[:, 1] - self.box[:, 0]) / cell).astype(numpy.int64))
+    coords = numpy.clip(numpy.floor((x - self.box[:, 0]) / cell).astype(numpy.int64), 0, cells - 1)
+    cell_id = numpy.ravel_multi_index(coords.T, cells)
+    self.neighbour_order = numpy.argsort(cell_id, kind='mergesort')
+    self.cell_counts = numpy.bincount(cell_id, minlength=int(numpy.prod(cells)))
+  
+  def _run(self, steps):
+    x = self._live('x')
+    v = self._live('v')
+    f = self._live('f')
+    mass = self._live('rmass')
+    radius = self._live('radius')
+    lower = self.box[:, 0] + radius[:, None]
+    upper = self.box[:, 1] - radius[:, None]
+    halt = self.fixes.get('halt')
+    limit = self.fixes.get('update_positions')
+    planar = self.dimension == 2
+    
+    for step in range(steps):
+      if halt is not None and step > 0 and self.step % int(halt[4]) == 0 and self._halted(halt):
+        return step
+      f[:] = mass[:, None] * self.gravity
+      v += self.gravity * self.dt
+      v *= 0.99
+      if planar:
+        f[:, 2] = 0.0
+        v[:, 2] = 0.0
+      if limit is not None and limit[3] == 'nve/limit':
+        speed = numpy.sqrt((v ** 2).sum(axis=1)) * self.dt
+        fast = speed > float(limit[4])
+        v[fast] *= (float(limit[4]) / speed[fast])[:, None]
+      x += v * self.dt
+      # grains stop dead at the walls.
+      outside = (x < lower) | (x > upper)
+      if not planar:
+        numpy.clip(x, lower, upper, out=x)
+        v[outside] = 0.0
+      else:
+        x[:, :2] = numpy.clip(x[:, :2], lower[:, :2], upper[:, :2])
+        v[:, :2][outside[:, :2]] = 0.0
+      self.step += 1
+    
+    if self.reorder_on_run and self.nlocal > 0:
+      order = self.rng.permutation(self.nlocal)
+      for name, array in self.arrays.items():
+        array[:self.nlocal] = array[:self.nlocal][order]
+    return steps
+  
+  def _halted(self, halt):
+    # fix halt all halt N v_name operator value ...
+    value = self._evaluate(self.variables[halt[5][2:]])
+    limit = float(halt[7])
+    return {
+      '<' : value < limit, '<=' : value <= limit,
+      '>' : value > limit, '>=' : value >= limit,
+      '==' : value == limit, '!=' : value != limit
+    }[halt[6]]
+  
+  # equal-style variables:
+  
+  def _evaluate(self, expression):
+    if expression in ['ke', 'etotal']:
+      v = self._live('v')
+      return 0.5 * float((self._live('rmass') * (v ** 2).sum(axis=1)).sum())
+    if expression == 'pe':
+      return 0.0
+    if expression == 'step':
+      return float(self.step)
+    if expression == 'c_max_speed':
+      if self.nlocal == 0:
+        return 0.0
+      return float(numpy.sqrt((self._live('v') ** 2).sum(axis=1)).max())
+    raise Exception("the fake lammps can't evaluate '" + expression + "'.")
@@ -0,0 +1,364 @@
+#! /usr/bin/python
+#
+# benchmarks/suite.py : times pydem's python side, against a fake lammps.
+#
+# Copyright (C) 2012  Joe Jordan
+# <joe.jordan@imperial.ac.uk>
+# <tehwalrus@h2j9k.org>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or (at
+# your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
+#
+
+import sys, os, getopt, time, shutil, tempfile, cjson
+import numpy
+# the pydem in this checkout, rather than any installed one.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import fake_lammps
+fake_lammps.install()
+import pydem, pydem.dem as l, pydem.granular as g, pydem.packing as packing
+
+def print_usage():
+  listing = '\n'.join(["    %-18s %s" % (name, function.__doc__.split('\n')[0]) for name, function, largest, sized in benchmarks])
+  print """
+  suite.py - times the python side of pydem (syncing particles with lammps,
+  adding and removing them, saving and opening systems, generating packs and
+  building lammps scripts) at a range of system sizes. lammps is replaced by
+  an in-memory stand-in (fake_lammps.py), so no lammps build is needed and
+  only pydem's own time is measured.
+  
+  USAGE:
+  
+  suite.py [-s sizes] [-d dimension] [-r repeats] [-o history_file] [benchmark ...]
+  
+  sizes is a comma separated list of particle counts (default
+  1000,10000,100000,1000000), dimension 2 or 3 (default 3), and each result is
+  the best of repeats runs (default 3). Only the benchmarks named are run - by
+  default, all of them:
+  
+  BENCHMARKS
+  
+  With -o, the results are appended to history_file (one json record per line)
+  and compared with the last record there for the same dimension, so
+  regressions show up as they happen.
+""".replace('  BENCHMARKS', listing)
+
+def box_for(count, dimension):
+  """box limits which a geometric pack (see granular.generate_geometric_pack)
+  fills with about count grains of radius 0.5 to 1.0."""
+  fraction = 0.5 if dimension == 3 else 0.7
+  mean_volume = (
+    packing.grain_volume(1.0, dimension) * 1.0 -
+    packing.grain_volume(0.5, dimension) * 0.5
+  ) / (dimension + 1) / 0.5
+  side = (count * mean_volume / fraction) ** (1.0 / dimension)
+  limits = {'x_limit' : side, 'y_limit' : side}
+  if dimension == 3:
+    limits['z_limit'] = side
+  # the pack leaves 4 units clear at the top.
+  limits[['y_limit', 'z_limit'][dimension - 2]] += 4.0
+  return limits
+
+def pack_inputs(count, dimension, deposition_method=g.DepositionMethod.GEOMETRIC_PACK):
+  simulation_params = {'dimension' : dimension, 'max_particles_guess' : count}
+  simulation_params.update(box_for(count, dimension))
+  return {
+    'simulation_params' : simulation_params,
+    'force_model_params' : {},
+    'element_generation_params' : {
+      'min_radius' : 0.5,
+      'max_radius' : 1.0,
+      'deposition_method' : deposition_method,
+      'separation_scaling' : 1.0,
+      'seed' : 1
+    }
+  }
+
+# systems already built, by (count, dimension); benchmarks get copies.
+_systems = {}
+
+def system(count, dimension):
+  """a system of about count grains, on a jittered lattice (building a real
+  pack of a million grains would take longer than the benchmarks.)"""
+  if (count, dimension) not in _systems:
+    inputs = pack_inputs(count, dimension)
+    params = g.generate_params(inputs)
+    upper = numpy.array([params['x_limit'], params['y_limit']] + ([params['z_limit']] if dimension == 3 else []))
+    rng = numpy.random.RandomState(1)
+    radii = 0.5 + 0.5 * rng.random_sample(count)
+    positions = packing.lattice_pack(radii, numpy.zeros(dimension), upper, rng)
+    _systems[(count, dimension)] = (params, {
+      'position' : positions,
+      'velocity' : rng.standard_normal((count, dimension)),
+      'radius' : radii,
+      'mass' : numpy.pi * radii ** 2
+    })
+  params, columns = _systems[(count, dimension)]
+  params_json = params.to_json()
+  fm_params = params_json['force_model']
+  del params_json['force_model']
+  return {
+    'params' : pydem.SimulationParams(params_json, fm_params),
+    'elements' : pydem.ParticleStore.from_columns(dimension, dict([(k, c.copy()) for k, c in columns.items()]))
+  }
+
+def simulation(count, dimension):
+  return l.Simulation(system(count, dimension))
+
+# each benchmark sets up what it needs, and returns the seconds its timed part
+# took.
+
+def bench_write_all(count, dimension):
+  """python -> lammps: every particle's position and velocity changed."""
+  s = simulation(count, dimension)
+  elements = s.data['elements']
+  elements.column('position')[:] += 0.01
+  elements.mark_dirty('position')
+  elements.mark_dirty('velocity')
+  start = time.time()
+  s.particles_modified()
+  return time.time() - start
+
+def bench_write_few(count, dimension):
+  """python -> lammps: one particle in a hundred given a new velocity."""
+  s = simulation(count, dimension)
+  elements = s.data['elements']
+  rows = numpy.arange(0, count, 100)
+  elements.column('velocity')[rows] = 0.0
+  elements.mark_dirty('velocity', rows)
+  start = time.time()
+  s.particles_modified()
+  return time.time() - start
+
+def bench_read_all(count, dimension):
+  """lammps -> python: every property read back after a run."""
+  s = simulation(count, dimension)
+  s.run_time(1)
+  start = time.time()
+  s.data['elements'].refresh()
+  return time.time() - start
+
+def bench_read_position(count, dimension):
+  """lammps -> python: just positions read back after a run."""
+  s = simulation(count, dimension)
+  s.run_time(1)
+  start = time.time()
+  s.data['elements'].refresh('position')
+  return time.time() - start
+
+def bench_read_sorted(count, dimension):
+  """lammps -> python: everything read back after lammps reordered its atoms.
+  they then have to be matched up by tag."""
+  s = simulation(count, dimension)
+  fake_lammps.lammps.reorder_on_run = True
+  try:
+    s.run_time(1)
+  finally:
+    fake_lammps.lammps.reorder_on_run = False
+  start = time.time()
+  s.data['elements'].refresh()
+  return time.time() - start
+
+def bench_add_particles(count, dimension):
+  """add_particles: a tenth as many again, from a ParticleStore."""
+  s = simulation(count, dimension)
+  new = system(max(1, count // 10), dimension)['elements']
+  start = time.time()
+  s.add_particles(new)
+  return time.time() - start
+
+def bench_remove_particles(count, dimension):
+  """remove_particles: a random tenth of them."""
+  s = simulation(count, dimension)
+  elements = s.data['elements']
+  rows = numpy.random.RandomState(1).permutation(count)[:max(1, count // 10)]
+  defunct = [elements[i] for i in rows.tolist()]
+  start = time.time()
+  s.remove_particles(defunct)
+  return time.time() - start
+
+def _save_and_open(count, dimension, extension, opening):
+  directory = tempfile.mkdtemp(prefix='pydem-benchmark')
+  try:
+    filename = os.path.join(directory, 'system' + extension)
+    data = system(count, dimension)
+    if opening:
+      pydem.save_system(data, filename)
+    start = time.time()
+    if opening:
+      opened = pydem.open_system(filename)
+      # snapshots are memory mapped; count reading them in.
+      opened['elements'].column('position').sum()
+    else:
+      pydem.save_system(data, filename)
+    return time.time() - start
+  finally:
+    shutil.rmtree(directory)
+
+def bench_save_json(count, dimension):
+  """save_system, to .json.gz."""
+  return _save_and_open(count, dimension, '.json.gz', False)
+
+def bench_open_json(count, dimension):
+  """open_system, from .json.gz."""
+  return _save_and_open(count, dimension, '.json.gz', True)
+
+def bench_save_snapshot(count, dimension):
+  """save_system, to .snapshot."""
+  return _save_and_open(count, dimension, '.snapshot', False)
+
+def bench_open_snapshot(count, dimension):
+  """open_system, from .snapshot, reading positions in."""
+  return _save_and_open(count, dimension, '.snapshot', True)
+
+def bench_generate_sheets(count, dimension):
+  """granular.generate_elements, stacking sheets (in 2D, lines) of grains.
+  layers are generated until there are about count grains."""
+  inputs = pack_inputs(count, dimension, g.DepositionMethod.RANDOM_SPACED_SHEETS)
+  params = g.generate_params(inputs)
+  options = inputs['element_generation_params']
+  generated = 0
+  start = time.time()
+  # a line or sheet at a time, stacked, as generate_stable_pack does.
+  elements = pydem.ParticleStore(dimension)
+  top = 0.0
+  while generated < count:
+    layer = g.generate_elements(options, params.json, elements, top)
+    if len(layer) == 0:
+      break
+    generated += len(layer)
+    top = g.top_height(layer, dimension)
+  return time.time() - start
+
+def bench_generate_pack(count, dimension):
+  """granular.generate_elements with a geometric pack of about count grains."""
+  inputs = pack_inputs(count, dimension)
+  params = g.generate_params(inputs)
+  start = time.time()
+  g.generate_elements(inputs['element_generation_params'], params.json, [])
+  return time.time() - start
+
+def bench_generate_fixes(count, dimension):
+  """Simulation._generate_fixes, building the fixes script (x 1000.)"""
+  s = simulation(count, dimension)
+  start = time.time()
+  for i in range(1000):
+    s._generate_fixes()
+  return time.time() - start
+
+# (name, function, largest count worth running it at, or None; whether it
+# depends on the count at all.)
+benchmarks = [
+  ('write_all', bench_write_all, None, True),
+  ('write_few', bench_write_few, None, True),
+  ('read_all', bench_read_all, None, True),
+  ('read_position', bench_read_position, None, True),
+  ('read_sorted', bench_read_sorted, None, True),
+  ('add_particles', bench_add_particles, None, True),
+  ('remove_particles', bench_remove_particles, None, True),
+  ('save_json', bench_save_json, None, True),
+  ('open_json', bench_open_json, None, True),
+  ('save_snapshot', bench_save_snapshot, None, True),
+  ('open_snapshot', bench_open_snapshot, None, True),
+  ('generate_sheets', bench_generate_sheets, None, True),
+  ('generate_pack', bench_generate_pack, 100000, True),
+  ('generate_fixes', bench_generate_fixes, None, False)
+]
+
+def run_benchmarks(names, sizes, dimension, repeats):
+  """runs the named benchmarks at each size, printing as it goes; returns
+  {name : {size : best seconds}}."""
+  results = {}
+  for name, function, largest, sized in benchmarks:
+    if name not in names:
+      continue
+    results[name] = {}
+    for count in (sizes if sized else sizes[:1]):
+      if largest != None and count > largest:
+        print "%-18s %9d      skipped (above %d)" % (name, count, largest)
+        continue
+      best = min([function(count, dimension) for r in range(repeats)])
+      results[name][str(count)] = best
+      print "%-18s %9d %12.6f s" % (name, count, best)
+      sys.stdout.flush()
+  return results
+
+def compare(previous, results):
+  """prints how each result compares with the same one in previous."""
+  print
+  print "compared with the run of", previous['date'] + ":"
+  for name, function, largest, sized in benchmarks:
+    for count, seconds in sorted(results.get(name, {}).items(), key=lambda item: int(item[0])):
+      before = previous['results'].get(name, {}).get(count)
+      if before:
+        print "%-18s %9s %8.2fx%s" % (name, count, seconds / before, '   SLOWER' if seconds > 1.2 * before and seconds - before > 0.001 else '')
+
+def record(history, dimension, repeats, results):
+  """appends the results to the history file, comparing them with the last
+  record there for the same dimension."""
+  previous = None
+  if os.path.exists(history):
+    for line in open(history):
+      if line.strip() != "":
+        entry = cjson.decode(line)
+        if entry['dimension'] == dimension:
+          previous = entry
+  entry = {
+    'date' : time.strftime('%Y-%m-%d %H:%M:%S'),
+    'dimension' : dimension,
+    'repeats' : repeats,
+    'results' : results
+  }
+  outfile = open(history, 'a')
+  outfile.write(cjson.encode(entry) + "\n")
+  outfile.close()
+  if previous != None:
+    compare(previous, results)
+
+if __name__ == "__main__":
+  
+  try:
+    options, arguments = getopt.getopt(sys.argv[1:], 's:d:r:o:h')
+  except getopt.GetoptError:
+    print_usage()
+    exit()
+  
+  sizes = [1000, 10000, 100000, 1000000]
+  dimension = 3
+  repeats = 3
+  history = None
+  for option, value in options:
+    if option == '-s':
+      sizes = [int(s) for s in value.split(',')]
+    elif option == '-d':
+      dimension = int(value)
+    elif option == '-r':
+      repeats = int(value)
+    elif option == '-o':
+      history = value
+    elif option == '-h':
+      print_usage()
+      exit()
+  
+  names = [b[0] for b in benchmarks]
+  for name in arguments:
+    if name not in names:
+      print "no benchmark called", name + "; there are", ', '.join(names)
+      exit(1)
+  if arguments:
+    names = arguments
+  
+  results = run_benchmarks(names, sizes, dimension, repeats)
+  if history != None:
+    record(history, dimension, repeats, results)
@@ -21,12 +21,16 @@
 #
 
 import gzip, cjson, os, math
+import numpy
+from pydem import timing
 
 def vector_length(vector):
   """ arbitrary size cartesean vector length evaluation. """
   return math.sqrt(sum([v_i ** 2 for v_i in vector]))
 
-class JsonContainer:
+class JsonContainer(object):
+  __slots__ = []
+  
   def __getitem__(self, key):
     return self.json[key]
   
@@ -190,7 +194,7 @@ class ForceModel(JsonContainer):
     
     # we use minimum 30 samples per collision. range 10-100 is acceptable.
     self.json['timestep'] = shortest_collision_time / params['collision_time_ratio']
-    
+  
   
   def validate(self):
     for key in ForceModel.compulsory_keys:
@@ -209,8 +213,8 @@ class ForceModel(JsonContainer):
         self['boundary_constants'][key]
       except KeyError:
         raise InvalidArgumentError("Compulsory property '" + key + "' (on force constants) was not specified, or has not been derived.")
-        
-    
+
+
 
 class SimulationParams(JsonContainer):
   """class which holds simulation-wide settings, like the force interactions
@@ -256,7 +260,14 @@ class InvalidArgumentError(ValueError):
   pass
 
 class Particle(JsonContainer):
-  """particles, forced to be spherical for now."""
+  """particles, forced to be spherical for now.
+  
+  a Particle is either standalone, in which case it owns a dict of properties
+  just like the other JsonContainers, or it is attached to a ParticleStore, in
+  which case it is a lightweight view onto one row of the store's arrays. In
+  both cases e['position'] etc. behave the same way."""
+  __slots__ = ['store', 'index', 'lammps', '_json']
+  
   compulsory_keys = [
     'position',
     'radius',
@@ -268,15 +279,52 @@ class Particle(JsonContainer):
     'angular_velocity'
   ]
   def __init__(self, params=None):
-    self.json = {}
+    self.store = None
+    self.index = None
+    self._json = {}
     if not params == None:
       self.initialise(params)
-    
+  
+  def _get_json(self):
+    if self.store is None:
+      return self._json
+    return self.store.particle_json(self.index)
+  
+  json = property(_get_json)
+  
+  def __getitem__(self, key):
+    if self.store is None:
+      return self._json[key]
+    return self.store.get(self.index, key)
+  
+  def __setitem__(self, key, value):
+    if self.store is None:
+      JsonContainer.__setitem__(self, key, value)
+    else:
+      self.store.set(self.index, key, value)
+  
+  def __delitem__(self, key):
+    if self.store is None:
+      del self._json[key]
+    else:
+      self.store.delete(self.index, key)
+  
+  def to_json(self):
+    return self.json
+  
+  def _get_tag(self):
+    if self.store is None:
+      return None
+    return self.store.tag_of(self.index)
+  
+  tag = property(_get_tag, doc="""the lammps atom tag (ID) of this particle,
+  or None until it has been added to a simulation.""")
+  
   def initialise(self, params):
     for key, value in params.items():
-      self.json[key] = value
+      self._json[key] = value
     if 'style' not in params:
-      self.json['style'] = 'sphere'
+      self._json['style'] = 'sphere'
     self.validate()
   
   def init_lammps(self, params, write_properties=False, read_properties=False):
@@ -287,128 +335,659 @@ class Particle(JsonContainer):
       self.update_from_lammps()
   
   def overwrite_lammps(self):
-    dimension = len(self.json['position'])
+    position = self['position']
+    dimension = len(position)
     
     # compulsory keys:
     
-    self.lammps['x'][0] = self.json['position'][0]
-    self.lammps['x'][1] = self.json['position'][1]
+    self.lammps['x'][0] = position[0]
+    self.lammps['x'][1] = position[1]
     if dimension > 2:
-      self.lammps['x'][2] = self.json['position'][2]
+      self.lammps['x'][2] = position[2]
     
     # the two PointerFromArray instances:
-    self.lammps['rmass'].assign(self.json['mass'])
-    self.lammps['radius'].assign(self.json['radius'])
+    self.lammps['rmass'].assign(self['mass'])
+    self.lammps['radius'].assign(self['radius'])
     
     # optional keys, surrounded by try/excepts:
     
     try:
-      self.lammps['v'][0] = self.json['velocity'][0]
-      self.lammps['v'][1] = self.json['velocity'][1]
+      velocity = self['velocity']
+      self.lammps['v'][0] = velocity[0]
+      self.lammps['v'][1] = velocity[1]
       if dimension > 2:
-        self.lammps['v'][2] = self.json['velocity'][2]
+        self.lammps['v'][2] = velocity[2]
     except KeyError:
-      self.json['velocity'] = [0.0, 0.0]
-      if dimension > 2:
-        self.json['velocity'].append(0.0)
-      
+      self['velocity'] = [0.0] * dimension
+    
     
     try:
       if dimension == 2:
-        self.lammps['omega'][2] = self.json['angular_velocity']
+        self.lammps['omega'][2] = self['angular_velocity']
       else:
-        self.lammps['omega'][0] = self.json['angular_velocity'][0]
-        self.lammps['omega'][1] = self.json['angular_velocity'][1]
-        self.lammps['omega'][2] = self.json['angular_velocity'][2]
+        angular_velocity = self['angular_velocity']
+        self.lammps['omega'][0] = angular_velocity[0]
+        self.lammps['omega'][1] = angular_velocity[1]
+        self.lammps['omega'][2] = angular_velocity[2]
     except KeyError:
-      self.json['angular_velocity'] = 0.0
+      self['angular_velocity'] = 0.0
       if dimension > 2:
-        self.json['angular_velocity'] = [0.0, 0.0, 0.0]
+        self['angular_velocity'] = [0.0, 0.0, 0.0]
   
   def update_from_lammps(self, delta_t = 0.0):
-    dimension = len(self.json['position'])
-    
-    self.json['position'] = [
-      self.lammps['x'][0],
-      self.lammps['x'][1]
-    ]
-    if dimension > 2:
-      self.json['position'].append(self.lammps['x'][2])
+    dimension = len(self['position'])
     
-    self.json['velocity'] = [
-      self.lammps['v'][0],
-      self.lammps['v'][1]
-    ]
-    if dimension > 2:
-      self.json['velocity'].append(self.lammps['v'][2])
-    
-    self.json['force'] = [
-      self.lammps['f'][0],
-      self.lammps['f'][1]
-    ]
-    if dimension > 2:
-      self.json['force'].append(self.lammps['f'][2])
+    self['position'] = [self.lammps['x'][i] for i in range(dimension)]
+    self['velocity'] = [self.lammps['v'][i] for i in range(dimension)]
+    self['force'] = [self.lammps['f'][i] for i in range(dimension)]
     
     # the two PointerFromArray instances:
-    self.json['mass'] = self.lammps['rmass'].read()
-    self.json['radius'] = self.lammps['radius'].read()
+    self['mass'] = self.lammps['rmass'].read()
+    self['radius'] = self.lammps['radius'].read()
     
     if dimension == 2:
+      new_omega = self.lammps['omega'][2]
       try:
-        new_omega = self.lammps['omega'][2]
-        
-        average_omega = (self.json['angular_velocity'] + new_omega) / 2.0
+        average_omega = (self['angular_velocity'] + new_omega) / 2.0
         
-        self.json['theta'] += delta_t * average_omega
+        self['theta'] += delta_t * average_omega
       except KeyError:
-        self.json['theta'] = 0.0
-      self.json['angular_velocity'] = new_omega 
+        self['theta'] = 0.0
+      self['angular_velocity'] = new_omega 
     else:
-      self.json['angular_velocity'] = [
+      self['angular_velocity'] = [
         self.lammps['omega'][0],
         self.lammps['omega'][1],
         self.lammps['omega'][2]
       ]
   
   def validate(self):
+    if self.store is not None:
+      return
     for key in Particle.compulsory_keys:
       try:
-        self.json[key]
+        self._json[key]
       except KeyError:
         raise InvalidArgumentError("Compulsory property '" + key + "' was not specified.")
+  
+  def _attach(self, store, index):
+    self.store = store
+    self.index = index
+    self._json = None
+  
+  def _detach(self):
+    json = self.store.particle_json(self.index)
+    self.store = None
+    self.index = None
+    self._json = json
+
+
+class ParticleStore(object):
+  """structure-of-arrays storage for a system's particles, used as
+  data['elements']. each property is held in one contiguous numpy array:
+  (N, dimension) for position, velocity and force, (N, 3) for omega (lammps
+  always keeps all three components), and (N,) for radius, mass and theta.
+  
+  the store behaves like the list of Particles it replaces - iterating or
+  indexing it yields Particle views, which keep their identity for as long as
+  they are in the store, so e['position'] code keeps working unchanged. Views
+  are only created when a particle is first looked at, so that building a
+  store for a large system does not mean building an object per particle.
+  
+  after a simulation run the store is marked stale rather than read back, and
+  each property is only fetched from lammps when it is next accessed - so code
+  which only looks at energies never pays for the readback.
+  
+  writes through a Particle (e['position'] = ..., or e['position'][0] = ...)
+  are recorded per particle and per property, so that
+  Simulation.particles_modified() only sends lammps what actually changed.
+  Particles hand out vectors as lists, as they always have, which write item
+  assignments back to the store; code which writes to the store's column arrays
+  directly must call mark_dirty() itself.
+  
+  each particle also carries the tag (ID) of its lammps atom, and the store
+  keeps a tag -> row map, so particles can be found by tag in constant time."""
+  
+  vector_keys = ['position', 'velocity', 'force']
+  scalar_keys = ['radius', 'mass', 'theta']
+  column_keys = vector_keys + scalar_keys + ['angular_velocity']
+  
+  # the lammps per-atom property each column is read back from:
+  lammps_names = {
+    'position' : 'x',
+    'velocity' : 'v',
+    'force' : 'f',
+    'omega' : 'omega',
+    'theta' : 'omega',
+    'mass' : 'rmass',
+    'radius' : 'radius'
+  }
+  
+  # the columns which are written back to lammps when particles are modified:
+  lammps_columns = ['position', 'velocity', 'omega', 'mass', 'radius']
+  
+  # any other properties a particle has, when none have been set:
+  default_extras = {'style' : 'sphere'}
+  
+  def __init__(self, dimension, particles=None, capacity=0):
+    self.dimension = dimension
+    self.count = 0
+    self.views = []
+    self.extras = []
+    self.capacity = 0
+    self.columns = {}
+    self.tags = numpy.zeros(0, dtype=numpy.int64)
+    self.tag_index = {}
+    self.dirty = {}
+    self.dirty_columns = set()
+    self.stale = set()
+    self.stale_time = 0.0
+    self.loader = None
+    self.timings = None
+    self._reserve(max(capacity, 16))
+    if particles:
+      self.extend(particles)
+  
+  @classmethod
+  def from_json(cls, dimension, elements):
+    """builds a store directly from a list of particle json dicts, as found
+    in a saved system."""
+    store = cls(dimension, capacity=len(elements))
+    store.extend(elements)
+    return store
+  
+  @classmethod
+  def from_columns(cls, dimension, columns, extras=None):
+    """builds a store around existing (N, ...) column arrays, keyed as in
+    _column_shapes - which are adopted as they are rather than copied, so they
+    may for instance be memory mapped from a file. extras, if given, is a list
+    holding each particle's other properties (or None for the defaults.)"""
+    store = cls(dimension, capacity=0)
+    n = len(columns['position'])
+    store.count = n
+    store.capacity = n
+    for name, shape in store._column_shapes().items():
+      if name in columns:
+        store.columns[name] = columns[name]
+      else:
+        store.columns[name] = numpy.zeros((n,) + shape)
+    store.tags = numpy.zeros(n, dtype=numpy.int64)
+    for key in ParticleStore.lammps_columns:
+      store.dirty[key] = numpy.ones(n, dtype=bool)
+      store.dirty_columns.add(key)
+    store.views = [None] * n
+    store.extras = list(extras) if extras is not None else [None] * n
+    return store
+  
+  def _column_shapes(self):
+    return {
+      'position' : (self.dimension,),
+      'velocity' : (self.dimension,),
+      'force' : (self.dimension,),
+      'omega' : (3,),
+      'radius' : (),
+      'mass' : (),
+      'theta' : ()
+    }
+  
+  def _reserve(self, capacity):
+    if capacity <= self.capacity:
+      return
+    capacity = max(capacity, 2 * self.capacity)
+    for name, shape in self._column_shapes().items():
+      column = numpy.zeros((capacity,) + shape)
+      if name in self.columns:
+        column[:self.count] = self.columns[name][:self.count]
+      self.columns[name] = column
+    tags = numpy.zeros(capacity, dtype=numpy.int64)
+    tags[:self.count] = self.tags[:self.count]
+    self.tags = tags
+    for name in ParticleStore.lammps_columns:
+      mask = numpy.zeros(capacity, dtype=bool)
+      if name in self.dirty:
+        mask[:self.count] = self.dirty[name][:self.count]
+      self.dirty[name] = mask
+    self.capacity = capacity
+  
+  def column(self, name):
+    """a live (N, ...) view of one column, read back from lammps first if it
+    is stale."""
+    if name in self.stale:
+      self.refresh(name)
+    return self.columns[name][:self.count]
+  
+  position = property(lambda self: self.column('position'))
+  velocity = property(lambda self: self.column('velocity'))
+  force = property(lambda self: self.column('force'))
+  omega = property(lambda self: self.column('omega'))
+  radius = property(lambda self: self.column('radius'))
+  mass = property(lambda self: self.column('mass'))
+  theta = property(lambda self: self.column('theta'))
+  tag = property(lambda self: self.tags[:self.count])
+  
+  def mark_stale(self, loader, delta_t=0.0, timings=None):
+    """flags every column as out of date after delta_t seconds of simulation.
+    loader(lammps_names) must return the named lammps per-atom arrays, in store
+    order, when the columns are eventually read. Reading them is counted as
+    'read' in timings, if given (see pydem.timing.)"""
+    self.loader = loader
+    self.timings = timings
+    self.stale = set(ParticleStore.lammps_names.keys())
+    self.stale_time += delta_t
+    # anything not flushed before the run has been overwritten by it.
+    self.take_dirty()
+  
+  def refresh(self, *keys):
+    """reads stale columns back from lammps - all of them, or only those
+    named, e.g. store.refresh('position') after a run.
+    
+    if several runs pass without omega being read, theta is integrated over
+    all of them at once, using the mean of the old and new angular velocity."""
+    if not self.stale:
+      return
+    if keys:
+      wanted = set(['omega' if k == 'angular_velocity' else k for k in keys])
+      if 'omega' in wanted or 'theta' in wanted:
+        wanted.update(['omega', 'theta'])
+      wanted.intersection_update(self.stale)
+    else:
+      wanted = set(self.stale)
+    if not wanted:
+      return
     
+    timings = self.timings
+    if timings is not None:
+      timings.begin('read')
+    try:
+      self.stale.difference_update(wanted)
+      names = set([ParticleStore.lammps_names[c] for c in wanted])
+      arrays = self.loader(names)
+      delta_t = 0.0
+      if 'omega' in names:
+        delta_t = self.stale_time
+        self.stale_time = 0.0
+      if not self.stale:
+        self.loader = None
+      self.update_from_lammps(delta_t=delta_t, **arrays)
+    finally:
+      if timings is not None:
+        timings.end()
+  
+  def __len__(self):
+    return self.count
+  
+  def _view(self, index):
+    view = self.views[index]
+    if view is None:
+      view = Particle()
+      view._attach(self, index)
+      self.views[index] = view
+    return view
+  
+  def __iter__(self):
+    for i in xrange(self.count):
+      yield self._view(i)
+  
+  def __getitem__(self, index):
+    if isinstance(index, slice):
+      return [self._view(i) for i in range(*index.indices(self.count))]
+    if index < 0:
+      index += self.count
+    if index < 0 or index >= self.count:
+      raise IndexError("particle index out of range")
+    return self._view(index)
+  
+  def __contains__(self, particle):
+    return getattr(particle, 'store', None) is self
+  
+  def index(self, particle):
+    if getattr(particle, 'store', None) is not self:
+      raise ValueError("particle is not in this store.")
+    return particle.index
+  
+  def forget_lammps(self):
+    """drops everything tying the store to the lammps instance it was last
+    run in - the particles' tags, and the record of what that instance already
+    holds - so the whole system is sent to the next one it is given to."""
+    self.refresh()
+    self.loader = None
+    self.tags[:self.count] = 0
+    self.tag_index = {}
+    for key in ParticleStore.lammps_columns:
+      self.mark_dirty(key)
+  
+  def tag_of(self, index):
+    tag = int(self.tags[index])
+    if tag == 0:
+      return None
+    return tag
+  
+  def by_tag(self, tag):
+    """the particle whose lammps atom has the given tag."""
+    return self._view(self.tag_index[tag])
+  
+  def assign_tags(self, start, tags):
+    """records the lammps tags given to the particles in rows start onwards."""
+    end = start + len(tags)
+    self.tags[start:end] = tags
+    self.tag_index.update(zip(self.tags[start:end].tolist(), range(start, end)))
+  
+  def get(self, index, key):
+    if key in ParticleStore.vector_keys:
+      return _StoreRow(self, index, key)
+    if key == 'angular_velocity':
+      if self.dimension == 2:
+        return float(self.column('omega')[index, 2])
+      return _StoreRow(self, index, key)
+    if key == 'theta' and self.dimension != 2:
+      raise KeyError(key)
+    if key in ParticleStore.scalar_keys:
+      return float(self.column(key)[index])
+    return self._extras(index)[key]
+  
+  def set(self, index, key, value):
+    if key in ParticleStore.vector_keys or key in ParticleStore.scalar_keys:
+      self.column(key)[index] = value
+    elif key == 'angular_velocity':
+      if self.dimension == 2:
+        self.column('omega')[index, 2] = value
+      else:
+        self.column('omega')[index] = value
+    else:
+      self._own_extras(index)[key] = value
+      return
+    self.mark_dirty(key, index)
+  
+  def mark_dirty(self, key, indices=None):
+    """records that a property has changed for the given rows (or all rows)
+    and needs writing back to lammps."""
+    if key == 'angular_velocity':
+      key = 'omega'
+    if key not in self.dirty:
+      return
+    if indices is None:
+      self.dirty[key][:self.count] = True
+    else:
+      self.dirty[key][indices] = True
+    self.dirty_columns.add(key)
+  
+  def take_dirty(self):
+    """returns {column : row indices} for everything modified since the last
+    call, and clears the record."""
+    dirty = {}
+    for key in self.dirty_columns:
+      mask = self.dirty[key][:self.count]
+      rows = numpy.flatnonzero(mask)
+      if len(rows) > 0:
+        dirty[key] = rows
+      mask[:] = False
+    self.dirty_columns = set()
+    return dirty
+  
+  def delete(self, index, key):
+    if key in ParticleStore.column_keys:
+      raise InvalidArgumentError("property '" + key + "' is held in the particle store, and cannot be deleted.")
+    del self._own_extras(index)[key]
+  
+  def _extras(self, index):
+    extras = self.extras[index]
+    if extras is None:
+      return ParticleStore.default_extras
+    return extras
+  
+  def _own_extras(self, index):
+    if self.extras[index] is None:
+      self.extras[index] = dict(ParticleStore.default_extras)
+    return self.extras[index]
+  
+  def particle_json(self, index):
+    """materialises one particle as a plain json dict."""
+    self.refresh()
+    c = self.columns
+    json = dict(self._extras(index))
+    json['position'] = c['position'][index].tolist()
+    json['velocity'] = c['velocity'][index].tolist()
+    json['force'] = c['force'][index].tolist()
+    json['radius'] = float(c['radius'][index])
+    json['mass'] = float(c['mass'][index])
+    if self.dimension == 2:
+      json['angular_velocity'] = float(c['omega'][index, 2])
+      json['theta'] = float(c['theta'][index])
+    else:
+      json['angular_velocity'] = c['omega'][index].tolist()
+    return json
+  
+  def to_json(self):
+    """the whole store as a list of plain json dicts, one column at a time."""
+    self.refresh()
+    n = self.count
+    columns = {
+      'position' : self.position.tolist(),
+      'velocity' : self.velocity.tolist(),
+      'force' : self.force.tolist(),
+      'radius' : self.radius.tolist(),
+      'mass' : self.mass.tolist()
+    }
+    if self.dimension == 2:
+      columns['angular_velocity'] = self.omega[:, 2].tolist()
+      columns['theta'] = self.theta.tolist()
+    else:
+      columns['angular_velocity'] = self.omega.tolist()
+    
+    default = ParticleStore.default_extras
+    output = [dict(default if e is None else e) for e in self.extras]
+    for key, values in columns.items():
+      for i in range(n):
+        output[i][key] = values[i]
+    return output
+  
+  def append(self, particle):
+    self.extend([particle])
+    return self._view(self.count - 1)
+  
+  def extend(self, particles):
+    """copies new particles (standalone Particles, or plain json dicts) into
+    the store in one batch. Particle objects passed in are turned into views
+    themselves, so references to them held by the caller remain valid; plain
+    dicts get no Particle object until one is asked for."""
+    views = []
+    jsons = []
+    for p in particles:
+      if isinstance(p, Particle):
+        if p.store is not None:
+          p._detach()
+        views.append(p)
+        jsons.append(p._json)
+      else:
+        views.append(None)
+        jsons.append(p)
+    
+    if len(jsons) == 0:
+      return
+    
+    zero_vector = [0.0] * self.dimension
+    try:
+      columns = {
+        'position' : [j['position'] for j in jsons],
+        'radius' : [j['radius'] for j in jsons],
+        'mass' : [j['mass'] for j in jsons]
+      }
+    except KeyError, e:
+      raise InvalidArgumentError("Compulsory property '" + e.args[0] + "' was not specified.")
+    columns['velocity'] = [j.get('velocity', zero_vector) for j in jsons]
+    columns['force'] = [j.get('force', zero_vector) for j in jsons]
+    columns['theta'] = [j.get('theta', 0.0) for j in jsons]
+    if self.dimension == 2:
+      omega = numpy.zeros((len(jsons), 3))
+      omega[:, 2] = [j.get('angular_velocity', 0.0) for j in jsons]
+      columns['omega'] = omega
+    else:
+      columns['omega'] = [j.get('angular_velocity', [0.0, 0.0, 0.0]) for j in jsons]
+    
+    extras = []
+    for j in jsons:
+      e = dict([(key, value) for key, value in j.items() if key not in ParticleStore.column_keys])
+      if 'style' not in e:
+        e['style'] = 'sphere'
+      extras.append(None if e == ParticleStore.default_extras else e)
+    
+    start = self.count
+    self.extend_columns(columns, extras)
+    for i, p in enumerate(views):
+      if p is not None:
+        p._attach(self, start + i)
+        self.views[start + i] = p
+  
+  def extend_columns(self, columns, extras=None):
+    """appends particles given as whole columns - (K, ...) arrays keyed as in
+    _column_shapes, where only position, radius and mass are compulsory."""
+    k = len(columns['position'])
+    if k == 0:
+      return
+    
+    self.refresh()
+    start = self.count
+    end = start + k
+    self._reserve(end)
+    for name in self._column_shapes().keys():
+      if name in columns:
+        self.columns[name][start:end] = columns[name]
+      else:
+        self.columns[name][start:end] = 0.0
+    self.tags[start:end] = 0
+    self.views.extend([None] * k)
+    self.extras.extend(extras if extras is not None else [None] * k)
+    self.count = end
+    
+    # lammps has yet to hear about any of the new particles.
+    for key in ParticleStore.lammps_columns:
+      self.mark_dirty(key, slice(start, end))
+  
+  def remove(self, particle):
+    """removes one particle, as list.remove would."""
+    self.remove_rows([self.index(particle)])
+  
+  def remove_rows(self, indices):
+    """removes the particles at the given store indices, compacting the
+    arrays. removed Particle views become standalone again, holding a copy of
+    their final state."""
+    keep = numpy.ones(self.count, dtype=bool)
+    keep[list(indices)] = False
+    if keep.all():
+      return
+    
+    self.refresh()
+    
+    for i in numpy.flatnonzero(~keep):
+      if self.views[i] is not None:
+        self.views[i]._detach()
+    
+    n = int(keep.sum())
+    for name, column in self.columns.items():
+      column[:n] = column[:self.count][keep]
+    for name, mask in self.dirty.items():
+      mask[:n] = mask[:self.count][keep]
+    self.tags[:n] = self.tags[:self.count][keep]
+    
+    self.views = [v for v, k in zip(self.views, keep) if k]
+    self.extras = [e for e, k in zip(self.extras, keep) if k]
+    first_moved = int(numpy.argmin(keep))
+    for i in range(first_moved, n):
+      if self.views[i] is not None:
+        self.views[i].index = i
+    self.count = n
+    
+    self.tag_index = dict(zip(self.tags[:n].tolist(), range(n)))
+    self.tag_index.pop(0, None)
+  
+  def update_from_lammps(self, delta_t=0.0, **arrays):
+    """bulk equivalent of Particle.update_from_lammps - copies whichever of
+    the (N, 3) x, v, f, omega and (N,) rmass, radius arrays read from lammps
+    are given into the store, in one go per property."""
+    dim = self.dimension
+    n = self.count
+    c = self.columns
+    for column, name in [('position', 'x'), ('velocity', 'v'), ('force', 'f')]:
+      if name in arrays:
+        c[column][:n] = arrays[name][:, :dim]
+    if 'rmass' in arrays:
+      c['mass'][:n] = arrays['rmass']
+    if 'radius' in arrays:
+      c['radius'][:n] = arrays['radius']
+    if 'omega' in arrays:
+      if dim == 2:
+        c['theta'][:n] += delta_t * (c['omega'][:n, 2] + arrays['omega'][:, 2]) / 2.0
+      c['omega'][:n] = arrays['omega']
+  
+  def lammps_values(self, key, rows=None):
+    """one writable column laid out as lammps holds it, for all rows or just
+    those given. returns the lammps property name and a (k, 3) or (k,) array."""
+    values = self.column(key)
+    if rows is not None:
+      values = values[rows]
+    if key in ['position', 'velocity'] and self.dimension < 3:
+      padded = numpy.zeros((len(values), 3))
+      padded[:, :self.dimension] = values
+      values = padded
+    return ParticleStore.lammps_names[key], values
+
 
+class _StoreRow(list):
+  """a copy of one particle's vector property, which writes item assignments
+  back to the store (so they are seen by lammps.) Anything else done to it -
+  appending, say - only changes the copy."""
+  
+  def __init__(self, store, index, key):
+    column = store.column('omega' if key == 'angular_velocity' else key)
+    list.__init__(self, column[index].tolist())
+    self.store = store
+    self.index = index
+    self.key = key
+  
+  def __setitem__(self, item, value):
+    list.__setitem__(self, item, value)
+    self.store.set(self.index, self.key, list(self))
+  
+  def __setslice__(self, start, end, values):
+    self.__setitem__(slice(start, end), values)
+
+@timing.timed('open_system', timing.io_timings)
 def open_system(filename):
-  """opens a gzipped json file, in the format created by this library."""
-  json_file = gzip.open(filename, 'rb')
-  json_string = json_file.read()
-  
-  # checking for old invalid ' instead of " should be unnecessary, but we leave
-  # it in as it's a pain when it prevents a system from loading.
-  if json_string.find('\'') != -1:
-    json_string = json_string.replace('\'', '\"')
-  input_data = cjson.decode(json_string)
-  json_file.close()
-  
-  fm_params = input_data['params']['force_model']
-  del input_data['params']['force_model']
-  data = {
-    'params' : SimulationParams(input_data['params'], fm_params),
-    'elements' : [Particle(e) for e in input_data['elements']]
-  }
+  """opens a gzipped json file, in the format created by this library, or a
+  binary snapshot (see pydem.snapshot.) json files are decoded a particle at a
+  time (see pydem.json_stream), so large systems load in little more memory
+  than the particles themselves take up. time spent here is counted in
+  pydem.timing.io_timings."""
+  from pydem import snapshot
+  if filename.endswith(snapshot.EXTENSION) or snapshot.is_snapshot(filename):
+    return snapshot.open_snapshot(filename)
   
-  return data
+  from pydem import json_stream
+  return json_stream.open_json_system(filename)
 
+@timing.timed('save_system', timing.io_timings)
 def save_system(data, filename):
   """saves the system in 'data' to a gzipped json format that can be
-  restored using open_system.
+  restored using open_system. filenames ending '.snapshot' are saved in the
+  binary snapshot format instead. time spent here is counted in
+  pydem.timing.io_timings.
   """
+  from pydem import snapshot
+  if filename.endswith(snapshot.EXTENSION):
+    return snapshot.save_snapshot(data, filename)
+  
   if not filename.endswith('.json.gz'):
     filename = filename + '.json.gz'
   
+  elements = data['elements']
+  if isinstance(elements, ParticleStore):
+    elements_json = elements.to_json()
+  else:
+    elements_json = [e.to_json() for e in elements]
+  
   output_data = {
     'params' : data['params'].to_json(),
-    'elements' : [e.to_json() for e in data['elements']]
+    'elements' : elements_json
   }
   outfile = gzip.open(filename , 'wb')
   json_string = cjson.encode(output_data)
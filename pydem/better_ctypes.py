@@ -21,6 +21,8 @@
 #
 #
 
+import ctypes, numpy
+
 class PointerFromArray:
   """it is seemingly impossible to store a pointer(c_int) from an arbitrary
 existing position in a heap array passed from a c library via ctypes - 
@@ -35,4 +37,17 @@ object. This class is a rather inelegant solution to this problem."""
     self.array_ptr[self.array_index] = value
   
   def read(self):
-    return self.array_ptr[self.array_index]
\ No newline at end of file
+    return self.array_ptr[self.array_index]
+
+def pointer_address(ptr):
+  """the raw address a ctypes pointer holds, so that two pointers extracted at
+different times can be compared."""
+  return ctypes.cast(ptr, ctypes.c_void_p).value
+
+def numpy_view(ptr, shape):
+  """a numpy array aliasing the memory behind a ctypes pointer - reads and
+writes go straight to the c array, nothing is copied. The view is only valid
+for as long as the c library keeps that memory allocated."""
+  if 0 in shape or not pointer_address(ptr):
+    return numpy.zeros(shape, dtype=numpy.dtype(ptr._type_))
+  return numpy.ctypeslib.as_array(ptr, shape=shape)
@@ -30,9 +30,11 @@
 # it will loop infinitely over two pointer things. always use x[0].
 #
 
-import os, os.path, shutil, numbers
-from pydem import ForceModelType, vector_length
-from better_ctypes import PointerFromArray
+import os, os.path, shutil, numbers, time, math, tempfile
+import numpy
+from pydem import Endpoint, ForceModelType, InvalidArgumentError, ParticleStore, vector_length
+from better_ctypes import PointerFromArray, numpy_view, pointer_address
+from pydem import timing
 import lammps
 
 LMPIPTR = 0
@@ -40,6 +42,89 @@ LMPIPTRPTR = 1
 LMPDPTR = 2
 LMPDPTRPTR = 3
 
+class AtomArrays:
+  """numpy arrays aliasing lammps' per-atom memory directly, in lammps' local
+  atom order:
+    atoms['x'], atoms['v'], atoms['f'], atoms['omega'] => (nlocal, 3)
+    atoms['rmass'], atoms['radius'] => (nlocal,)
+    atoms['id'] => (nlocal,) atom tags.
+  each lookup checks (in a constant number of calls) whether lammps has moved
+  or resized the array since the last one, and re-binds the view if so - so
+  look arrays up again after running lammps commands, rather than holding on
+  to them."""
+  
+  extracts = {
+    'x' : LMPDPTRPTR,
+    'v' : LMPDPTRPTR,
+    'f' : LMPDPTRPTR,
+    'omega' : LMPDPTRPTR,
+    'rmass' : LMPDPTR,
+    'radius' : LMPDPTR,
+    'id' : LMPIPTR
+  }
+  
+  def __init__(self, lmp):
+    self.lmp = lmp
+    self.views = {}
+  
+  def __getitem__(self, name):
+    ptrtype = AtomArrays.extracts[name]
+    nlocal = self.lmp.extract_global('nlocal', 0)
+    ptr = self.lmp.extract_atom(name, ptrtype)
+    if ptrtype == LMPDPTRPTR:
+      # 2d lammps arrays are a single contiguous block, starting at row 0.
+      ptr = ptr[0]
+      shape = (nlocal, 3)
+    else:
+      shape = (nlocal,)
+    
+    address = pointer_address(ptr)
+    try:
+      cached_address, view = self.views[name]
+      if cached_address == address and view.shape == shape:
+        return view
+    except KeyError:
+      pass
+    
+    view = numpy_view(ptr, shape)
+    self.views[name] = (address, view)
+    return view
+  
+  def keys(self):
+    return AtomArrays.extracts.keys()
+
+class Callback:
+  """a python function which a Simulation calls every so many timesteps while
+  it runs - see Simulation.add_callback."""
+  
+  # what a callback can need, besides particle properties:
+  ENERGY = 'energy'
+  
+  def __init__(self, function, every_steps=None, every_time=None, needs=None):
+    if (every_steps == None) == (every_time == None):
+      raise InvalidArgumentError("a callback needs one (and only one) of every_steps and every_time.")
+    self.function = function
+    self.every_steps = every_steps
+    self.every_time = every_time
+    self.needs = list(needs or [])
+    for need in self.needs:
+      if need != Callback.ENERGY and need not in ParticleStore.lammps_names:
+        raise InvalidArgumentError("a callback cannot ask for '" + str(need) + "'.")
+    self.last_step = None
+  
+  def interval(self, simulation):
+    """the number of timesteps between calls, for this simulation."""
+    if self.every_steps != None:
+      return max(1, int(self.every_steps))
+    return max(1, int(round(self.every_time / simulation.data['params']['force_model']['timestep'])))
+  
+  def steps_until_due(self, simulation):
+    interval = self.interval(simulation)
+    return interval - simulation.steps_run % interval
+  
+  def due(self, simulation):
+    return simulation.steps_run % self.interval(simulation) == 0 and simulation.steps_run != self.last_step
+
 class Simulation:
   """a class to encapsulate the lifetime of a simulation, and marshal the
   lammps instance and associated ctypes and function calls.
@@ -48,9 +133,20 @@ class Simulation:
   TOTAL = 'totaleoutput'
   KINETIC = 'kineticeoutput'
   POTENTIAL = 'potentialeoutput'
+  MAX_SPEED = 'maxspeedoutput'
+  STEP = 'stepoutput'
+  
+  # above this fraction of particles changed, a property is written in bulk.
+  bulk_flush_fraction = 0.1
+  
+  # particles are removed by gathering their atoms into this group, a batch of
+  # ids at a time.
+  _defunct_group = 'pydem_defunct'
+  _ids_per_command = 500
   
   _init_commands = """atom_style sphere
 units si
+atom_modify map array
 
 communicate single vel yes
 
@@ -67,7 +163,14 @@ create_box MAX_ATOM_GUESS outer_box
 
 variable totaleoutput equal etotal
 variable kineticeoutput equal ke
-variable potentialeoutput equal pe"""
+variable potentialeoutput equal pe
+
+variable speed atom sqrt(vx*vx+vy*vy+vz*vz)
+compute max_speed all reduce max v_speed
+variable maxspeedoutput equal c_max_speed
+variable stepoutput equal step
+
+thermo_style custom step atoms ke pe etotal c_max_speed"""
   
   # NOTE - we may wish to extend lammps to support 'blank' atoms through the
   # create_atom command, to save all the calls to the random libs.
@@ -94,6 +197,20 @@ timestep DELTA_T"""
   
   _2d_fix = "fix enforce_planar all enforce2d"
   
+  _halt_fix = "fix halt all halt CHECK_EVERY v_VARIABLE OPERATOR VALUE error continue"
+  
+  # the pile height counts only particles which have slowed to settled_speed,
+  # so grains still falling from the pour zone don't count towards it.
+  _pour_commands = """region pour_zone block POUR_ZONE
+fix pour all pour POUR_COUNT 1 SEED region pour_zone diam range MIN_DIAMETER MAX_DIAMETER dens DENSITY DENSITY vol VOLUME_FRACTION 100
+variable pile_height atom (v_speed<SETTLED_SPEED)*VERTICAL
+compute pile_top all reduce max v_pile_height
+variable pourdoneoutput equal (atoms>=ATOM_TARGET)||(c_pile_top>FILL_HEIGHT)"""
+  
+  _pour_cleanup = """unfix pour
+uncompute pile_top
+region pour_zone delete"""
+  
   _lammps_extracts = {
     'x' : LMPDPTRPTR,
     'v' : LMPDPTRPTR,
@@ -116,11 +233,21 @@ timestep DELTA_T"""
 provided - called automatically if data is provided to the constructor."""
     self.data = data
     
+    if not isinstance(data['elements'], ParticleStore):
+      data['elements'] = ParticleStore(data['params']['dimension'], data['elements'])
+    else:
+      # the store may have been run before, in another lammps instance.
+      data['elements'].forget_lammps()
+    
     if (self.lmp == None):
       args = ['-log', 'none']
       if not self.show_lammps_output:
         args.extend(['-screen', 'none'])
       self.lmp = lammps.lammps(cmdargs=args)
+      self.atoms = AtomArrays(self.lmp)
+      self.bulk_sync = self.bulk_sync and hasattr(self.lmp, 'scatter_atoms')
+      if self.lammps_timing:
+        self.time_lammps()
     
     commands = self.commands_from_script(self._build_init())
     
@@ -131,26 +258,62 @@ provided - called automatically if data is provided to the constructor."""
     self.constants_modified()
     
     self.timesteps_run = [0]
-    
+    self.steps_run = 0
+  
   
-  def __init__(self, data=None):
+  def __init__(self, data=None, renderer=None, recorder=None):
     """data can be provided here, in which case lammps in initialised for use
 immidiately, or instance.initialise(data) can be called later.
 lammps spits out a LOT to the command line, especially when running with the
-simple visualiser. This is disabled by default, but you can pass
-show_lammps_output=True
-to this constructor to enable it."""
+simple visualiser. This is disabled by default, but you can set
+data['params']['show_lammps_output'] = True
+to enable it. The other options below are read from data['params'] likewise.
+after each run, particle state is read through numpy arrays which alias lammps'
+own memory (see instance.atoms); set zero_copy=False to copy the arrays out of
+lammps instead.
+particles are written to lammps with the library's gather/scatter_atoms calls
+when it provides them; set bulk_sync=False to use the per-particle path.
+runs which follow on from one another with nothing changed in between skip
+lammps' setup (the neighbour list build, initial force evaluation and so on)
+with 'run N pre no post no'; set continuation=False to always do it.
+where the time goes is counted in instance.timings (see pydem.timing); set
+lammps_timing=True to have lammps' own breakdown of its runs counted too (see
+time_lammps.)
+renderer and recorder are passed to this constructor, not in params (which are
+saved with the system): to draw the system while running, pass
+renderer=ThreadedRenderer(...) (see pydem.simple_visualiser); to record a
+trajectory, pass recorder=TrajectoryRecorder(...) (see pydem.trajectory).
+Either can also be set on the instance later. To run other python code while
+running, see add_callback."""
     self.show_lammps_output = False
     self.show_lammps_input = False
-    self.renderer = None
-    for option in ['show_lammps_output', 'show_lammps_input', 'renderer']:
+    self.renderer = renderer
+    self.recorder = recorder
+    self.callbacks = []
+    self.zero_copy = True
+    self.bulk_sync = True
+    self.continuation = True
+    self.lammps_timing = False
+    for option in ['show_lammps_output', 'show_lammps_input', 'zero_copy', 'bulk_sync', 'continuation', 'lammps_timing']:
       try:
         setattr(self, option, data['params'][option])
       except KeyError:
         pass
+    try:
+      # older scripts hand the renderer over in params; it can't stay there, as
+      # params are encoded whenever the system is saved.
+      self.renderer = data['params']['renderer']
+      del data['params']['renderer']
+    except KeyError:
+      pass
     self.fixes_applied = False
+    self.halt_applied = False
+    self.setup_needed = True
     self.atoms_created = 0
     self.lmp = None
+    self.atoms = None
+    self.timings = timing.Timings()
+    self.lammps_log = None
     if data != None:
       self.initialise(data)
   
@@ -196,62 +359,218 @@ to this constructor to enable it."""
     
     return output_commands
   
-  def _sync_pointers(self, particles, start_index=0, write_properties=False, read_properties=False):
-    # TODO make particles store their lammps ID, so when particles are removed 
-    # the IDs here need not be a contiguous block.
+  @timing.timed('sync_pointers')
+  def _sync_pointers(self, particles, write_properties=False, read_properties=False):
+    """the per-particle sync path: hands each particle a set of ctypes
+pointers into its own atom's lammps data, found by the particle's tag."""
     vars = {}
     for var, ptrtype in Simulation._lammps_extracts.items():
       vars[var] = self.lmp.extract_atom(var, ptrtype)
-    for i, e in enumerate(particles):
+    local_indices = self._local_indices()
+    for e in particles:
+      local_index = e.index if local_indices is None else int(local_indices[e.index])
       params = {}
       for key, value in vars.items():
         try:
           if Simulation._lammps_extracts[key] == LMPDPTR:
-            params[key] = PointerFromArray(value, start_index + i)
+            params[key] = PointerFromArray(value, local_index)
           else:
             # PTRPTRs are fine, as we get a new PTR from the subscript call.
-            params[key] = value[start_index + i]
+            params[key] = value[local_index]
         except:
           print "error from key", key
           raise
       e.init_lammps(params, write_properties=write_properties, read_properties=read_properties)
   
+  def _local_indices(self):
+    """for each particle in the store, the index of its atom in lammps' local
+arrays, matched up by tag (lammps reorders its local arrays whenever it sorts
+atoms.) None means the two orders already agree. lammps may hold atoms the
+store has yet to adopt (see _adopt_created_atoms), but never fewer."""
+    local_tags = self.atoms['id']
+    tags = self.data['elements'].tag
+    if len(local_tags) < len(tags):
+      raise Exception("lammps holds " + str(len(local_tags)) + " atoms, but the system has " + str(len(tags)) + " elements.")
+    if numpy.array_equal(local_tags, tags):
+      return None
+    order = numpy.argsort(local_tags)
+    return order[numpy.searchsorted(local_tags[order], tags)]
+  
+  def _consecutive_tags(self, tags):
+    """whether the store's tags run 1..N in order, as the library's
+whole-system gather/scatter_atoms calls require."""
+    return numpy.array_equal(tags, numpy.arange(1, len(tags) + 1))
+  
+  def _scatter(self, name, values, tags=None):
+    """writes one property for every atom, in tag order, or (when tags are
+given) for just those atoms."""
+    count = 1 if values.ndim == 1 else values.shape[1]
+    data = numpy.ascontiguousarray(values, dtype=numpy.float64).ravel()
+    c_data = numpy.ctypeslib.as_ctypes(data)
+    if tags is None:
+      self.lmp.scatter_atoms(name, 1, count, c_data)
+    else:
+      c_tags = numpy.ctypeslib.as_ctypes(numpy.ascontiguousarray(tags, dtype=numpy.int32))
+      self.lmp.scatter_atoms_subset(name, 1, count, len(tags), c_tags, c_data)
+  
+  def _gather(self, name, count, tags=None):
+    """reads one property for every atom, in tag order, or (when tags are
+given) for just those atoms."""
+    if tags is None:
+      c_data = self.lmp.gather_atoms(name, 1, count)
+      n = len(self.data['elements'])
+    else:
+      c_tags = numpy.ctypeslib.as_ctypes(numpy.ascontiguousarray(tags, dtype=numpy.int32))
+      c_data = self.lmp.gather_atoms_subset(name, 1, count, len(tags), c_tags)
+      n = len(tags)
+    data = numpy.ctypeslib.as_array(c_data)[:count * n]
+    if count > 1:
+      return data.reshape(n, count)
+    return data
+  
   def add_particles(self, new_particles, already_in_array=False):
     """use this to add particles to lammps safely - do not simply add to
-instance.data['elements'], as lammps will not be notified."""
+instance.data['elements'], as lammps will not be notified. new_particles may be
+a list of Particles, or a ParticleStore (whose columns are copied in whole.)"""
+    if len(new_particles) == 0:
+      return
+    elements = self.data['elements']
+    elements.refresh()
+    # taken from lammps, not the store, whose particles may not be in lammps
+    # yet (see initialise.)
+    local_tags = self.atoms['id']
+    max_tag = int(local_tags.max()) if len(local_tags) > 0 else 0
+    
     self._run_commands([
       Simulation._create_atoms_template.replace('NUM_ATOMS', str(len(new_particles)))
     ])
     
     if not already_in_array:
-      self.data['elements'].extend(new_particles)
+      if isinstance(new_particles, ParticleStore):
+        new_particles.refresh()
+        elements.extend_columns(
+          dict([(name, new_particles.columns[name][:len(new_particles)]) for name in new_particles.columns]),
+          new_particles.extras
+        )
+      else:
+        elements.extend(new_particles)
+    
+    # lammps gives new atoms tags above the highest one in use.
+    local_tags = self.atoms['id']
+    new_tags = numpy.sort(local_tags[local_tags > max_tag])
+    elements.assign_tags(len(elements) - len(new_tags), new_tags)
     
-    # sync ALL pointers when we add new particles - arrays may have been moved in RAM by lammps.
-    self._sync_pointers(self.data['elements'], start_index=0, write_properties=True)
+    self._update_lammps_from_python()
     
     self.atoms_created += len(new_particles)
+  
+  
+  
+  def pour_particles(self, count, min_radius, max_radius, pour_zone, density=1.0, volume_fraction=0.3, fill_height=None, settled_speed=None, seed=12345, max_timesteps=None, check_every=100):
+    """pours up to count new particles, of radii between min_radius and
+max_radius, in from the box pour_zone = [xlo, xhi, ylo, yhi(, zlo, zhi)] with
+lammps' fix pour - continuously, in one run, which lammps itself stops once all
+count are in or (if given) once the settled pile reaches fill_height. The
+poured particles are then added to data['elements']. Returns how many were
+poured."""
+    p = self.data['params']
+    if settled_speed == None:
+      settled_speed = math.sqrt(2.0 * vector_length(p['force_model']['gravity']) * min_radius)
+    if fill_height == None:
+      fill_height = 2.0 * max([p['x_limit'], p['y_limit'], p['z_limit'] if p['dimension'] == 3 else 0.0])
+    zone = list(pour_zone)
+    if p['dimension'] == 2:
+      zone.extend([-0.5, 0.5])
     
+    elements = self.data['elements']
+    self._update_lammps_from_python()
+    start_count = len(elements)
     
+    self._run_commands(self.commands_from_script(_string_sub(Simulation._pour_commands, {
+      'POUR_ZONE' : ' '.join([str(z) for z in zone]),
+      'POUR_COUNT' : str(count),
+      'ATOM_TARGET' : str(start_count + count),
+      'SEED' : str(seed),
+      'MIN_DIAMETER' : str(2.0 * min_radius),
+      'MAX_DIAMETER' : str(2.0 * max_radius),
+      'DENSITY' : str(density),
+      'VOLUME_FRACTION' : str(volume_fraction),
+      'SETTLED_SPEED' : str(settled_speed),
+      'VERTICAL' : 'y' if p['dimension'] == 2 else 'z',
+      'FILL_HEIGHT' : str(fill_height)
+    })))
+    try:
+      self.run_until('pourdoneoutput', '>', 0.5, max_timesteps=max_timesteps, check_every=check_every)
+    finally:
+      self._run_commands(self.commands_from_script(Simulation._pour_cleanup))
+    
+    return len(elements) - start_count
+  
+  @timing.timed('read')
+  def _adopt_created_atoms(self):
+    """appends atoms that lammps created by itself (i.e. with fix pour) during
+a run to data['elements'], in tag order."""
+    elements = self.data['elements']
+    elements.refresh()
+    max_tag = int(elements.tag.max()) if len(elements) > 0 else 0
+    
+    local_tags = numpy.array(self.atoms['id'])
+    new = numpy.nonzero(local_tags > max_tag)[0]
+    if len(new) == 0:
+      return
+    new = new[numpy.argsort(local_tags[new])]
+    
+    arrays = self.atoms if self.zero_copy else self._extract_lammps_arrays()
+    dim = self.data['params']['dimension']
+    start = len(elements)
+    elements.extend_columns({
+      'position' : arrays['x'][new, :dim],
+      'velocity' : arrays['v'][new, :dim],
+      'force' : arrays['f'][new, :dim],
+      'omega' : arrays['omega'][new],
+      'radius' : arrays['radius'][new],
+      'mass' : arrays['rmass'][new]
+    })
+    elements.assign_tags(start, local_tags[new])
+    # these came from lammps, so there is nothing to write back.
+    elements.take_dirty()
+    self.atoms_created += len(new)
   
   def remove_particles(self, defunct_particles):
     """use this to safely remove particles from the simulation. The particles
 will be automatically removed from data['elements'] after they are removed from
-lammps."""
-    ids_to_remove = [self.data['elements'].index(i) for i in defunct_particles]
-    ids_as_strings = [str(i) for i in ids_to_remove]
-    command = 'delete_atoms ids ' + ' '.join(ids_as_strings)
-    self._run_commands([command])
-    self.data['elements'] = [e for i, e in enumerate(self.data['elements']) if i not in ids_to_remove]
-    self._sync_pointers(self.data['elements'], read_properties=True)
+lammps. Atoms are deleted by tag, so the remaining particles keep theirs."""
+    elements = self.data['elements']
+    elements.refresh()
+    indices = [elements.index(p) for p in defunct_particles]
+    if len(indices) == 0:
+      return
+    
+    group = Simulation._defunct_group
+    commands = []
+    ids = _id_list(elements.tag[indices])
+    for i in range(0, len(ids), Simulation._ids_per_command):
+      commands.append('group ' + group + ' id ' + ' '.join(ids[i:i + Simulation._ids_per_command]))
+    commands.append('delete_atoms group ' + group + ' compress no')
+    commands.append('group ' + group + ' delete')
+    self._run_commands(commands)
     
+    elements.remove_rows(indices)
+  
   
-  def particles_modified(self):
+  def particles_modified(self, everything=False):
     """always call this method when elements' python properties have been
 changed that require persisting to lammps, e.g. when position or velocity are
 manually assigned. This function is automatically called by the add and remove
-functions."""
-    self._sync_pointers(self.data['elements'], write_properties=True)
-      
+functions.
+only the particles and properties assigned since the last call are written; if
+you have written to the particle store's column arrays directly, either call
+data['elements'].mark_dirty() or pass everything=True."""
+    if everything:
+      for key in ParticleStore.lammps_columns:
+        self.data['elements'].mark_dirty(key)
+    self._update_lammps_from_python()
+  
   
   def constants_modified(self):
     """always call this method when simulation params' python properties have
@@ -338,10 +657,156 @@ or damping have been manually assigned."""
   def compute_energy(self, type=TOTAL):
     return self.lmp.extract_variable(type, None, 0)
   
+  def compute_max_speed(self):
+    """the speed of the fastest particle, reduced inside lammps."""
+    return self.lmp.extract_variable(Simulation.MAX_SPEED, None, 0)
+  
+  def _current_step(self):
+    return int(round(self.lmp.extract_variable(Simulation.STEP, None, 0)))
+  
+  def _run_command(self, timesteps):
+    """the lammps command to run timesteps more timesteps. In continuation
+mode, lammps' setup is skipped unless something has changed since the last
+run (see setup_needed), as is the timing summary after it (unless lammps'
+timings are being collected, see time_lammps.)"""
+    command = 'run ' + str(timesteps)
+    if self.continuation:
+      command += ' pre ' + ('yes' if self.setup_needed else 'no')
+      command += ' post ' + ('yes' if self.lammps_log != None else 'no')
+    self.setup_needed = False
+    return command
+  
   def _run_time_internal(self, timesteps_to_run):
-    self._run_commands(['run ' + str(timesteps_to_run)])
-    self.timesteps_run.append(timesteps_to_run)
-    self._update_particles_from_lammps()
+    """returns the number of timesteps actually run, which is fewer than asked
+for only when a halt condition (see run_until) stopped lammps early."""
+    total = 0
+    while timesteps_to_run > 0:
+      # stop wherever a callback (or the recorder) is next due, and nowhere
+      # else, so the run is as few run commands as it can be.
+      segment = timesteps_to_run
+      due = self._steps_until_callback()
+      if due != None:
+        segment = min(segment, due)
+      if self.halt_applied:
+        first_step = self._current_step()
+      self._run_commands([self._run_command(segment)])
+      done = segment
+      if self.halt_applied:
+        done = self._current_step() - first_step
+      self.timesteps_run.append(done)
+      self.steps_run += done
+      total += done
+      self._update_particles_from_lammps()
+      if len(self.atoms['id']) > len(self.data['elements']):
+        self._adopt_created_atoms()
+      timesteps_to_run -= segment
+      self._run_callbacks()
+      if done < segment:
+        break
+    return total
+  
+  def add_callback(self, function, every_steps=None, every_time=None, needs=None):
+    """has function(simulation, state) called every every_steps timesteps (or
+every every_time in-universe seconds) during runs. state is a dict holding the
+'step' and 'time' the simulation has reached, and whatever the callback says
+it needs, from:
+  Callback.ENERGY - 'kinetic_energy', 'potential_energy' and 'total_energy',
+                    reduced inside lammps, so no particle data is read back.
+  'position', 'velocity', 'force', 'omega', 'radius', 'mass', 'theta' -
+                    that column of data['elements'], read back from lammps.
+only what the callbacks due at a step need is read back, and only once however
+many of them need it. e.g.
+  instance.add_callback(log_energy, every_steps=1000, needs=[Callback.ENERGY])
+  instance.add_callback(check_height, every_time=0.5, needs=['position'])
+runs are split only where some callback is due. A callback which changes any
+particles must call instance.particles_modified(), as usual. Returns the
+Callback, for remove_callback."""
+    callback = Callback(function, every_steps, every_time, needs)
+    self.callbacks.append(callback)
+    return callback
+  
+  def remove_callback(self, callback):
+    self.callbacks.remove(callback)
+  
+  def _steps_until_callback(self):
+    """timesteps until the next callback or recorder frame is due, or None."""
+    steps = [c.steps_until_due(self) for c in self.callbacks]
+    if self.recorder != None:
+      steps.append(self.recorder.steps_until_frame(self))
+    if not steps:
+      return None
+    return min(steps)
+  
+  def _run_callbacks(self):
+    if self.recorder != None:
+      self.timings.begin('record')
+      try:
+        self.recorder.step(self)
+      finally:
+        self.timings.end()
+    due = [c for c in self.callbacks if c.due(self)]
+    if not due:
+      return
+    
+    self.timings.begin('callbacks')
+    try:
+      self._call_callbacks(due)
+    finally:
+      self.timings.end()
+  
+  def _call_callbacks(self, due):
+    state = {
+      'step' : self.steps_run,
+      'time' : self.steps_run * self.data['params']['force_model']['timestep']
+    }
+    needs = set()
+    for c in due:
+      needs.update(c.needs)
+    if Callback.ENERGY in needs:
+      needs.remove(Callback.ENERGY)
+      state['kinetic_energy'] = self.compute_energy(Simulation.KINETIC)
+      state['potential_energy'] = self.compute_energy(Simulation.POTENTIAL)
+      state['total_energy'] = state['kinetic_energy'] + state['potential_energy']
+    if needs:
+      elements = self.data['elements']
+      elements.refresh(*needs)
+      for key in needs:
+        state[key] = elements.column(key)
+    
+    for c in due:
+      c.last_step = self.steps_run
+      c.function(self, state)
+  
+  def run_until(self, variable, operator, value, max_timesteps=None, check_every=100, chunk_timesteps=100000):
+    """runs until a lammps equal-style variable meets a condition, e.g.
+  instance.run_until(Simulation.MAX_SPEED, '<', 1.0e-3)
+the condition is tested by lammps itself (with fix halt) every check_every
+timesteps, so a long run is a few run commands of chunk_timesteps each rather
+than a trip back to python every few timesteps. Gives up after max_timesteps,
+if set. Returns the number of timesteps run."""
+    self._run_commands([_string_sub(Simulation._halt_fix, {
+      'CHECK_EVERY' : str(check_every),
+      'VARIABLE' : variable,
+      'OPERATOR' : operator,
+      'VALUE' : str(value)
+    })])
+    self.halt_applied = True
+    
+    timesteps_run = 0
+    try:
+      while max_timesteps == None or timesteps_run < max_timesteps:
+        chunk = chunk_timesteps
+        if max_timesteps != None:
+          chunk = min(chunk, max_timesteps - timesteps_run)
+        done = self._run_time_internal(chunk)
+        timesteps_run += done
+        if done < chunk:
+          break
+    finally:
+      self.halt_applied = False
+      self._run_commands(['unfix halt'])
+    
+    return timesteps_run
   
   def run_time(self, time, dont_render=False):
     """when a simulation is ready to run timesteps, call this function with the
@@ -369,29 +834,165 @@ you, although note that this MUST be a float:
       
       for i in range(frames_to_render):
         self._run_time_internal(frame_how_many)
-        self.renderer.render(self.data)
+        self._render()
       if leftover_timesteps > 0:
         self._run_time_internal(leftover_timesteps)
-        self.renderer.render(self.data)
-      
+        self._render()
+    
     else:
       if how_many <= 0:
         return
       self._run_time_internal(how_many)
   
+  @timing.timed('render')
+  def _render(self):
+    self.renderer.render(self.data)
+  
+  def _extract_lammps_arrays(self):
+    """copies the per-atom arrays out of lammps, with one ctypes slice per
+property (lammps allocates its 2d arrays as a contiguous block.) This is the
+fallback for when zero_copy is disabled."""
+    n = self.lmp.extract_global('nlocal', 0)
+    arrays = {}
+    for var, ptrtype in AtomArrays.extracts.items():
+      ptr = self.lmp.extract_atom(var, ptrtype)
+      if ptrtype == LMPDPTRPTR:
+        arrays[var] = numpy.array(ptr[0][0:3 * n]).reshape(n, 3)
+      else:
+        arrays[var] = numpy.array(ptr[0:n])
+    return arrays
+  
+  def _lammps_arrays_by_tag(self, names=None):
+    """lammps' per-atom arrays (all of them, or those named), in the order the
+particle store keeps its particles in."""
+    if names is None:
+      names = Simulation._lammps_extracts.keys()
+    
+    tags = self.data['elements'].tag
+    if not self.zero_copy and self.bulk_sync and len(tags) > 0:
+      whole = self._consecutive_tags(tags)
+      if whole or hasattr(self.lmp, 'gather_atoms_subset'):
+        by_tag = {}
+        for var in names:
+          count = 3 if Simulation._lammps_extracts[var] == LMPDPTRPTR else 1
+          # atoms lammps created itself have higher tags, so come last.
+          by_tag[var] = self._gather(var, count, None if whole else tags)[:len(tags)]
+        return by_tag
+    
+    local_indices = self._local_indices()
+    if self.zero_copy:
+      arrays = self.atoms
+    else:
+      arrays = self._extract_lammps_arrays()
+    
+    by_tag = {}
+    for var in names:
+      by_tag[var] = arrays[var] if local_indices is None else arrays[var][local_indices]
+    return by_tag
+  
   def _update_particles_from_lammps(self):
-    for e in self.data['elements']:
-      e.update_from_lammps(self.timesteps_run[-1] * self.data['params']['force_model']['timestep'])
+    """marks the particle store stale after a run - each property is read
+back from lammps only when, and if, python next touches it."""
+    self.data['elements'].mark_stale(
+      self._lammps_arrays_by_tag,
+      self.timesteps_run[-1] * self.data['params']['force_model']['timestep'],
+      self.timings
+    )
   
+  @timing.timed('write')
   def _update_lammps_from_python(self):
-    for e in self.data['elements']:
-      e.overwrite_lammps()
+    """writes the particle properties changed since the last write into lammps.
+A property which has changed for many particles is moved whole, with one
+scatter_atoms call (tags permitting); when only a few have changed, just those
+are sent with scatter_atoms_subset. Without library scatter support, the
+changes are written through the zero-copy views, or failing that the
+per-particle pointer path. With zero_copy off, the views are never written
+through: a property is sent whole if it can't be sent in part."""
+    elements = self.data['elements']
+    dirty = elements.take_dirty()
+    if len(elements) == 0 or not dirty:
+      return
+    # particles have moved (or changed) under lammps' neighbour lists.
+    self.setup_needed = True
+    
+    tags = elements.tag
+    whole = self.bulk_sync and self._consecutive_tags(tags)
+    subset = self.bulk_sync and hasattr(self.lmp, 'scatter_atoms_subset')
+    few = len(elements) * Simulation.bulk_flush_fraction
+    per_particle = set()
+    for key, rows in dirty.items():
+      if len(rows) > few:
+        rows = None
+      if not (whole or subset or self.zero_copy):
+        per_particle.update(range(len(elements)) if rows is None else rows.tolist())
+        continue
+      
+      if rows is not None and not (subset or self.zero_copy):
+        # only the whole-system scatter is left.
+        rows = None
+      name, values = elements.lammps_values(key, rows)
+      if rows is None and whole:
+        self._scatter(name, values)
+      elif subset:
+        self._scatter(name, values, tags if rows is None else tags[rows])
+      else:
+        local_indices = self._local_indices()
+        if local_indices is None:
+          local_indices = numpy.arange(len(elements))
+        self.atoms[name][local_indices if rows is None else local_indices[rows]] = values
+    
+    if per_particle:
+      self._sync_pointers([elements[i] for i in sorted(per_particle)], write_properties=True)
+  
+  # commands after which the next run can skip lammps' setup; any other
+  # (creating or deleting atoms, changing fixes...) means it must be done.
+  _setup_free_commands = ['run', 'variable', 'print', 'thermo', 'thermo_style', 'thermo_modify', 'log']
   
   def _run_commands(self, commands):
+    """sends lammps each command, timing runs as 'run' and everything else
+as 'commands'."""
     for c in commands:
       if self.show_lammps_input:
         print "INPUT>",c
-      self.lmp.command(c)
+      words = c.split(None, 1)
+      if words and words[0] not in Simulation._setup_free_commands:
+        self.setup_needed = True
+      run = len(words) > 0 and words[0] == 'run'
+      self.timings.begin('run' if run else 'commands')
+      try:
+        self.lmp.command(c)
+      finally:
+        self.timings.end()
+      if run and self.lammps_log != None:
+        self._read_lammps_timing()
+  
+  def time_lammps(self, enabled=True):
+    """has lammps' own breakdown of each run's time (pair, neighbor, comm,
+modify...) added up in instance.timings.lammps, or with enabled=False stops
+it. lammps only works the breakdown out when a run is finished off with its
+statistics (see _run_command), which costs a little, and only writes it to its
+log - a temporary file, while this is on - so it is off by default."""
+    if enabled and self.lammps_log == None:
+      descriptor, self.lammps_log = tempfile.mkstemp(prefix='pydem', suffix='.log')
+      os.close(descriptor)
+      self.lammps_log_read = 0
+      self._run_commands(['log ' + self.lammps_log])
+    elif not enabled and self.lammps_log != None:
+      self._run_commands(['log none'])
+      os.remove(self.lammps_log)
+      self.lammps_log = None
+  
+  @timing.timed('lammps_timing')
+  def _read_lammps_timing(self):
+    # reopening the log flushes what lammps has written to it.
+    self.lmp.command('log ' + self.lammps_log + ' append')
+    log = open(self.lammps_log)
+    log.seek(self.lammps_log_read)
+    text = log.read()
+    self.lammps_log_read = log.tell()
+    log.close()
+    for breakdown in timing.parse_lammps_timing(text):
+      self.timings.add_lammps(breakdown)
   
   def update_gravity(self, g):
     """allows you to change size/direction of gravity mid-simulation."""
@@ -416,9 +1017,108 @@ velocities to very low values can reduce endless vibration."""
   def close(self):
     """use this method if you want to instantiate a new simulation without
     restarting python."""
+    self.data['elements'].refresh()
+    if self.recorder != None:
+      self.recorder.close()
+    self.time_lammps(False)
     self._run_commands(['clear'])
     self.lmp = None
 
+# where a checkpoint records how far through its run it is:
+CHECKPOINT_TIMESTEPS = 'checkpoint_timesteps'
+
+def run_simulation(data, endpoint=Endpoint.EQUILIBRIUM, timestep_limit=None, equilibrium_speed=1.0e-3, check_every=100, checkpoint=None, checkpoint_every=100000):
+  """runs the system in data until the endpoint is reached:
+  Endpoint.EQUILIBRIUM - until no particle is faster than equilibrium_speed (or
+                         timestep_limit timesteps have passed, if given.)
+  Endpoint.TIMESTEP_LIMIT - for timestep_limit timesteps.
+returns (data, stats), where stats is a dict of the 'timesteps' run, the
+'wall_time' taken in seconds, the 'kinetic_energy' at the end and the
+'timings' of each phase of the run (see pydem.timing.)
+
+if checkpoint (a .snapshot filename) is given, the system is saved there every
+checkpoint_every timesteps, and if it is already there the run carries on from
+it instead of from data (which may then be None) - so a run which is killed and
+started again loses at most checkpoint_every timesteps. The caller deletes the
+checkpoint once the result is safely saved. stats['timesteps'] counts the
+timesteps run before the checkpoint as well."""
+  if endpoint == Endpoint.TIMESTEP_LIMIT and timestep_limit == None:
+    raise InvalidArgumentError("Endpoint.TIMESTEP_LIMIT needs a timestep_limit.")
+  if endpoint not in [Endpoint.EQUILIBRIUM, Endpoint.TIMESTEP_LIMIT]:
+    raise InvalidArgumentError("not a recognised endpoint.")
+  
+  start = time.time()
+  timesteps_before = 0
+  if checkpoint != None:
+    from pydem import snapshot
+    if not checkpoint.endswith(snapshot.EXTENSION):
+      checkpoint = checkpoint + snapshot.EXTENSION
+    if os.path.exists(checkpoint):
+      data = snapshot.open_snapshot(checkpoint, mmap=False)
+      timesteps_before = data['params'].json.pop(CHECKPOINT_TIMESTEPS, 0)
+  if data == None:
+    raise InvalidArgumentError("no system to run, and no checkpoint to resume from.")
+  
+  simulation = Simulation(data)
+  simulation.steps_run = timesteps_before
+  
+  remaining = None
+  if timestep_limit != None:
+    remaining = timestep_limit - timesteps_before
+  while remaining == None or remaining > 0:
+    # without a checkpoint to write, the whole run is one chunk.
+    chunk = remaining
+    if checkpoint != None and (chunk == None or chunk > checkpoint_every):
+      chunk = checkpoint_every
+    
+    if endpoint == Endpoint.EQUILIBRIUM:
+      done = simulation.run_until(Simulation.MAX_SPEED, '<', equilibrium_speed, max_timesteps=chunk, check_every=check_every)
+      if chunk == None or done < chunk:
+        break
+    else:
+      simulation.run_time(int(chunk))
+      done = chunk
+    
+    if remaining != None:
+      remaining -= done
+    if checkpoint != None and (remaining == None or remaining > 0):
+      _save_checkpoint(simulation, checkpoint)
+  
+  stats = {
+    'timesteps' : simulation.steps_run,
+    'kinetic_energy' : simulation.compute_energy(Simulation.KINETIC),
+    'timings' : simulation.timings.to_json()
+  }
+  simulation.close()
+  stats['wall_time'] = time.time() - start
+  
+  return data, stats
+
+def _save_checkpoint(simulation, filename):
+  """saves the simulation's system as a snapshot at filename, by way of a
+  temporary file, so a checkpoint is never left half written."""
+  from pydem import snapshot
+  directory, name = os.path.split(filename)
+  partial = os.path.join(directory, '.' + name)
+  params = simulation.data['params']
+  params[CHECKPOINT_TIMESTEPS] = simulation.steps_run
+  simulation.timings.begin('checkpoint')
+  try:
+    snapshot.save_snapshot(simulation.data, partial)
+  finally:
+    del params.json[CHECKPOINT_TIMESTEPS]
+    simulation.timings.end()
+  os.rename(partial, filename)
+
+def _id_list(tags):
+  """atom tags as the shortest list of 'id' and 'lo:hi' arguments accepted by
+the lammps group command."""
+  tags = numpy.unique(tags)
+  breaks = numpy.flatnonzero(numpy.diff(tags) != 1) + 1
+  starts = tags[numpy.concatenate([[0], breaks])].tolist()
+  ends = tags[numpy.concatenate([breaks - 1, [len(tags) - 1]])].tolist()
+  return [str(a) if a == b else str(a) + ':' + str(b) for a, b in zip(starts, ends)]
+
 def _string_sub(string, params):
   for key, value in params.items():
     string = string.replace(key, value)
@@ -0,0 +1,165 @@
+#
+# pydem/ensemble.py : running many independent simulations at once.
+#
+# Copyright (C) 2012  Joe Jordan
+# <joe.jordan@imperial.ac.uk>
+# <tehwalrus@h2j9k.org>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or (at
+# your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
+#
+#
+# pydem doesn't do MPI; instead, independent simulations (a parameter study,
+# say) are run side by side, each in a process of its own with its own lammps
+# instance. A fresh process per job means nothing one run does to lammps can
+# leak into the next, and a run which kills its process (lammps errors are
+# often fatal) is reported as failed rather than taking the batch down with
+# it.
+#
+# Systems are sent back to the parent as their bare columns, since a live
+# ParticleStore is tied to the simulation (and lammps) it came from.
+#
+
+import multiprocessing, traceback, Queue
+import pydem
+
+class JobFailed(Exception):
+  """what an ensemble reports for a job which raised an exception, or whose
+  process died. message holds the traceback, or the exit code."""
+  pass
+
+def default_job(job):
+  """runs a system ({'params' : ..., 'elements' : ...}) to equilibrium with
+  pydem.dem.run_simulation, returning (system, stats); or, given the inputs to
+  granular.generate_stable_pack, returns the pack it generates."""
+  if 'elements' in job:
+    from pydem import dem
+    return dem.run_simulation(job)
+  from pydem import granular
+  return granular.generate_stable_pack(job)
+
+def run_ensemble(jobs, function=default_job, processes=None):
+  """runs function(job) for every job, each in a new process, at most
+  processes (by default, one per core) at a time. yields (index, result) for
+  each job as it finishes - index being the job's position in jobs - with a
+  JobFailed as the result if the job raised or its process died, so that
+  one bad run doesn't stop the rest. e.g.
+    for k, result in run_ensemble(systems):
+      if isinstance(result, JobFailed):
+        print 'run', k, 'failed:', result
+      else:
+        system, stats = result"""
+  if processes == None:
+    processes = multiprocessing.cpu_count()
+  processes = max(1, int(processes))
+  
+  results = multiprocessing.Queue()
+  waiting = list(enumerate(jobs))
+  waiting.reverse()
+  running = {}
+  
+  try:
+    while waiting or running:
+      while waiting and len(running) < processes:
+        index, job = waiting.pop()
+        worker = multiprocessing.Process(target=_run_job, args=(function, index, job, results))
+        worker.daemon = True
+        worker.start()
+        running[index] = worker
+      
+      try:
+        index, succeeded, value = results.get(timeout=0.5)
+      except Queue.Empty:
+        # no results yet - see whether any process has died without one.
+        for index, worker in running.items():
+          if not worker.is_alive() and results.empty():
+            worker.join()
+            del running[index]
+            yield index, JobFailed("the process running job " + str(index) + " died, with exit code " + str(worker.exitcode) + ".")
+        continue
+      
+      running.pop(index).join()
+      if succeeded:
+        yield index, _restore(value)
+      else:
+        yield index, JobFailed(value)
+  finally:
+    # the caller stopped early, or something went wrong here.
+    for worker in running.values():
+      worker.terminate()
+
+def run_all(jobs, function=default_job, processes=None):
+  """as run_ensemble, but waits for every job and returns a list of their
+  results in the order the jobs were given."""
+  results = [None] * len(jobs)
+  for index, result in run_ensemble(jobs, function, processes):
+    results[index] = result
+  return results
+
+def _run_job(function, index, job, results):
+  try:
+    value = _portable(function(job))
+  except BaseException:
+    results.put((index, False, traceback.format_exc()))
+    return
+  results.put((index, True, value))
+
+def _portable(value):
+  """value, with each ParticleStore (or list of Particles) in it replaced by
+  its columns, so it can be pickled back to the parent process."""
+  if isinstance(value, tuple):
+    return tuple([_portable(v) for v in value])
+  if isinstance(value, list):
+    return [_portable(v) for v in value]
+  if isinstance(value, dict):
+    if isinstance(value.get('params'), pydem.SimulationParams) and 'elements' in value:
+      elements = value['elements']
+      if not isinstance(elements, pydem.ParticleStore):
+        elements = pydem.ParticleStore(value['params']['dimension'], [e.to_json() for e in elements])
+      elements.refresh()
+      portable = dict(value)
+      portable['params'] = value['params'].to_json()
+      portable['elements'] = _StoreColumns(elements)
+      return portable
+    return dict([(k, _portable(v)) for k, v in value.items()])
+  return value
+
+def _restore(value):
+  if isinstance(value, tuple):
+    return tuple([_restore(v) for v in value])
+  if isinstance(value, list):
+    return [_restore(v) for v in value]
+  if isinstance(value, dict):
+    if isinstance(value.get('elements'), _StoreColumns):
+      system = dict(value)
+      params_json = dict(value['params'])
+      fm_params = params_json['force_model']
+      del params_json['force_model']
+      system['params'] = pydem.SimulationParams(params_json, fm_params)
+      system['elements'] = value['elements'].store()
+      return system
+    return dict([(k, _restore(v)) for k, v in value.items()])
+  return value
+
+class _StoreColumns:
+  """the columns and extras of a ParticleStore, which (unlike the store)
+  pickle."""
+  
+  def __init__(self, store):
+    self.dimension = store.dimension
+    self.columns = dict([(name, store.columns[name][:store.count].copy()) for name in store.columns])
+    self.extras = list(store.extras)
+  
+  def store(self):
+    return pydem.ParticleStore.from_columns(self.dimension, self.columns, self.extras)
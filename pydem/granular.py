@@ -22,10 +22,14 @@
 
 import pydem as d
 import pydem.dem as l
-import random, time, math, os
+import pydem.packing as packing
+import random, time, math, os, copy
+import numpy
 
 class DepositionMethod:
   RANDOM_SPACED_SHEETS = 0
+  CONTINUOUS_POUR = 1
+  GEOMETRIC_PACK = 2
 
 class Dispersity:
   POLYDISPERSE = 0  
@@ -71,135 +75,224 @@ def rand_float(minimum, maximum):
   return minimum + scale * from_system
 
 
-def generate_element_line(options, simulation_options, existing_elements):
+def top_height(elements, dimension):
+  """the highest particle centre in elements (a ParticleStore or a list of
+  Particles), or 0.0 if there are none."""
+  if len(elements) == 0:
+    return 0.0
+  if isinstance(elements, d.ParticleStore):
+    return float(elements.column('position')[:, dimension - 1].max())
+  return max([e['position'][dimension - 1] for e in elements])
+
+def random_state(options):
+  """the numpy RandomState generators draw from: options['rng'] if one has
+been given, otherwise a new one seeded from options['seed'] (if any), which is
+then kept in options so that successive calls carry on the same sequence."""
+  if 'rng' not in options:
+    options['rng'] = numpy.random.RandomState(options.get('seed'))
+  return options['rng']
+
+def generate_rows(options, x_limit, rows):
+  """lays out the given number of rows of grains along x, each starting at 0
+and continuing, with random radii and random gaps between neighbours, for as
+long as the next grain fits inside x_limit - all rows at once. returns the
+x positions and radii of the grains, and the row each is in."""
   min_radius = options['min_radius']
   max_radius = options['max_radius']
-  
-  y_line = max_radius * 3.0
-  if len(existing_elements) > 0:
-    y_line += max([e['position'][1] for e in existing_elements])
-  
-  
-  x_limit = simulation_options['x_limit']
   gap_scale = options['separation_scaling']
-  
-  x_pos = 0.0
-  previous_radius = 0.0
-  
-  new_elements = []
-  
-  while True:
-    new_radius = rand_float(min_radius, max_radius)
-    gap_width = gap_scale * rand_float(max_radius / 5.0, max_radius)
-    
-    if (x_pos + previous_radius + (2.0 * new_radius) + gap_width) < x_limit:
-      x_pos += previous_radius + new_radius + gap_width
-      new_elements.append(d.Particle({
-        'position': [x_pos, y_line],
-        'radius': new_radius,
-        'mass' : (math.pi * new_radius ** 2)
-      }))
-      previous_radius = new_radius
-    else:
-      break
-  
-  return new_elements
+  rng = random_state(options)
+  
+  # no row can hold more than this, with every grain and gap at its smallest.
+  width = int(x_limit / (2.0 * min_radius + gap_scale * max_radius / 5.0)) + 1
+  radii = min_radius + (max_radius - min_radius) * rng.random_sample((rows, width))
+  gaps = gap_scale * (max_radius / 5.0 + (max_radius - max_radius / 5.0) * rng.random_sample((rows, width)))
+  
+  # each grain sits its own radius, the gap and its neighbour's radius along
+  # from that neighbour; a row stops at the first grain that would not fit.
+  previous = numpy.zeros((rows, width))
+  previous[:, 1:] = radii[:, :-1]
+  x = numpy.cumsum(previous + radii + gaps, axis=1)
+  fits = numpy.logical_and.accumulate(x + radii < x_limit, axis=1)
+  
+  row = numpy.repeat(numpy.arange(rows)[:, None], width, axis=1)
+  return x[fits], radii[fits], row[fits]
 
-def generate_element_sheet(options, simulation_options, existing_elements):
-  min_radius = options['min_radius']
+def generate_element_line(options, simulation_options, existing_elements, top=None):
+  """a row of grains along x, 3 max radii above the highest existing grain (or
+top, if the caller is keeping track of it.) returns a ParticleStore."""
   max_radius = options['max_radius']
+  if top is None:
+    top = top_height(existing_elements, 2)
+  
+  x, radii, row = generate_rows(options, simulation_options['x_limit'], 1)
+  positions = numpy.empty((len(x), 2))
+  positions[:, 0] = x
+  positions[:, 1] = top + max_radius * 3.0
+  
+  return d.ParticleStore.from_columns(2, {
+    'position' : positions,
+    'radius' : radii,
+    'mass' : math.pi * radii ** 2
+  })
+
+def generate_element_sheet(options, simulation_options, existing_elements, top=None):
+  """a sheet of rows of grains, 3 max radii apart in y, 3 max radii above the
+highest existing grain (or top, if the caller is keeping track of it.) returns
+a ParticleStore."""
+  max_radius = options['max_radius']
+  if top is None:
+    top = top_height(existing_elements, 3)
   
-  z_line = max_radius * 3.0
-  if len(existing_elements) > 0:
-    z_line += max([e['position'][2] for e in existing_elements])
-  
-  x_limit = simulation_options['x_limit']
+  # rows go at 1, 2, ... row separations, leaving one spare at the far side.
   row_separation = max_radius * 3.0
-  y_limit = simulation_options['y_limit']
-  gap_scale = options['separation_scaling']
-  
-  y_line = 0.0
-  previous_radius = 0.0
-  
-  new_elements = []
-  
-  while True:
-    y_line += row_separation
-    x_pos = 0.0
-    
-    if y_line + row_separation > y_limit:
-      break
-    
-    while True:
-      new_radius = rand_float(min_radius, max_radius)
-      gap_width = gap_scale * rand_float(max_radius / 5.0, max_radius)
-      
-      if (x_pos + previous_radius + (2.0 * new_radius) + gap_width) < x_limit:
-        x_pos += previous_radius + new_radius + gap_width
-        new_elements.append(d.Particle({
-          'position': [x_pos, y_line, z_line],
-          'radius': new_radius,
-          'mass' : (math.pi * new_radius ** 2)
-        }))
-        previous_radius = new_radius
-      else:
-        break
+  rows = max(0, int(simulation_options['y_limit'] / row_separation) - 1)
+  
+  x, radii, row = generate_rows(options, simulation_options['x_limit'], rows)
+  positions = numpy.empty((len(x), 3))
+  positions[:, 0] = x
+  positions[:, 1] = (row + 1) * row_separation
+  positions[:, 2] = top + max_radius * 3.0
+  
+  return d.ParticleStore.from_columns(3, {
+    'position' : positions,
+    'radius' : radii,
+    'mass' : math.pi * radii ** 2
+  })
+
+def generate_geometric_pack(options, simulation_options):
+  """fills the box, up to the height fill_criterion asks for, with a dense
+non-overlapping packing of grains built geometrically (see pydem.packing), so
+that DEM only has to let it settle under gravity. options['packing_fraction']
+sets how dense (by default 0.5 in 3D, 0.7 in 2D); random numbers come from
+random_state(options). returns a ParticleStore."""
+  dimension = simulation_options['dimension']
+  min_radius = options['min_radius']
+  max_radius = options['max_radius']
+  fraction = options.get('packing_fraction', 0.7 if dimension == 2 else 0.5)
+  rng = random_state(options)
   
-  return new_elements
+  limits = [simulation_options['x_limit'], simulation_options['y_limit']]
+  if dimension == 3:
+    limits.append(simulation_options['z_limit'])
+  upper = numpy.array(limits)
+  upper[-1] -= 4.0
+  lower = numpy.zeros(dimension)
+  
+  # how many grains of the mean volume it takes, with radii uniform between
+  # min_radius and max_radius.
+  mean_volume = packing.grain_volume(min_radius, dimension)
+  if max_radius > min_radius:
+    mean_volume = (
+      packing.grain_volume(max_radius, dimension) * max_radius -
+      packing.grain_volume(min_radius, dimension) * min_radius
+    ) / (dimension + 1) / (max_radius - min_radius)
+  count = int(fraction * numpy.prod(upper - lower) / mean_volume)
+  
+  radii = min_radius + (max_radius - min_radius) * rng.random_sample(count)
+  positions = packing.geometric_pack(radii, lower, upper, rng=rng)
+  
+  return d.ParticleStore.from_columns(dimension, {
+    'position' : positions,
+    'radius' : radii,
+    'mass' : math.pi * radii ** 2
+  })
 
-def generate_elements(options, simulation_options, existing_elements):
+def generate_elements(options, simulation_options, existing_elements, top=None):
   if options['deposition_method'] == DepositionMethod.RANDOM_SPACED_SHEETS:
     if simulation_options['dimension'] == 2:
-      return generate_element_line(options, simulation_options, existing_elements)
+      return generate_element_line(options, simulation_options, existing_elements, top)
     else:
-      return generate_element_sheet(options, simulation_options, existing_elements)
+      return generate_element_sheet(options, simulation_options, existing_elements, top)
+  elif options['deposition_method'] == DepositionMethod.GEOMETRIC_PACK:
+    if len(existing_elements) > 0:
+      raise d.InvalidArgumentError('a geometric pack fills the whole box, so cannot be added to existing elements.')
+    return generate_geometric_pack(options, simulation_options)
+  elif options['deposition_method'] == DepositionMethod.CONTINUOUS_POUR:
+    raise d.InvalidArgumentError('a continuous pour is made by lammps as it runs (see pour_elements), so has no elements to generate.')
   else:
-    raise Error('cannot use unknown deposition method.')
+    raise d.InvalidArgumentError('cannot use unknown deposition method.')
 
-def fill_criterion(data):
-  vertical = 1
+def fill_criterion(data, top=None):
   key = 'y_limit'
   if data['params']['dimension'] == 3:
-    vertical = 2
     key = 'z_limit'
-  return max([e['position'][vertical] for e in data['elements']]) + 4.0 > data['params'][key]
+  if top is None:
+    top = top_height(data['elements'], data['params']['dimension'])
+  return top + 4.0 > data['params'][key]
+
+def pour_elements(simulation, system, options):
+  """fills the box by pouring grains in continuously from a zone at the top,
+in a single lammps run, until the settled pile is as high as fill_criterion
+asks for, or options['pour_count'] grains (if given) have been poured. masses
+are set to pi r^2 afterwards, as generate_element_line/sheet make them."""
+  p = system['params']
+  dimension = p['dimension']
+  min_radius = options['min_radius']
+  max_radius = options['max_radius']
+  limits = [p['x_limit'], p['y_limit']] + ([p['z_limit']] if dimension == 3 else [])
+  top = limits[-1]
+  
+  fill_height = top - 4.0
+  zone = []
+  for limit in limits[:-1]:
+    zone.extend([max_radius, limit - max_radius])
+  zone.extend([min(fill_height, top - 3.0 * max_radius), top - max_radius])
+  
+  count = options.get('pour_count')
+  if count == None:
+    # enough to fill the whole box, tightly packed; lammps stops at fill_height.
+    box = reduce(lambda a, b: a * b, limits)
+    grain = math.pi * min_radius ** 2 if dimension == 2 else 4.0 / 3.0 * math.pi * min_radius ** 3
+    count = int(box / grain) + 1
+  
+  elements = system['elements']
+  start = len(elements)
+  simulation.pour_particles(count, min_radius, max_radius, zone, fill_height=fill_height, seed=options.get('seed', 12345))
+  
+  masses = elements.column('mass')
+  masses[start:] = math.pi * elements.column('radius')[start:] ** 2
+  elements.mark_dirty('mass', slice(start, len(elements)))
+  simulation.particles_modified()
 
 def modulus(v):
   return math.sqrt(sum([i**2 for i in v]))
 
-def run_to_equilibrium(simulation, system):
+def run_to_equilibrium(simulation, system, check_time=3.0):
   """now run to equilibrium by limiting particle velocities allow the system to
-relax."""
+relax. the speeds and energies this is judged on are reduced inside lammps, so
+no particle data comes back to python along the way."""
   vertical_key = 'y_limit'
   if system['params']['dimension'] == 3:
     vertical_key = 'z_limit'
   
+  timestep = system['params']['force_model']['timestep']
   theoretical_max_velocity = math.sqrt(2.0 * modulus(system['params']['force_model']['gravity']) * system['params'][vertical_key])
+  check_timesteps = max(1, int(check_time / timestep))
   
-  current_max_velocity = max([modulus(e['velocity']) for e in system['elements']])
-  travel_limit =  current_max_velocity / 10.0 * system['params']['force_model']['timestep']
+  travel_limit = simulation.compute_max_speed() / 10.0 * timestep
   
   # our exist condition is that the travel limit (based on the current system KE)
   # is equivalent to 10^-15 of the velocity obtained by dropping from the top of
   # the container; the max possible in the system. 
-  while travel_limit > theoretical_max_velocity * (10.0 ** -15) * system['params']['force_model']['timestep']:
+  # the limit is still set from here, between runs: fix nve/limit only takes a
+  # number, not a variable, so lammps can't move it mid-run. That is a couple
+  # of commands per limit, which is nothing next to the runs at each one.
+  while travel_limit > theoretical_max_velocity * (10.0 ** -15) * timestep:
     simulation.limit_velocities(travel_limit)
     simulation.run_time(1)
     initial_kinetic_energy = starting_kinetic_energy = simulation.compute_energy(l.Simulation.KINETIC)
     
+    # when the rate of energy loss starts slowing - less than 1% of the initial
+    # energy over check_time - drop the velocity limit more. each check is one
+    # lammps run and one energy read, with nothing else fetched.
     while True:
-      simulation.run_time(3.0)
+      simulation.run_time(check_timesteps)
       new_kinetic_energy = simulation.compute_energy(l.Simulation.KINETIC)
-      
-      # when the rate of energy loss starts slowing, drop the velocity limit more. 
       if abs(starting_kinetic_energy - new_kinetic_energy) < (initial_kinetic_energy / 100):
         break
-      
       starting_kinetic_energy = new_kinetic_energy
     
-    current_max_velocity = max([modulus(e['velocity']) for e in system['elements']])
-    
-    travel_limit =  current_max_velocity / 10.0 * system['params']['force_model']['timestep']
+    travel_limit = simulation.compute_max_speed() / 10.0 * timestep
 
 
 def generate_params(inputs=None):
@@ -260,25 +353,31 @@ def generate_stable_pack(params=None):
            defaults are there to override - there are lots, all at the top.
 this function *returns* the new system - the caller must save it to disk. 
 """
+  pour = params['element_generation_params']['deposition_method'] == DepositionMethod.CONTINUOUS_POUR
   system = {
     'params' : generate_params(params),
-    'elements' : generate_elements(params['element_generation_params'], params['simulation_params'], []) 
+    'elements' : [] if pour else generate_elements(params['element_generation_params'], params['simulation_params'], []) 
   }
   
   simulation = l.Simulation(system)
   
   start = time.clock()
-  simulation.run_time(5.0)
   
-  # fill the box
-  while not fill_criterion(system):
-    # TODO update generate call.
-    simulation.add_particles(generate_elements(params['element_generation_params'], params['simulation_params'], system['elements']))
+  # fill the box (a geometric pack is already full)
+  if pour:
+    pour_elements(simulation, system, params['element_generation_params'])
+  elif params['element_generation_params']['deposition_method'] != DepositionMethod.GEOMETRIC_PACK:
     simulation.run_time(5.0)
+    # the top of the pile is found once per round, and shared by the fill
+    # test and the generator.
+    top = top_height(system['elements'], system['params']['dimension'])
+    while not fill_criterion(system, top):
+      simulation.add_particles(generate_elements(params['element_generation_params'], params['simulation_params'], system['elements'], top))
+      simulation.run_time(5.0)
+      top = top_height(system['elements'], system['params']['dimension'])
   
-  # now allow to settle to low velocities (note the comparison is on v^2..):
-  while max([sum([val ** 2 for val in e['velocity']]) for e in system['elements']]) > 0.000001:
-    simulation.run_time(20.0)
+  # now allow to settle to low velocities (|v| < 0.001, tested by lammps):
+  simulation.run_until(l.Simulation.MAX_SPEED, '<', 0.001)
   
   run_to_equilibrium(simulation, system)
   
@@ -287,3 +386,72 @@ this function *returns* the new system - the caller must save it to disk.
   system['params']['time_to_completion'] = end - start
   
   return system
+
+def replicate_pack(seed_system, x_limit, y_limit=None, radius_jitter=0.05, seed=None, settle_timesteps=None):
+  """builds a stable pack in a wider box from a settled smaller one (as
+returned by generate_stable_pack or open_system): copies of seed_system are laid
+side by side - along x, and in 3D along y too - to cover x_limit (and y_limit),
+cut off at the far walls, then each grain's radius is shrunk by a random
+fraction of up to radius_jitter so that the copies are no longer identical.
+Shrinking opens gaps rather than making overlaps, so the new pack only needs a
+short settle and run_to_equilibrium, rather than being filled and settled from
+nothing. settle_timesteps caps the settle. returns the new system."""
+  start = time.clock()
+  
+  old_params = seed_system['params']
+  dimension = old_params['dimension']
+  elements = seed_system['elements']
+  if not isinstance(elements, d.ParticleStore):
+    elements = d.ParticleStore(dimension, [e.to_json() for e in elements])
+  if y_limit == None or dimension == 2:
+    y_limit = old_params['y_limit']
+  
+  # the copies needed along each lateral axis, and where each one starts.
+  old_limits = [old_params['x_limit'], old_params['y_limit']]
+  new_limits = [x_limit, y_limit]
+  lateral = 1 if dimension == 2 else 2
+  counts = [int(math.ceil(new_limits[a] / old_limits[a])) for a in range(lateral)]
+  offsets = numpy.zeros((numpy.prod(counts), dimension))
+  for a, tile in enumerate(numpy.indices(counts).reshape(lateral, -1)):
+    offsets[:, a] = tile * old_limits[a]
+  
+  positions = (elements.column('position')[None, :, :] + offsets[:, None, :]).reshape(-1, dimension)
+  radii = numpy.tile(elements.column('radius'), len(offsets))
+  masses = numpy.tile(elements.column('mass'), len(offsets))
+  inside = numpy.ones(len(positions), dtype=bool)
+  for a in range(lateral):
+    inside &= positions[:, a] + radii <= new_limits[a]
+  positions = positions[inside]
+  radii = radii[inside]
+  masses = masses[inside]
+  
+  rng = numpy.random.RandomState(seed)
+  force_model = old_params['force_model']
+  smallest = force_model.json.get('min_radius', 0.0)
+  jittered = numpy.maximum(radii * (1.0 - radius_jitter * rng.random_sample(len(radii))), numpy.minimum(smallest, radii))
+  # masses go as r^2, as everywhere else in this module.
+  masses = masses * (jittered / radii) ** 2
+  
+  params_json = dict(old_params.json)
+  params_json.pop('time_to_completion', None)
+  params_json['x_limit'] = x_limit
+  params_json['y_limit'] = y_limit
+  params_json['max_particles_guess'] = len(positions)
+  params_json['force_model'] = d.ForceModel(copy.deepcopy(force_model.to_json()))
+  
+  system = {
+    'params' : d.SimulationParams(params_json),
+    'elements' : d.ParticleStore.from_columns(dimension, {
+      'position' : positions,
+      'radius' : jittered,
+      'mass' : masses
+    })
+  }
+  
+  simulation = l.Simulation(system)
+  simulation.run_until(l.Simulation.MAX_SPEED, '<', 0.001, max_timesteps=settle_timesteps)
+  run_to_equilibrium(simulation, system)
+  
+  system['params']['time_to_completion'] = time.clock() - start
+  
+  return system
@@ -0,0 +1,218 @@
+#
+# pydem/json_stream.py : incremental loading of .json.gz system files.
+#
+# Copyright (C) 2012  Joe Jordan
+# <joe.jordan@imperial.ac.uk>
+# <tehwalrus@h2j9k.org>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or (at
+# your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
+#
+#
+# A saved system is one json object, {"params" : {...}, "elements" : [...]},
+# with the keys in either order. Rather than decompressing and decoding the
+# whole thing at once, the file is read a chunk at a time and the elements in
+# each chunk are decoded and copied straight into a ParticleStore, so only the
+# store itself (and a chunk or so of text) is ever held in memory.
+#
+
+import gzip, re
+import cjson
+import pydem
+
+# elements are decoded a buffer-full at a time with cjson, the fastest codec we
+# have, but that needs the text cut at a boundary between elements. Where that
+# can't be done, values are decoded one at a time with raw_decode(string,
+# index), which decodes the value starting at index and says where it ended;
+# simplejson's C scanner is the fastest of those offering it, and the standard
+# library's is the fallback.
+try:
+  import simplejson as _json
+  from simplejson import _speedups
+except ImportError:
+  import json as _json
+
+_decoder = _json.JSONDecoder()
+_whitespace = re.compile(r'[ \t\n\r]*')
+
+chunk_size = 1 << 20
+batch_size = 4096
+
+def _as_cjson(value):
+  """value, with its strings as cjson would have decoded them: str where they
+  are plain ascii, unicode otherwise. (raw_decode makes every string unicode.)"""
+  if isinstance(value, unicode):
+    try:
+      return value.encode('ascii')
+    except UnicodeEncodeError:
+      return value
+  if isinstance(value, dict):
+    return dict([(_as_cjson(k), _as_cjson(v)) for k, v in value.items()])
+  if isinstance(value, list):
+    return [_as_cjson(v) for v in value]
+  return value
+
+class _Reader:
+  """the decompressed text of a file, read in as it is consumed."""
+  
+  def __init__(self, json_file):
+    self.json_file = json_file
+    self.text = ''
+    self.position = 0
+    self.finished = False
+    # legacy files used ' instead of ". Each chunk is translated as it is read,
+    # rather than copying the whole text.
+    self.legacy_quotes = False
+    self.cut_failed = False
+  
+  def _read_more(self):
+    if self.finished:
+      return False
+    chunk = self.json_file.read(chunk_size)
+    if not chunk:
+      self.finished = True
+      return False
+    if self.legacy_quotes or chunk.find('\'') != -1:
+      self.legacy_quotes = True
+      chunk = chunk.replace('\'', '\"')
+    # drop what has already been consumed before growing the buffer.
+    self.text = self.text[self.position:] + chunk
+    self.position = 0
+    self.cut_failed = False
+    return True
+  
+  def next_character(self):
+    """skips whitespace, and returns (without consuming) the next character."""
+    while True:
+      self.position = _whitespace.match(self.text, self.position).end()
+      if self.position < len(self.text):
+        return self.text[self.position]
+      if not self._read_more():
+        raise pydem.InvalidArgumentError("unexpected end of system file.")
+  
+  def expect(self, characters):
+    c = self.next_character()
+    if c not in characters:
+      raise pydem.InvalidArgumentError("malformed system file: expected one of '" + characters + "', found '" + c + "'.")
+    self.position += 1
+    return c
+  
+  def value(self):
+    """decodes the json value at the current position. Values here are always
+    objects, arrays or strings, so a decode that fails part way through the
+    buffer only means more of the file is needed."""
+    self.next_character()
+    while True:
+      try:
+        value, end = _decoder.raw_decode(self.text, self.position)
+      except ValueError:
+        if not self._read_more():
+          raise
+        continue
+      self.position = end
+      return _as_cjson(value)
+  
+  def objects(self):
+    """decodes every whole object left in the buffer, from the current position
+    inside an array, in one go - or returns [] if it can't. The text is cut
+    at the last '}' in the buffer; if that is inside a string or a nested
+    object rather than at the end of an element the cut text is not valid
+    json, so a successful decode means the cut was in the right place."""
+    if self.cut_failed or self.next_character() != '{':
+      return []
+    end = self.text.rfind('}', self.position)
+    if end == -1:
+      return []
+    try:
+      values = cjson.decode('[' + self.text[self.position:end + 1] + ']')
+    except cjson.DecodeError:
+      # don't try again until there is more text to try on.
+      self.cut_failed = True
+      return []
+    self.position = end + 1
+    return values
+
+def open_json_system(filename):
+  """opens a gzipped json system file as open_system does, without ever
+  holding the whole file (or all the decoded elements) in memory."""
+  json_file = gzip.open(filename, 'rb')
+  try:
+    reader = _Reader(json_file)
+    params = None
+    store = None
+    
+    reader.expect('{')
+    if reader.next_character() == '}':
+      raise pydem.InvalidArgumentError("system file '" + filename + "' is empty.")
+    while True:
+      key = reader.value()
+      reader.expect(':')
+      if key == 'elements':
+        store = _read_elements(reader, params)
+      else:
+        value = reader.value()
+        if key == 'params':
+          fm_params = value['force_model']
+          del value['force_model']
+          params = pydem.SimulationParams(value, fm_params)
+      if reader.expect(',}') == '}':
+        break
+  finally:
+    json_file.close()
+  
+  if params is None:
+    raise pydem.InvalidArgumentError("system file '" + filename + "' has no params.")
+  if store is None:
+    store = pydem.ParticleStore(params['dimension'])
+  return {
+    'params' : params,
+    'elements' : store
+  }
+
+def _read_elements(reader, params):
+  """decodes the elements array, batch by batch, into a new ParticleStore. If
+  the params have not been read yet, the dimension comes from the first
+  particle's position."""
+  reader.expect('[')
+  store = None
+  if params is not None:
+    store = pydem.ParticleStore(params['dimension'])
+  
+  batch = []
+  if reader.next_character() == ']':
+    reader.position += 1
+    return store
+  while True:
+    values = reader.objects()
+    if values:
+      batch.extend(values)
+    else:
+      batch.append(reader.value())
+    if len(batch) >= batch_size:
+      store = _flush(store, batch)
+      batch = []
+    if reader.expect(',]') == ']':
+      break
+  return _flush(store, batch)
+
+def _flush(store, batch):
+  if store is None:
+    if not batch:
+      return store
+    try:
+      store = pydem.ParticleStore(len(batch[0]['position']))
+    except KeyError, e:
+      raise pydem.InvalidArgumentError("Compulsory property '" + e.args[0] + "' was not specified.")
+  store.extend(batch)
+  return store
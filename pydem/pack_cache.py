@@ -0,0 +1,226 @@
+#
+# pydem/pack_cache.py : an on-disk cache of generated stable packs.
+#
+# Copyright (C) 2012  Joe Jordan
+# <joe.jordan@imperial.ac.uk>
+# <tehwalrus@h2j9k.org>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or (at
+# your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
+#
+#
+# Each pack is stored as a snapshot (see snapshot.py) named by the sha1 of its
+# inputs, in canonical json: the resolved SimulationParams (force model
+# constants included), the element generation options and the seed. So two
+# jobs asking for the same pack share one file, however the inputs were spelt.
+#
+# Several processes may use one cache directory at once. A pack is written to
+# a temporary file and renamed into place, so readers never see half of one;
+# a process generating a pack holds a lock on its key (an empty .lock file)
+# so others asking for the same pack wait for it rather than generating it
+# again; and eviction is done under a lock on the whole directory. A key's lock
+# file goes when its pack does, once no one holds it, so a process which finds
+# it has locked a file since deleted locks the new one instead. A pack's modification time is its last use, and the least
+# recently used are evicted first.
+#
+
+import copy, fcntl, hashlib, json, os, tempfile
+import pydem
+import pydem.granular as granular
+from pydem import snapshot
+
+# bump this when a change to pack generation makes old packs wrong.
+KEY_VERSION = 1
+
+LOCK_EXTENSION = '.lock'
+
+class PackCache:
+  """a directory of generated stable packs, used as
+    cache = PackCache('/scratch/packs', max_bytes=10 * 2 ** 30)
+    system = cache.stable_pack(params)
+  where params are the inputs to granular.generate_stable_pack. A pack is
+  generated (and kept) the first time it is asked for, and opened from disk
+  after that; once the packs kept take up more than max_bytes (if given), the
+  least recently used are deleted.
+  
+  packs are only as reproducible as their inputs - params without a seed in
+  element_generation_params name 'any pack with these params', so every job
+  asking for one gets the same pack."""
+  
+  def __init__(self, directory, max_bytes=None):
+    self.directory = directory
+    self.max_bytes = max_bytes
+    if not os.path.isdir(directory):
+      try:
+        os.makedirs(directory)
+      except OSError:
+        # another process made it first.
+        if not os.path.isdir(directory):
+          raise
+  
+  def key(self, params):
+    """the name a pack generated from params is kept under."""
+    generation = params['element_generation_params']
+    if 'rng' in generation:
+      raise pydem.InvalidArgumentError("a cached pack needs a seed in element_generation_params, not an rng.")
+    
+    resolved = granular.generate_params(copy.deepcopy(params))
+    canonical = json.dumps({
+      'version' : KEY_VERSION,
+      'params' : resolved.to_json(),
+      'element_generation_params' : generation,
+      'seed' : generation.get('seed')
+    }, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha1(canonical).hexdigest()
+  
+  def path(self, key):
+    return os.path.join(self.directory, key + snapshot.EXTENSION)
+  
+  def stable_pack(self, params):
+    """the pack generate_stable_pack(params) would make, opened from the cache
+    - once it has been generated and kept there, if it wasn't already."""
+    key = self.key(params)
+    system = self._open(key)
+    if system is not None:
+      return system
+    
+    lock = self._lock(key + LOCK_EXTENSION)
+    try:
+      # someone else may have made it while we waited for the lock.
+      system = self._open(key)
+      if system is not None:
+        return system
+      self._store(key, granular.generate_stable_pack(copy.deepcopy(params)))
+      # handed back as a hit would be, rather than as generated.
+      system = self._open(key)
+    finally:
+      self._unlock(lock)
+    
+    self.evict(keep=key)
+    return system
+  
+  def __contains__(self, params):
+    return os.path.exists(self.path(self.key(params)))
+  
+  def entries(self):
+    """(path, bytes, last used) for every pack in the cache, least recently
+    used first."""
+    entries = []
+    for name in os.listdir(self.directory):
+      if not name.endswith(snapshot.EXTENSION) or name.startswith('.'):
+        continue
+      path = os.path.join(self.directory, name)
+      try:
+        stat = os.stat(path)
+      except OSError:
+        # evicted by another process since listdir.
+        continue
+      entries.append((path, stat.st_size, stat.st_mtime))
+    entries.sort(key=lambda e: e[2])
+    return entries
+  
+  def evict(self, keep=None):
+    """deletes the least recently used packs until the rest fit in max_bytes.
+    The pack named keep is never deleted."""
+    if self.max_bytes is None:
+      return
+    lock = self._lock('.evict.lock')
+    try:
+      entries = self.entries()
+      total = sum([e[1] for e in entries])
+      for path, size, used in entries:
+        if total <= self.max_bytes:
+          break
+        if keep is not None and path == self.path(keep):
+          continue
+        try:
+          os.remove(path)
+        except OSError:
+          pass
+        total -= size
+      self._remove_locks()
+    finally:
+      self._unlock(lock)
+  
+  def clear(self):
+    for path, size, used in self.entries():
+      try:
+        os.remove(path)
+      except OSError:
+        pass
+    self._remove_locks()
+  
+  def _remove_locks(self):
+    """deletes the lock files of packs which aren't in the cache, skipping any
+    which someone holds (they are generating the pack.)"""
+    for name in os.listdir(self.directory):
+      if not name.endswith(LOCK_EXTENSION) or name.startswith('.'):
+        continue
+      path = os.path.join(self.directory, name)
+      lock = self._lock(name, wait=False)
+      if lock is None:
+        continue
+      try:
+        if not os.path.exists(self.path(name[:-len(LOCK_EXTENSION)])):
+          os.remove(path)
+      except OSError:
+        pass
+      finally:
+        self._unlock(lock)
+  
+  def _open(self, key):
+    path = self.path(key)
+    try:
+      # mark it used, for eviction. This fails if the pack isn't there.
+      os.utime(path, None)
+      # the columns are memory mapped, which keeps them readable even if
+      # another process evicts the file.
+      return snapshot.open_snapshot(path)
+    except (OSError, IOError):
+      return None
+  
+  def _store(self, key, system):
+    descriptor, temporary = tempfile.mkstemp(prefix='.' + key, suffix=snapshot.EXTENSION, dir=self.directory)
+    os.close(descriptor)
+    try:
+      snapshot.save_snapshot(system, temporary)
+      os.rename(temporary, self.path(key))
+    except:
+      os.remove(temporary)
+      raise
+  
+  def _lock(self, name, wait=True):
+    """locks the file name in the cache directory, creating it if need be.
+    Without wait, returns None if someone else holds it."""
+    path = os.path.join(self.directory, name)
+    while True:
+      lock = open(path, 'a')
+      try:
+        fcntl.flock(lock.fileno(), fcntl.LOCK_EX if wait else fcntl.LOCK_EX | fcntl.LOCK_NB)
+      except IOError:
+        lock.close()
+        if wait:
+          raise
+        return None
+      try:
+        # the file may have been deleted (see _remove_locks) while we waited.
+        if os.fstat(lock.fileno()).st_ino == os.stat(path).st_ino:
+          return lock
+      except OSError:
+        pass
+      self._unlock(lock)
+  
+  def _unlock(self, lock):
+    fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
+    lock.close()
@@ -0,0 +1,179 @@
+#
+# pydem/packing.py : geometric (DEM-free) construction of dense packings.
+#
+# Copyright (C) 2012  Joe Jordan
+# <joe.jordan@imperial.ac.uk>
+# <tehwalrus@h2j9k.org>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or (at
+# your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
+#
+#
+# Grains start on a jittered lattice, spaced for the packing fraction asked
+# for, so neighbours overlap a little; repeated relaxation passes then push
+# each overlapping pair apart along the line between their centres until no
+# overlap is left. Pairs are found with a spatial hash - a grid of cells no
+# smaller than the largest grain - so each pass is O(N), and everything is done
+# in whole-array numpy operations.
+#
+
+import itertools, math
+import numpy
+import pydem
+
+def cell_pairs(positions, cell_size, lower, upper):
+  """every pair (i, j), i < j, of points in the same or neighbouring cells of a
+  grid of cell_size cells over the box lower..upper - a superset of the pairs
+  closer than cell_size. returns two index arrays."""
+  n, dimension = positions.shape
+  cells = numpy.maximum(1, numpy.floor((upper - lower) / cell_size).astype(numpy.int64))
+  coords = numpy.floor((positions - lower) / ((upper - lower) / cells)).astype(numpy.int64)
+  coords = numpy.clip(coords, 0, cells - 1)
+  cell_id = numpy.ravel_multi_index(coords.T, cells)
+  
+  order = numpy.argsort(cell_id, kind='mergesort')
+  sorted_coords = coords[order]
+  counts = numpy.bincount(cell_id, minlength=int(numpy.prod(cells)))
+  starts = numpy.cumsum(counts) - counts
+  
+  first = []
+  second = []
+  for offset in _half_shell(dimension):
+    neighbour = sorted_coords + offset
+    valid = numpy.all((neighbour >= 0) & (neighbour < cells), axis=1)
+    neighbour_id = numpy.ravel_multi_index(numpy.where(valid[:, None], neighbour, 0).T, cells)
+    k = numpy.where(valid, counts[neighbour_id], 0)
+    
+    # pair each (sorted) point with every point in its neighbouring cell.
+    i = numpy.repeat(numpy.arange(n), k)
+    within = numpy.arange(k.sum()) - numpy.repeat(numpy.cumsum(k) - k, k)
+    j = numpy.repeat(starts[neighbour_id], k) + within
+    if not any(offset):
+      keep = j > i
+      i = i[keep]
+      j = j[keep]
+    first.append(order[i])
+    second.append(order[j])
+  
+  return numpy.concatenate(first), numpy.concatenate(second)
+
+def _half_shell(dimension):
+  """the cell offsets to look at so that each neighbouring pair of cells is
+  visited once: the cell itself, and half of the rest."""
+  offsets = []
+  for offset in itertools.product([-1, 0, 1], repeat=dimension):
+    if offset > tuple([0] * dimension) or not any(offset):
+      offsets.append(numpy.array(offset))
+  return offsets
+
+def near_pairs(positions, radii, skin, lower, upper):
+  """the pairs of spheres (or discs) less than skin apart, from cell_pairs."""
+  i, j = cell_pairs(positions, 2.0 * radii.max() + skin, lower, upper)
+  separation = positions[j] - positions[i]
+  near = (separation ** 2).sum(axis=1) < (radii[i] + radii[j] + skin) ** 2
+  return i[near], j[near]
+
+def relax_overlaps(positions, radii, lower, upper, tolerance, max_passes=1000):
+  """moves the spheres (or discs) apart, in place, until no pair overlaps by
+  more than tolerance and all lie inside lower..upper. returns the largest
+  overlap left.
+  
+  the pairs near enough to touch are found again only when some grain has
+  moved half the skin distance since they were last found, and no grain may
+  move more than a fraction of the skin in one pass, so the search is rarely
+  repeated."""
+  n, dimension = positions.shape
+  skin = 0.8 * radii.max()
+  step_limit = 0.15 * radii.max()
+  anchor = None
+  
+  worst = 0.0
+  for p in range(max_passes):
+    if anchor is None or ((positions - anchor) ** 2).sum(axis=1).max() > (0.5 * skin) ** 2:
+      i, j = near_pairs(positions, radii, skin, lower, upper)
+      anchor = positions.copy()
+    
+    separation = positions[j] - positions[i]
+    distance = numpy.sqrt((separation ** 2).sum(axis=1))
+    overlap = radii[i] + radii[j] - distance
+    touching = overlap > 0.0
+    worst = overlap[touching].max() if touching.any() else 0.0
+    if worst <= tolerance:
+      break
+    
+    si = i[touching]
+    sj = j[touching]
+    separation = separation[touching]
+    distance = distance[touching]
+    coincident = distance == 0.0
+    if coincident.any():
+      separation[coincident, 0] = 1.0
+      distance[coincident] = 1.0
+    # each grain of a pair takes half the overlap (and a little more, so the
+    # last sliver doesn't take forever to go.)
+    push = (0.5 * overlap[touching] + 0.25 * tolerance) / distance
+    push = separation * push[:, None]
+    move = numpy.zeros_like(positions)
+    for axis in range(dimension):
+      move[:, axis] = numpy.bincount(sj, push[:, axis], minlength=n) - numpy.bincount(si, push[:, axis], minlength=n)
+    
+    length = numpy.sqrt((move ** 2).sum(axis=1))
+    too_far = length > step_limit
+    move[too_far] *= (step_limit / length[too_far])[:, None]
+    positions += move
+    numpy.clip(positions, lower + radii[:, None], upper - radii[:, None], out=positions)
+  
+  return worst
+
+def lattice_pack(radii, lower, upper, rng):
+  """positions for the given grains on a jittered lattice filling lower..upper,
+  taken in a random order. The lattice has at least as many sites as grains."""
+  dimension = len(lower)
+  size = upper - lower
+  spacing = (numpy.prod(size) / len(radii)) ** (1.0 / dimension)
+  sites = numpy.maximum(1, numpy.floor(size / spacing).astype(numpy.int64))
+  while numpy.prod(sites) < len(radii):
+    sites[numpy.argmin(size / sites)] += 1
+  step = size / sites
+  
+  chosen = rng.permutation(int(numpy.prod(sites)))[:len(radii)]
+  coords = numpy.array(numpy.unravel_index(chosen, sites)).T
+  jitter = (rng.random_sample(coords.shape) - 0.5) * 0.1 * step
+  return lower + (coords + 0.5) * step + jitter
+
+def geometric_pack(radii, lower, upper, tolerance=None, rng=None, max_passes=1000):
+  """places the grains of the given radii, without overlaps (to within
+  tolerance, by default a hundredth of the smallest radius), in the box
+  lower..upper. returns an (N, dimension) array of positions. Raises
+  InvalidArgumentError if the grains can't be separated in max_passes - usually
+  because they take up too much of the box."""
+  lower = numpy.asarray(lower, dtype=float)
+  upper = numpy.asarray(upper, dtype=float)
+  if rng is None:
+    rng = numpy.random.RandomState()
+  if tolerance is None:
+    tolerance = 0.01 * radii.min()
+  
+  positions = lattice_pack(radii, lower, upper, rng)
+  worst = relax_overlaps(positions, radii, lower, upper, tolerance, max_passes=max_passes)
+  if worst > tolerance:
+    fraction = grain_volume(radii, len(lower)).sum() / numpy.prod(upper - lower)
+    raise pydem.InvalidArgumentError("could not separate the grains: after %d passes, they still overlap by up to %g (tolerance %g). They fill %.3g of the box; use a bigger box or fewer grains." % (max_passes, worst, tolerance, fraction))
+  return positions
+
+def grain_volume(radii, dimension):
+  """the volume (in 2D, area) of grains of the given radii."""
+  if dimension == 2:
+    return math.pi * radii ** 2
+  return 4.0 / 3.0 * math.pi * radii ** 3
@@ -0,0 +1,264 @@
+#
+# pydem/raster.py : headless rendering of systems and trajectories to PNG.
+#
+# Copyright (C) 2012  Joe Jordan
+# <joe.jordan@imperial.ac.uk>
+# <tehwalrus@h2j9k.org>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or (at
+# your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
+#
+#
+# Frames are drawn like simple_visualiser's - each grain an outline, black or
+# (if 'different') red, with a line from its centre showing its angle - but
+# without pygame or a display, so they can be made on compute nodes. Rather
+# than drawing circle by circle, grains are grouped by their radius in pixels;
+# each group shares one stencil of pixel offsets, and every grain in it is
+# stamped onto the image with a single indexed assignment.
+#
+# In 3D a frame is a set of slices across the slice axis (z, by default): each
+# shows the circles where the spheres crossing it are cut by that plane.
+#
+
+import math, multiprocessing, struct, zlib
+import numpy
+import pydem
+
+_white = numpy.array([255, 255, 255], dtype=numpy.uint8)
+_black = numpy.array([0, 0, 0], dtype=numpy.uint8)
+_red = numpy.array([255, 0, 0], dtype=numpy.uint8)
+
+# how many pixels to index at once.
+_chunk_pixels = 1 << 22
+
+def write_png(filename, image, compression_level=6):
+  """writes an (height, width, 3) uint8 array as an RGB PNG."""
+  height, width = image.shape[:2]
+  rows = numpy.zeros((height, width * 3 + 1), dtype=numpy.uint8)
+  rows[:, 1:] = image.reshape(height, width * 3)
+  
+  def chunk(kind, body):
+    return struct.pack('>I', len(body)) + kind + body + struct.pack('>I', zlib.crc32(kind + body) & 0xffffffff)
+  
+  png = open(filename, 'wb')
+  png.write('\x89PNG\r\n\x1a\n')
+  png.write(chunk('IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)))
+  png.write(chunk('IDAT', zlib.compress(rows.tostring(), compression_level)))
+  png.write(chunk('IEND', ''))
+  png.close()
+
+def _ring(radius):
+  """pixel offsets (dx, dy) of a one pixel wide circle of the given radius."""
+  span = numpy.arange(-radius, radius + 1)
+  dx, dy = numpy.meshgrid(span, span)
+  distance = numpy.sqrt(dx ** 2 + dy ** 2)
+  on = (distance <= radius + 0.5) & (distance > radius - 0.5)
+  return dx[on], dy[on]
+
+class Rasteriser:
+  """draws systems (or trajectory frames) into numpy images, e.g.
+    rasteriser = Rasteriser(data['params'], pixel_density=10)
+    rasteriser.save(data, 'frame00001')   # => frame00001.png
+  pixel_density is pixels per unit length. zoom, as for SimulationRenderer, is
+  {'x' : left, 'y' : top, 'width' : width shown}. In 3D, slices is how many
+  evenly spaced slices to cut (or a list of where to cut them) across
+  slice_axis; each is saved as its own file, name_slice00.png etc."""
+  
+  def __init__(self, params, pixel_density=10, zoom=None, slices=5, slice_axis=2):
+    self.dimension = params['dimension']
+    self.pixel_density = pixel_density
+    self.zoom = zoom
+    
+    limits = [params['x_limit'], params['y_limit']]
+    if self.dimension == 3:
+      limits.append(params['z_limit'])
+    if self.dimension == 2:
+      self.axes = [0, 1]
+      self.slice_axis = None
+      self.slices = [None]
+    else:
+      self.axes = [a for a in range(3) if a != slice_axis]
+      self.slice_axis = slice_axis
+      if isinstance(slices, (int, long)):
+        depth = limits[slice_axis]
+        self.slices = [depth * (k + 0.5) / slices for k in range(slices)]
+      else:
+        self.slices = list(slices)
+    self.limits = [limits[a] for a in self.axes]
+    
+    self.scale = float(pixel_density)
+    self.offset = [0.0, 0.0]
+    if zoom != None:
+      self.scale *= self.limits[0] / zoom['width']
+      self.offset = [zoom['x'], zoom['y']]
+    self.width = pixel_density * int(math.ceil(self.limits[0]))
+    self.height = pixel_density * int(math.ceil(self.limits[1]))
+    self.stencils = {}
+  
+  def _stencil(self, radius):
+    if radius not in self.stencils:
+      self.stencils[radius] = _ring(radius)
+    return self.stencils[radius]
+  
+  def draw(self, positions, radii, thetas=None, different=None, depth=None):
+    """an image of the grains with the given (N, dimension) positions, radii,
+    angles and 'different' flags; in 3D, of the slice at depth."""
+    image = numpy.empty((self.height, self.width, 3), dtype=numpy.uint8)
+    image[:] = _white
+    positions = numpy.asarray(positions, dtype=float)
+    radii = numpy.asarray(radii, dtype=float)
+    colours = numpy.zeros(len(radii), dtype=numpy.int64)
+    if different is not None:
+      colours[numpy.asarray(different, dtype=bool)] = 1
+    
+    if depth != None:
+      # the circle each sphere makes where the plane cuts it; angles are only
+      # drawn in 2D.
+      gap = positions[:, self.slice_axis] - depth
+      cut = numpy.abs(gap) < radii
+      positions = positions[cut]
+      radii = numpy.sqrt(radii[cut] ** 2 - gap[cut] ** 2)
+      colours = colours[cut]
+      thetas = None
+    if len(radii) == 0:
+      return image
+    
+    # note, y coords on screen are upside down.
+    x = (positions[:, self.axes[0]] - self.offset[0]) * self.scale
+    y = ((self.limits[1] - positions[:, self.axes[1]]) - self.offset[1]) * self.scale
+    r = radii * self.scale
+    xs = numpy.round(x).astype(numpy.int64)
+    ys = numpy.round(y).astype(numpy.int64)
+    rs = numpy.maximum(0, numpy.round(r).astype(numpy.int64))
+    
+    pixels = image.reshape(-1, 3)
+    palette = numpy.array([_black, _red])
+    for radius in numpy.unique(rs).tolist():
+      group = numpy.nonzero(rs == radius)[0]
+      dx, dy = self._stencil(radius)
+      self._stamp(pixels, xs[group], ys[group], colours[group], dx, dy, palette)
+    
+    if thetas is not None:
+      # each line is drawn as points a pixel apart, from the centre out.
+      thetas = numpy.asarray(thetas, dtype=float)
+      length = max(1, int(rs.max()))
+      t = numpy.arange(length + 1) / float(length)
+      step = max(1, _chunk_pixels // (length + 1))
+      for start in range(0, len(rs), step):
+        end = start + step
+        reach = r[start:end, None] * t[None, :]
+        px = numpy.round(x[start:end, None] + reach * numpy.cos(thetas[start:end, None])).astype(numpy.int64)
+        py = numpy.round(y[start:end, None] + reach * numpy.sin(thetas[start:end, None])).astype(numpy.int64)
+        self._put(pixels, px, py, numpy.repeat(colours[start:end, None], length + 1, axis=1), palette)
+    
+    return image
+  
+  def _stamp(self, pixels, xs, ys, colours, dx, dy, palette):
+    """draws the stencil (dx, dy) at every (x, y), a chunk of grains at a time
+    so as not to build enormous index arrays."""
+    step = max(1, _chunk_pixels // max(1, len(dx)))
+    for start in range(0, len(xs), step):
+      end = start + step
+      px = xs[start:end, None] + dx[None, :]
+      py = ys[start:end, None] + dy[None, :]
+      self._put(pixels, px, py, numpy.repeat(colours[start:end, None], len(dx), axis=1), palette)
+  
+  def _put(self, pixels, px, py, colours, palette):
+    inside = (px >= 0) & (px < self.width) & (py >= 0) & (py < self.height)
+    pixels[(py * self.width + px)[inside]] = palette[colours[inside]]
+  
+  def images(self, positions, radii, thetas=None, different=None):
+    """one image per slice (just the one, in 2D)."""
+    return [self.draw(positions, radii, thetas, different, depth) for depth in self.slices]
+  
+  def save(self, data, name):
+    """rasterises a system and saves it as name.png (or, in 3D, a file per
+    slice), returning the filenames written."""
+    elements = data['elements']
+    if not isinstance(elements, pydem.ParticleStore):
+      elements = pydem.ParticleStore(self.dimension, [e.to_json() for e in elements])
+    different = numpy.array([bool(e is not None and e.get('different', False)) for e in elements.extras], dtype=bool)
+    return self.save_columns(name, elements.column('position'), elements.column('radius'), elements.column('theta'), different)
+  
+  def save_columns(self, name, positions, radii, thetas=None, different=None):
+    filenames = []
+    for k, image in enumerate(self.images(positions, radii, thetas, different)):
+      filename = name + '.png'
+      if self.slice_axis != None:
+        filename = name + '_slice%02d.png' % k
+      write_png(filename, image)
+      filenames.append(filename)
+    return filenames
+
+
+class PNGRenderer:
+  """a renderer for Simulation (instance.renderer = PNGRenderer(...)) which
+  saves each frame to a numbered PNG file rather than showing it - so, unlike
+  SimulationRenderer, it needs no display, and any number can be used at
+  once. name_pattern is a filename, without .png, with a %d for the frame
+  number; options are passed on to Rasteriser."""
+  
+  def __init__(self, data, name_pattern='frame%05d', frame_time=0.1, **options):
+    self.name_pattern = name_pattern
+    self.frame_time = frame_time
+    self.rasteriser = Rasteriser(data['params'], **options)
+    self.frames_written = 0
+    self.render(data)
+  
+  def render(self, data):
+    self.rasteriser.save(data, self.name_pattern % self.frames_written)
+    self.frames_written += 1
+
+
+def render_trajectory(filename, name_pattern='frame%05d', frames=None, processes=None, **options):
+  """renders frames of a trajectory file (see pydem.trajectory) to PNG files,
+  name_pattern % k for frame k, in parallel worker processes - by default one
+  per core. frames is a list of frame indices (by default, all of them);
+  options are passed on to Rasteriser. returns the filenames written."""
+  from pydem.trajectory import Trajectory
+  trajectory = Trajectory(filename)
+  if frames == None:
+    frames = range(len(trajectory))
+  trajectory.close()
+  
+  pool = multiprocessing.Pool(processes, _start_worker, (filename, options))
+  try:
+    written = []
+    jobs = [(k, name_pattern % k) for k in frames]
+    for filenames in pool.imap_unordered(_render_frame, jobs, chunksize=max(1, len(jobs) // (8 * multiprocessing.cpu_count()))):
+      written.extend(filenames)
+    pool.close()
+  except:
+    pool.terminate()
+    raise
+  finally:
+    pool.join()
+  return sorted(written)
+
+# each worker's own trajectory (memory mapped, so frames are only read as they
+# are rendered) and rasteriser.
+_worker = {}
+
+def _start_worker(filename, options):
+  from pydem.trajectory import Trajectory
+  _worker['trajectory'] = Trajectory(filename)
+  _worker['rasteriser'] = Rasteriser(_worker['trajectory'].params, **options)
+
+def _render_frame(job):
+  k, name = job
+  frame = _worker['trajectory'][k]
+  theta = frame.get('theta')
+  if theta is not None:
+    theta = theta.ravel()
+  return _worker['rasteriser'].save_columns(name, frame['position'], frame['radius'].ravel(), theta, frame['different'])
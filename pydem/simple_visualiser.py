@@ -21,13 +21,58 @@
 #
 #
 
-import math
+import math, threading
+import numpy
+import pydem
 import pygame
 import pygame.draw
 import pygame.gfxdraw
 import pygame.surface
 import pygame.display
 import pygame.time
+import pygame.event
+
+def take_snapshot(data):
+  """copies what the renderers draw out of a system - on screen coordinates,
+  radii, angles and 'different' flags - so it can be drawn later, or from
+  another thread, whatever the simulation has done in the meantime. theta is
+  None when no particle has an angle (as in 3D), and nan for any particle
+  without one; those get no orientation line."""
+  elements = data['elements']
+  params = data['params']
+  vertical = SimulationRenderer.vertical[1]
+  if len(elements) == 0:
+    positions = numpy.zeros((0, 2))
+    radii = numpy.zeros(0)
+    thetas = None
+    extras = []
+  elif hasattr(elements, 'column'):
+    position = elements.column('position')
+    positions = numpy.column_stack((position[:, 0], position[:, vertical]))
+    radii = elements.column('radius').copy()
+    thetas = None
+    if elements.dimension == 2:
+      thetas = elements.column('theta').copy()
+    # a shallow copy; 'different' is picked out of it when drawing.
+    extras = list(elements.extras)
+  else:
+    positions = numpy.array([[e['position'][0], e['position'][vertical]] for e in elements])
+    radii = numpy.array([e['radius'] for e in elements])
+    thetas = [e.json.get('theta') for e in elements]
+    if thetas.count(None) == len(thetas):
+      thetas = None
+    else:
+      thetas = numpy.array([numpy.nan if t is None else t for t in thetas], dtype=float)
+    extras = [e.json for e in elements]
+  return {
+    'x_limit' : params['x_limit'],
+    'y_limit' : params[SimulationRenderer.vertical[0]],
+    'gravity' : list(params['force_model']['gravity']),
+    'position' : positions,
+    'radius' : radii,
+    'theta' : thetas,
+    'extras' : extras
+  }
 
 class SimulationRenderer:
   instance = None
@@ -48,6 +93,17 @@ class SimulationRenderer:
     if data['params']['dimension'] != 2:
       SimulationRenderer.vertical = ['z_limit', 2]
     
+    self.mode = {
+      'x' : self.pixel_density * int(math.ceil(data['params']['x_limit'])),
+      'y' : self.pixel_density * int(math.ceil(data['params'][SimulationRenderer.vertical[0]]))
+    }
+    
+    self.last_rendered = 0
+    
+    self._open_display()
+    self.render(data)
+  
+  def _open_display(self):
     pygame.init()
     pygame.display.init()
     
@@ -55,102 +111,83 @@ class SimulationRenderer:
     self.black = pygame.Color('#000000')
     self.red = pygame.Color('#FF0000')
     
-    self.mode = {
-      'x' : self.pixel_density * int(math.ceil(data['params']['x_limit'])),
-      'y' : self.pixel_density * int(math.ceil(data['params'][SimulationRenderer.vertical[0]]))
-    }
-    
     self.render_surface = pygame.display.set_mode(
       (
         self.mode['x'],
         self.mode['y']
       )
     )
-    
-    self.last_rendered = 0
-    
-    self.render(data)
-    
+  
   def render(self, data):
-    
+    self.draw(take_snapshot(data))
+  
+  def draw(self, frame):
+    """draws a frame taken by take_snapshot (or made by TrajectoryPlayer, which
+    gives a 'different' array in place of extras.)"""
     r_scale = 1.0
     x_offset = 0.0
     y_offset = 0.0
     
     try:
-      r_scale = data['params']['x_limit'] / self.zoom['width']
+      r_scale = frame['x_limit'] / self.zoom['width']
       x_offset = self.zoom['x']
       y_offset = self.zoom['y']
     except:
       # we don't mind if self.zoom is not defined.
       pass
     
-    elements = data['elements']
-    y_limit = data['params'][SimulationRenderer.vertical[0]]
+    y_limit = frame['y_limit']
+    different = frame.get('different')
+    if different is None:
+      different = [e is not None and e.get('different', False) for e in frame['extras']]
+    
+    # the screen coordinates of every particle, in one go. note, y coords on
+    # screen are upside down.
+    float_r = self.pixel_density * frame['radius'] * r_scale
+    float_x = self.pixel_density * (frame['position'][:, 0] - x_offset) * r_scale
+    float_y = self.pixel_density * ((y_limit - frame['position'][:, 1]) - y_offset) * r_scale
+    radii = numpy.round(float_r).astype(int)
+    xs = numpy.round(float_x).astype(int)
+    ys = numpy.round(float_y).astype(int)
+    # the orientation lines, for the particles which have an angle.
+    thetas = frame['theta']
+    if thetas is None:
+      has_line = numpy.zeros(len(radii), dtype=bool)
+      thetas = numpy.zeros(len(radii))
+    else:
+      has_line = ~numpy.isnan(thetas)
+      thetas = numpy.where(has_line, thetas, 0.0)
+    line_xs = numpy.round(float_x + float_r * numpy.cos(thetas)).astype(int)
+    line_ys = numpy.round(float_y + float_r * numpy.sin(thetas)).astype(int)
     
-    current_radius = 0.0
-    current_x = 0.0
-    current_y = 0.0
-    current_id = 0
+    # do not draw if zooming and off the screen.
+    shown = numpy.ones(len(radii), dtype=bool)
+    if hasattr(self, 'zoom'):
+      shown = (
+        (xs >= -radii) & (ys >= -radii) &
+        (xs <= self.mode['x'] + radii) & (ys <= self.mode['y'] + radii)
+      )
+    
+    # initialise in case of error on first run.
+    current_id = -1
     
     try:
       self.render_surface.fill(self.white)
       
-      # initialise in case of error on first run.
-      current_id = -1
-      float_r = -1.0
-      float_x = -1.0
-      float_y = -1.0
-      
-      # note, y coords on screen are upside down.
-      for i, e in enumerate(elements):
+      for i in numpy.nonzero(shown)[0].tolist():
         current_id = i
-        float_r = self.pixel_density * e.json["radius"] * r_scale
-        current_radius = int(round(float_r))
-        float_x = self.pixel_density * (e["position"][0] - x_offset) * r_scale
-        current_x = int(round(float_x))
-        float_y = self.pixel_density * ((y_limit - e["position"][SimulationRenderer.vertical[1]]) - y_offset) * r_scale
-        current_y = int(round(float_y))
-        
-        # do not draw if zooming and off the screen.
-        if hasattr(self, 'zoom') and (
-           current_x < -1.0 * current_radius or
-           current_y < -1.0 * current_radius or
-           current_x > self.mode['x'] + current_radius or
-           current_y > self.mode['y'] + current_radius):
-          continue
         
         color = self.black
-        try:
-          if e['different']:
-            color = self.red
-        except KeyError:
-          pass
-        
-        pygame.gfxdraw.aacircle(
-          self.render_surface,
-          current_x,
-          current_y,
-          current_radius,
-          color
-        )
+        if different[i]:
+          color = self.red
         
-        try:
-          e.json['theta']
-          pygame.gfxdraw.line(
-            self.render_surface,
-            current_x,
-            current_y,
-            int(round(float_x + float_r * math.cos(e.json['theta']))),
-            int(round(float_y + float_r * math.sin(e.json['theta']))),
-            color
-          )
-        except KeyError:
-          pass
+        pygame.gfxdraw.aacircle(self.render_surface, int(xs[i]), int(ys[i]), int(radii[i]), color)
+        if has_line[i]:
+          pygame.gfxdraw.line(self.render_surface, int(xs[i]), int(ys[i]), int(line_xs[i]), int(line_ys[i]), color)
       
       # now draw an arrow indicating the direction of gravity:
       gravity_arrow_length = 50
-      g = data['params']['force_model']['gravity']
+      g = frame['gravity']
       theta = math.atan2(-g[1], g[0])
       #arrowhead_rotation = math.degrees(theta)
       
@@ -164,9 +201,296 @@ class SimulationRenderer:
       
       pygame.display.flip()
       self.last_rendered = pygame.time.get_ticks()
-      
+    
     except:
       #just give up on rendering this frame...
-      print "caught a rendering exception, on radius", float_r, "and x", float_x, "and y", float_y, "and id", current_id, "and element json:", elements[current_id].json
-      print "current number of elements is", len(elements) 
+      if current_id >= 0:
+        print "caught a rendering exception, on radius", float_r[current_id], "and x", float_x[current_id], "and y", float_y[current_id], "and id", current_id, "and different:", different[current_id]
+      print "current number of elements is", len(radii)
       raise
+
+
+class FrameBuffer:
+  """two frame slots shared between a simulation, which publishes frames, and
+  a renderer, which draws the latest one. Publishing copies into whichever
+  slot isn't being drawn, so it never waits for the renderer; a frame which is
+  overwritten before it was drawn is dropped."""
+  
+  def __init__(self):
+    self.condition = threading.Condition()
+    self.slots = [None, None]
+    self.latest = None
+    self.drawing = None
+    self.closed = False
+    self.frames_published = 0
+    self.frames_dropped = 0
+  
+  def publish(self, data):
+    self.condition.acquire()
+    try:
+      if self.drawing != None:
+        target = 1 - self.drawing
+      elif self.latest != None:
+        target = 1 - self.latest
+      else:
+        target = 0
+      if self.latest != None:
+        # the renderer never got to the last one; this one replaces it.
+        self.latest = None
+        self.frames_dropped += 1
+    finally:
+      self.condition.release()
+    
+    # the renderer only ever takes the latest slot, so this one is ours.
+    self.slots[target] = take_snapshot(data)
+    
+    self.condition.acquire()
+    try:
+      self.latest = target
+      self.frames_published += 1
+      self.condition.notify()
+    finally:
+      self.condition.release()
+  
+  def take(self):
+    """waits for a frame which hasn't been drawn yet, and checks it out for
+    drawing; returns None once the buffer is closed."""
+    self.condition.acquire()
+    try:
+      self.drawing = None
+      while self.latest == None and not self.closed:
+        self.condition.wait(0.1)
+      if self.closed:
+        return None
+      self.drawing = self.latest
+      self.latest = None
+      return self.slots[self.drawing]
+    finally:
+      self.condition.release()
+  
+  def close(self):
+    self.condition.acquire()
+    try:
+      self.closed = True
+      self.condition.notify()
+    finally:
+      self.condition.release()
+
+
+class ThreadedRenderer(SimulationRenderer):
+  """a SimulationRenderer which draws on a thread of its own, so the
+  simulation doesn't wait for pygame: Simulation.run_time only hands it a copy
+  of the particles each frame_time (see FrameBuffer), and frames which come
+  faster than they can be drawn are dropped. lammps runs without holding the
+  python lock, so physics carries on at full speed while a frame is drawn.
+    instance.renderer = ThreadedRenderer(data, frame_time=0.1)"""
+  
+  def __init__(self, data, pixel_density=80, zoom=None, frame_time=0.1):
+    self.frame_time = frame_time
+    self.frames = FrameBuffer()
+    self.frames_drawn = 0
+    self.error = None
+    self.opened = threading.Event()
+    SimulationRenderer.__init__(self, data, pixel_density, zoom)
+  
+  def _open_display(self):
+    # pygame is only ever used from the drawing thread.
+    self.thread = threading.Thread(target=self._draw_frames)
+    self.thread.daemon = True
+    self.thread.start()
+    self.opened.wait()
+    if self.error != None:
+      raise self.error
+  
+  def _draw_frames(self):
+    try:
+      SimulationRenderer._open_display(self)
+    except Exception, e:
+      self.error = e
+      self.opened.set()
+      return
+    self.opened.set()
+    
+    while True:
+      frame = self.frames.take()
+      if frame == None:
+        return
+      try:
+        self.draw(frame)
+      except Exception, e:
+        self.error = e
+        return
+      self.frames_drawn += 1
+  
+  def render(self, data):
+    if self.error != None:
+      raise self.error
+    self.frames.publish(data)
+  
+  def close(self):
+    """stops the drawing thread, once it has finished the current frame."""
+    self.frames.close()
+    self.thread.join()
+
+
+class TrajectoryPlayer(SimulationRenderer):
+  """plays back a trajectory file written by a TrajectoryRecorder (see
+  pydem.trajectory), without re-running the simulation:
+    TrajectoryPlayer('run.trajectory').play()
+  the file is memory mapped and only the frame on screen is decompressed, so
+  long runs open at once. speed is in-universe seconds per second of playback.
+  
+  keys: space pauses; left and right step a frame (with shift, a tenth of the
+  run); home and end jump to the start and end; up and down double and halve
+  the speed; the mouse wheel zooms in and out about the pointer, and r resets
+  the zoom; q or escape quits."""
+  
+  def __init__(self, filename, pixel_density=80, zoom=None, speed=1.0, fps=60):
+    from pydem.trajectory import Trajectory
+    self.trajectory = Trajectory(filename)
+    if len(self.trajectory) == 0:
+      raise pydem.InvalidArgumentError("'" + filename + "' has no frames to play.")
+    fields = [f[0] for f in self.trajectory.fields]
+    if 'position' not in fields or 'radius' not in fields:
+      raise pydem.InvalidArgumentError("'" + filename + "' was recorded without positions and radii, so can't be drawn.")
+    
+    self.speed = speed
+    self.fps = fps
+    self.paused = False
+    self.time = float(self.trajectory.times[0])
+    self.shown = None
+    self.frame_index = None
+    self.frame = None
+    
+    # opens the display on the empty box.
+    SimulationRenderer.__init__(self, {'params' : self.trajectory.params, 'elements' : []}, pixel_density, zoom)
+  
+  def frame_at(self, k):
+    """frame k of the trajectory, in the form SimulationRenderer.draw takes."""
+    if k != self.frame_index:
+      raw = self.trajectory[k]
+      params = self.trajectory.params
+      vertical = SimulationRenderer.vertical[1]
+      count = len(raw['position'])
+      theta = raw.get('theta')
+      if theta is not None and params['dimension'] == 2:
+        theta = theta.ravel()
+      else:
+        # 3D frames carry theta, but it means nothing there.
+        theta = None
+      different = raw.get('different')
+      self.frame = {
+        'x_limit' : params['x_limit'],
+        'y_limit' : params[SimulationRenderer.vertical[0]],
+        'gravity' : list(params['force_model']['gravity']),
+        'position' : numpy.column_stack((raw['position'][:, 0], raw['position'][:, vertical])),
+        'radius' : raw['radius'].ravel(),
+        'theta' : theta,
+        'different' : numpy.zeros(count, dtype=bool) if different is None else different.astype(bool),
+        'step' : raw['step'],
+        'time' : raw['time']
+      }
+      self.frame_index = k
+    return self.frame
+  
+  def show(self, k):
+    """draws frame k, unless it (at the same zoom) is already on screen."""
+    zoom = getattr(self, 'zoom', None)
+    shown = (k, None if zoom is None else tuple(sorted(zoom.items())))
+    if shown == self.shown:
+      return
+    frame = self.frame_at(k)
+    self.draw(frame)
+    self.shown = shown
+    
+    state = 'paused' if self.paused else 'x' + str(self.speed)
+    pygame.display.set_caption("frame %d/%d, step %d, t = %.4g (%s)" % (k + 1, len(self.trajectory), frame['step'], frame['time'], state))
+  
+  def seek(self, k):
+    k = max(0, min(len(self.trajectory) - 1, k))
+    self.time = float(self.trajectory.times[k])
+    return k
+  
+  def zoom_about(self, pixel, factor):
+    """zooms in (factor > 1) or out, keeping the point under the given screen
+    pixel where it is."""
+    x_limit = self.trajectory.params['x_limit']
+    zoom = getattr(self, 'zoom', {'x' : 0.0, 'y' : 0.0, 'width' : x_limit})
+    scale = self.pixel_density * x_limit / zoom['width']
+    point = (zoom['x'] + pixel[0] / scale, zoom['y'] + pixel[1] / scale)
+    
+    width = min(x_limit, zoom['width'] / factor)
+    if width >= x_limit:
+      self.reset_zoom()
+      return
+    scale = self.pixel_density * x_limit / width
+    self.zoom = {'x' : point[0] - pixel[0] / scale, 'y' : point[1] - pixel[1] / scale, 'width' : width}
+  
+  def reset_zoom(self):
+    if hasattr(self, 'zoom'):
+      del self.zoom
+  
+  def play(self):
+    """plays the trajectory until the window is closed (or q is pressed)."""
+    clock = pygame.time.Clock()
+    last = len(self.trajectory) - 1
+    k = self.trajectory.frame_at_time(self.time)
+    try:
+      while True:
+        elapsed = clock.tick(self.fps) / 1000.0
+        
+        for event in pygame.event.get():
+          if event.type == pygame.QUIT:
+            return
+          if event.type == pygame.MOUSEBUTTONDOWN:
+            if event.button == 4:
+              self.zoom_about(event.pos, 1.25)
+            elif event.button == 5:
+              self.zoom_about(event.pos, 0.8)
+            continue
+          if event.type != pygame.KEYDOWN:
+            continue
+          
+          jump = 1
+          if event.mod & pygame.KMOD_SHIFT:
+            jump = max(1, len(self.trajectory) // 10)
+          if event.key in (pygame.K_q, pygame.K_ESCAPE):
+            return
+          elif event.key == pygame.K_SPACE:
+            self.paused = not self.paused
+            if not self.paused and k == last:
+              # play again from the start.
+              k = self.seek(0)
+            self.shown = None
+          elif event.key == pygame.K_RIGHT:
+            k = self.seek(k + jump)
+          elif event.key == pygame.K_LEFT:
+            k = self.seek(k - jump)
+          elif event.key == pygame.K_HOME:
+            k = self.seek(0)
+          elif event.key == pygame.K_END:
+            k = self.seek(last)
+          elif event.key == pygame.K_UP:
+            self.speed *= 2.0
+            self.shown = None
+          elif event.key == pygame.K_DOWN:
+            self.speed /= 2.0
+            self.shown = None
+          elif event.key == pygame.K_r:
+            self.reset_zoom()
+        
+        if not self.paused:
+          self.time += elapsed * self.speed
+          k = self.trajectory.frame_at_time(self.time)
+          if k == last:
+            self.paused = True
+            self.shown = None
+        
+        self.show(k)
+    finally:
+      self.close()
+  
+  def close(self):
+    self.trajectory.close()
+    pygame.display.quit()
+    SimulationRenderer.instance = None
@@ -0,0 +1,154 @@
+#
+# pydem/snapshot.py : binary, columnar system snapshots.
+#
+# Copyright (C) 2012  Joe Jordan
+# <joe.jordan@imperial.ac.uk>
+# <tehwalrus@h2j9k.org>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or (at
+# your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
+#
+#
+# A snapshot file holds the same system as a .json.gz file, laid out as:
+#
+#   'PYDEMSNP'                    8 byte magic string
+#   version, header length        little-endian uint32, uint64 (4 bytes pad)
+#   header                        json: params, dimension, count, columns
+#   columns                       one little-endian float64 array per particle
+#                                 property, each starting on a 64 byte boundary
+#
+# so the columns can be memory mapped straight into a ParticleStore.
+#
+
+import struct
+import cjson, numpy
+import pydem
+
+MAGIC = 'PYDEMSNP'
+VERSION = 1
+EXTENSION = '.snapshot'
+
+_preamble = struct.Struct('<8sIxxxxQ')
+_alignment = 64
+_dtype = numpy.dtype('<f8')
+
+def is_snapshot(filename):
+  """whether filename holds a snapshot, judging by its first few bytes."""
+  try:
+    snapshot_file = open(filename, 'rb')
+  except IOError:
+    return False
+  magic = snapshot_file.read(len(MAGIC))
+  snapshot_file.close()
+  return magic == MAGIC
+
+def _padding(offset):
+  return (-offset) % _alignment
+
+def save_snapshot(data, filename):
+  """saves the system in 'data' as a snapshot, which can be restored using
+  open_snapshot (or pydem.open_system.)"""
+  if not filename.endswith(EXTENSION):
+    filename = filename + EXTENSION
+  
+  elements = data['elements']
+  if not isinstance(elements, pydem.ParticleStore):
+    elements = pydem.ParticleStore(data['params']['dimension'], [e.to_json() for e in elements])
+  elements.refresh()
+  
+  names = sorted(elements._column_shapes().keys())
+  columns = []
+  offset = 0
+  for name in names:
+    column = elements.columns[name][:elements.count]
+    columns.append({
+      'name' : name,
+      'shape' : list(column.shape),
+      'offset' : offset
+    })
+    offset += column.size * _dtype.itemsize
+    offset += _padding(offset)
+  
+  extras = None
+  if any([e is not None for e in elements.extras]):
+    default = pydem.ParticleStore.default_extras
+    extras = [default if e is None else e for e in elements.extras]
+  
+  header = cjson.encode({
+    'params' : data['params'].to_json(),
+    'dimension' : elements.dimension,
+    'count' : elements.count,
+    'columns' : columns,
+    'extras' : extras
+  })
+  
+  outfile = open(filename, 'wb')
+  outfile.write(_preamble.pack(MAGIC, VERSION, len(header)))
+  outfile.write(header)
+  outfile.write('\0' * _padding(_preamble.size + len(header)))
+  for name in names:
+    values = numpy.ascontiguousarray(elements.columns[name][:elements.count], dtype=_dtype)
+    values.tofile(outfile)
+    outfile.write('\0' * _padding(values.size * _dtype.itemsize))
+  outfile.close()
+
+def open_snapshot(filename, mmap=True):
+  """opens a snapshot file. With mmap=True (the default) the particle columns
+  are memory mapped copy-on-write, so even very large systems open in
+  milliseconds and are only paged in as they are used; changes made in memory
+  never reach the file."""
+  snapshot_file = open(filename, 'rb')
+  magic, version, header_length = _preamble.unpack(snapshot_file.read(_preamble.size))
+  if magic != MAGIC:
+    snapshot_file.close()
+    raise pydem.InvalidArgumentError("'" + filename + "' is not a pydem snapshot.")
+  if version > VERSION:
+    snapshot_file.close()
+    raise pydem.InvalidArgumentError("'" + filename + "' was written by a newer version of pydem.")
+  
+  header = cjson.decode(snapshot_file.read(header_length))
+  start = _preamble.size + header_length
+  start += _padding(start)
+  
+  columns = {}
+  for column in header['columns']:
+    shape = tuple(column['shape'])
+    if mmap and header['count'] > 0:
+      columns[column['name']] = numpy.memmap(filename, dtype=_dtype, mode='c', offset=start + column['offset'], shape=shape)
+    else:
+      snapshot_file.seek(start + column['offset'])
+      columns[column['name']] = numpy.fromfile(snapshot_file, dtype=_dtype, count=int(numpy.prod(shape))).reshape(shape)
+  snapshot_file.close()
+  
+  extras = header['extras']
+  if extras is not None:
+    default = pydem.ParticleStore.default_extras
+    extras = [None if e == default else e for e in extras]
+  
+  params_json = header['params']
+  fm_params = params_json['force_model']
+  del params_json['force_model']
+  
+  return {
+    'params' : pydem.SimulationParams(params_json, fm_params),
+    'elements' : pydem.ParticleStore.from_columns(header['dimension'], columns, extras)
+  }
+
+def json_to_snapshot(json_filename, snapshot_filename):
+  """converts a .json.gz system file to a snapshot."""
+  save_snapshot(pydem.open_system(json_filename), snapshot_filename)
+
+def snapshot_to_json(snapshot_filename, json_filename):
+  """converts a snapshot back to a .json.gz system file."""
+  pydem.save_system(open_snapshot(snapshot_filename, mmap=False), json_filename)
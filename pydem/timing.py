@@ -0,0 +1,157 @@
+#
+# pydem/timing.py : where the wall time of a simulation goes.
+#
+# Copyright (C) 2012  Joe Jordan
+# <joe.jordan@imperial.ac.uk>
+# <tehwalrus@h2j9k.org>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or (at
+# your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
+#
+#
+# Every Simulation keeps a Timings (instance.timings) which each phase of its
+# work - lammps runs, other lammps commands, writing particles to lammps,
+# reading them back, rendering, callbacks - is counted against. Phases nest
+# (a callback may read particles back, say), and time is only ever counted
+# against the innermost phase running, so the phases add up to the time spent
+# inside pydem, with nothing counted twice.
+#
+# lammps' own breakdown of its runs (pair, neighbour, comm, modify...) is only
+# printed to its log, and only when a run is finished off with 'post yes';
+# Simulation.time_lammps() turns that on, and the breakdowns are read back out
+# of the log into Timings.lammps.
+#
+
+import functools, re, time
+
+class Timings:
+  """accumulated wall time (in seconds) and call counts, per phase. e.g.
+    print instance.timings           # a table, longest phase first
+    instance.timings.seconds('run')
+    instance.timings.reset()
+  to_json() gives everything as a dict, for saving alongside results."""
+  
+  def __init__(self):
+    self.stack = []
+    self.reset()
+  
+  def reset(self):
+    """zeroes every count. A phase which is running carries on being timed,
+    from now."""
+    self.phases = {}
+    self.lammps = {}
+    self.lammps_runs = 0
+    self.since = time.time()
+  
+  def begin(self, phase):
+    now = time.time()
+    if self.stack:
+      self._charge(self.stack[-1], now)
+    self.stack.append(phase)
+    self.since = now
+    self.phases.setdefault(phase, [0.0, 0])[1] += 1
+  
+  def end(self):
+    now = time.time()
+    self._charge(self.stack.pop(), now)
+    self.since = now
+  
+  def _charge(self, phase, now):
+    self.phases.setdefault(phase, [0.0, 0])[0] += now - self.since
+  
+  def add_lammps(self, breakdown):
+    """adds one run's breakdown, {section : seconds}, to the lammps totals."""
+    for section, seconds in breakdown.items():
+      self.lammps[section] = self.lammps.get(section, 0.0) + seconds
+    self.lammps_runs += 1
+  
+  def seconds(self, phase):
+    return self.phases.get(phase, [0.0, 0])[0]
+  
+  def calls(self, phase):
+    return self.phases.get(phase, [0.0, 0])[1]
+  
+  def total(self):
+    return sum([p[0] for p in self.phases.values()])
+  
+  def to_json(self):
+    return {
+      'phases' : dict([(phase, {'seconds' : p[0], 'calls' : p[1]}) for phase, p in self.phases.items()]),
+      'lammps' : dict(self.lammps),
+      'lammps_runs' : self.lammps_runs
+    }
+  
+  def report(self):
+    lines = ["%-16s %12s %10s %7s" % ('phase', 'seconds', 'calls', '%')]
+    total = self.total() or 1.0
+    for phase, p in sorted(self.phases.items(), key=lambda item: -item[1][0]):
+      lines.append("%-16s %12.6f %10d %7.2f" % (phase, p[0], p[1], 100.0 * p[0] / total))
+    if self.lammps_runs > 0:
+      lines.append("")
+      lines.append("lammps, over %d runs:" % self.lammps_runs)
+      for section, seconds in sorted(self.lammps.items(), key=lambda item: -item[1]):
+        lines.append("%-16s %12.6f" % (section, seconds))
+    return "\n".join(lines)
+  
+  __str__ = report
+
+def timed(phase, timings=None):
+  """decorates a function so its time is counted as phase, against timings or
+  (for methods, when timings is None) against self.timings."""
+  def decorate(function):
+    @functools.wraps(function)
+    def timed_function(*args, **kwargs):
+      counter = timings
+      if counter is None:
+        counter = args[0].timings
+      counter.begin(phase)
+      try:
+        return function(*args, **kwargs)
+      finally:
+        counter.end()
+    return timed_function
+  return decorate
+
+# what open_system and save_system spend, as they belong to no simulation.
+io_timings = Timings()
+
+# the names lammps gives its timing sections, in old ('Pair  time (%) = ...')
+# and new ('Pair    | min | avg | max ...') style logs:
+_section_names = {
+  'outpt' : 'output',
+  'kspce' : 'kspace',
+  'neigh' : 'neighbor'
+}
+_loop_line = re.compile(r'^Loop time of ([-+.eE0-9]+)')
+_old_section_line = re.compile(r'^(\w+)\s+time \(%\) = ([-+.eE0-9]+)')
+# (the 'Other' line of new style logs has only an average.)
+_new_section_line = re.compile(r'^(\w+)\s*\|\s*[-+.eE0-9]*\s*\|\s*([-+.eE0-9]+)\s*\|')
+
+def parse_lammps_timing(text):
+  """the timing breakdowns of the runs in a piece of lammps log, as a list of
+  {section : seconds} - 'loop' being the whole run."""
+  runs = []
+  for line in text.splitlines():
+    line = line.strip()
+    match = _loop_line.match(line)
+    if match:
+      runs.append({'loop' : float(match.group(1))})
+      continue
+    if not runs:
+      continue
+    match = _old_section_line.match(line) or _new_section_line.match(line)
+    if match:
+      name = match.group(1).lower()
+      runs[-1][_section_names.get(name, name)] = float(match.group(2))
+  return runs
@@ -0,0 +1,297 @@
+#
+# pydem/trajectory.py : recording and reading back simulation trajectories.
+#
+# Copyright (C) 2012  Joe Jordan
+# <joe.jordan@imperial.ac.uk>
+# <tehwalrus@h2j9k.org>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or (at
+# your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
+#
+#
+# A trajectory file is laid out as:
+#
+#   'PYDEMTRJ', version, header length     as in a snapshot (see snapshot.py)
+#   header                                 json: params, dimension, fields
+#   frames                                 each one a frame header followed by
+#                                          a zlib compressed block holding the
+#                                          frame's columns, one after another
+#   index                                  (offset, length, count, step, time)
+#                                          for every frame
+#   'PYDEMIDX', index offset, frame count  footer
+#
+# the index lets a reader jump straight to any frame. If the recorder never
+# got to write it (e.g. the process was killed) the reader rebuilds it from
+# the frame headers, without decompressing anything.
+#
+
+import mmap, struct, threading, zlib, Queue
+import cjson, numpy
+import pydem
+
+MAGIC = 'PYDEMTRJ'
+FRAME_MAGIC = 'PYDEMFRM'
+INDEX_MAGIC = 'PYDEMIDX'
+VERSION = 1
+
+_preamble = struct.Struct('<8sIxxxxQ')
+_frame_header = struct.Struct('<8sQQQd')
+_footer = struct.Struct('<8sQQ')
+_index_dtype = numpy.dtype([
+  ('offset', '<u8'),
+  ('length', '<u8'),
+  ('count', '<u8'),
+  ('step', '<u8'),
+  ('time', '<f8')
+])
+
+# what each recordable field is, and how wide it is per particle:
+_field_types = {
+  'tag' : ('<i8', None),
+  'position' : ('<f8', 'dimension'),
+  'velocity' : ('<f8', 'dimension'),
+  'force' : ('<f8', 'dimension'),
+  'omega' : ('<f8', 3),
+  'radius' : ('<f8', 1),
+  'mass' : ('<f8', 1),
+  'theta' : ('<f8', 1),
+  'different' : ('<u1', None)
+}
+
+class TrajectoryRecorder:
+  """appends frames of a running simulation to a compressed trajectory file.
+  attach one to a simulation with
+    instance.recorder = TrajectoryRecorder('run.trajectory', every_steps=1000)
+  and a frame is captured every 1000 timesteps (or give every_time in
+  in-universe seconds; with neither, frames follow the renderer's frame_time.)
+  compression and disk writes happen on a background thread, so the
+  simulation only pays for copying the recorded columns. Call close() when
+  finished, to write the frame index.
+  
+  tags (for following particles between frames as they are added and removed)
+  and the 'different' highlight flag are always recorded, along with the
+  fields asked for."""
+  
+  default_fields = ['position', 'velocity', 'radius', 'theta']
+  
+  def __init__(self, filename, every_steps=None, every_time=None, fields=None, compression_level=1, queue_size=16):
+    self.filename = filename
+    self.every_steps = every_steps
+    self.every_time = every_time
+    self.fields = ['tag'] + list(fields or TrajectoryRecorder.default_fields) + ['different']
+    self.compression_level = compression_level
+    self.frames_captured = 0
+    self.last_step = None
+    
+    self.outfile = open(filename, 'wb')
+    self.header_written = False
+    self.index = []
+    self.error = None
+    self.queue = Queue.Queue(queue_size)
+    self.writer = threading.Thread(target=self._write_frames)
+    self.writer.daemon = True
+    self.writer.start()
+  
+  def interval(self, simulation):
+    """the number of timesteps between frames, for this simulation."""
+    if self.every_steps is not None:
+      return max(1, int(self.every_steps))
+    every_time = self.every_time
+    if every_time is None:
+      if simulation.renderer is None:
+        raise pydem.InvalidArgumentError("a TrajectoryRecorder needs every_steps or every_time when there is no renderer.")
+      every_time = simulation.renderer.frame_time
+    return max(1, int(round(every_time / simulation.data['params']['force_model']['timestep'])))
+  
+  def steps_until_frame(self, simulation):
+    interval = self.interval(simulation)
+    return interval - simulation.steps_run % interval
+  
+  def step(self, simulation):
+    """called by the simulation after each run; captures a frame if one is
+    due."""
+    if simulation.steps_run % self.interval(simulation) == 0 and simulation.steps_run != self.last_step:
+      self.capture(simulation)
+  
+  def capture(self, simulation):
+    """copies the recorded fields out of the simulation and queues them to be
+    written as a frame."""
+    self._raise_writer_error()
+    data = simulation.data
+    elements = data['elements']
+    
+    if not self.header_written:
+      self._write_header(data['params'], elements.dimension)
+    
+    columns = []
+    for field in self.fields:
+      if field == 'tag':
+        values = elements.tag
+      elif field == 'different':
+        values = numpy.array([bool(e is not None and e.get('different', False)) for e in elements.extras])
+      else:
+        values = elements.column(field)
+      columns.append(numpy.array(values, dtype=_field_types[field][0]))
+    
+    time = simulation.steps_run * data['params']['force_model']['timestep']
+    self.queue.put((len(elements), simulation.steps_run, time, columns))
+    self.frames_captured += 1
+    self.last_step = simulation.steps_run
+  
+  def close(self):
+    """waits for queued frames to be written, then writes the frame index."""
+    if self.outfile is None:
+      return
+    self.queue.put(None)
+    self.writer.join()
+    self._raise_writer_error()
+    
+    if not self.header_written:
+      self.outfile.close()
+      self.outfile = None
+      return
+    index_offset = self.outfile.tell()
+    numpy.array(self.index, dtype=_index_dtype).tofile(self.outfile)
+    self.outfile.write(_footer.pack(INDEX_MAGIC, index_offset, len(self.index)))
+    self.outfile.close()
+    self.outfile = None
+  
+  def _write_header(self, params, dimension):
+    header = cjson.encode({
+      'params' : params.to_json(),
+      'dimension' : dimension,
+      'fields' : [
+        [field, _field_types[field][0], _field_width(field, dimension)]
+        for field in self.fields
+      ]
+    })
+    self.outfile.write(_preamble.pack(MAGIC, VERSION, len(header)))
+    self.outfile.write(header)
+    self.header_written = True
+  
+  def _write_frames(self):
+    while True:
+      frame = self.queue.get()
+      if frame is None:
+        return
+      if self.error is not None:
+        continue
+      try:
+        count, step, time, columns = frame
+        block = zlib.compress(''.join([c.tostring() for c in columns]), self.compression_level)
+        offset = self.outfile.tell()
+        self.outfile.write(_frame_header.pack(FRAME_MAGIC, len(block), count, step, time))
+        self.outfile.write(block)
+        self.index.append((offset, len(block), count, step, time))
+      except Exception, e:
+        self.error = e
+  
+  def _raise_writer_error(self):
+    if self.error is not None:
+      raise self.error
+
+
+class Trajectory:
+  """reads a trajectory file written by a TrajectoryRecorder. The file is
+  memory mapped, and frames are decompressed only when asked for:
+    trajectory = Trajectory('run.trajectory')
+    frame = trajectory[k]   # => {'position' : (N, dim) array, ..., 'step', 'time'}
+  trajectory.steps and trajectory.times give every frame's timestep and
+  in-universe time, without reading any frames."""
+  
+  def __init__(self, filename):
+    self.filename = filename
+    self.file = open(filename, 'rb')
+    self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+    
+    magic, version, header_length = _preamble.unpack(self.map[:_preamble.size])
+    if magic != MAGIC:
+      raise pydem.InvalidArgumentError("'" + filename + "' is not a pydem trajectory.")
+    if version > VERSION:
+      raise pydem.InvalidArgumentError("'" + filename + "' was written by a newer version of pydem.")
+    header = cjson.decode(self.map[_preamble.size:_preamble.size + header_length])
+    self.frames_start = _preamble.size + header_length
+    
+    self.dimension = header['dimension']
+    self.fields = [(name, numpy.dtype(dtype), width) for name, dtype, width in header['fields']]
+    params_json = header['params']
+    fm_params = params_json['force_model']
+    del params_json['force_model']
+    self.params = pydem.SimulationParams(params_json, fm_params)
+    
+    self.index = self._read_index()
+  
+  def _read_index(self):
+    size = len(self.map)
+    if size >= self.frames_start + _footer.size:
+      magic, index_offset, frame_count = _footer.unpack(self.map[size - _footer.size:])
+      if magic == INDEX_MAGIC:
+        return numpy.frombuffer(
+          self.map[index_offset:index_offset + frame_count * _index_dtype.itemsize],
+          dtype=_index_dtype
+        )
+    
+    # no index was written, so walk the frame headers to rebuild it.
+    index = []
+    offset = self.frames_start
+    while offset + _frame_header.size <= size:
+      magic, length, count, step, time = _frame_header.unpack(self.map[offset:offset + _frame_header.size])
+      if magic != FRAME_MAGIC or offset + _frame_header.size + length > size:
+        break
+      index.append((offset, length, count, step, time))
+      offset += _frame_header.size + length
+    return numpy.array(index, dtype=_index_dtype)
+  
+  steps = property(lambda self: self.index['step'])
+  times = property(lambda self: self.index['time'])
+  
+  def __len__(self):
+    return len(self.index)
+  
+  def __getitem__(self, k):
+    if k < 0:
+      k += len(self.index)
+    if k < 0 or k >= len(self.index):
+      raise IndexError("frame index out of range")
+    offset, length, count, step, time = self.index[k]
+    start = int(offset) + _frame_header.size
+    block = zlib.decompress(self.map[start:start + int(length)])
+    
+    frame = {'step' : int(step), 'time' : float(time)}
+    position = 0
+    for name, dtype, width in self.fields:
+      shape = (int(count),) if width is None else (int(count), width)
+      size = int(numpy.prod(shape)) * dtype.itemsize
+      frame[name] = numpy.frombuffer(block, dtype=dtype, count=int(numpy.prod(shape)), offset=position).reshape(shape)
+      position += size
+    return frame
+  
+  def __iter__(self):
+    for k in range(len(self)):
+      yield self[k]
+  
+  def frame_at_time(self, time):
+    """the index of the last frame recorded at or before the given time."""
+    return max(0, int(numpy.searchsorted(self.times, time, side='right')) - 1)
+  
+  def close(self):
+    self.map.close()
+    self.file.close()
+
+
+def _field_width(field, dimension):
+  width = _field_types[field][1]
+  if width == 'dimension':
+    return dimension
+  return width
@@ -21,7 +21,8 @@
 # Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
 #
 
-import sys, pydem, pydem.dem as l
+import sys, os, getopt, cjson, pydem, pydem.dem as l
+from pydem import ensemble, snapshot
 
 def print_usage():
   print """
@@ -30,25 +31,100 @@ def print_usage():
   
   USAGE:
   
-  run_dem.py system_file
+  run_dem.py [-j jobs] [-c checkpoint_timesteps] system_file [system_file ...]
   
-  where 'system_file' refers to a .json.gz file containing the physics model,
-  boundary conditions and granular particle properties. 
+  where each 'system_file' refers to a .json.gz (or .snapshot) file containing
+  the physics model, boundary conditions and granular particle properties, or
+  to a directory of them. Each system is run to equilibrium and saved back to
+  its file.
+  
+  up to 'jobs' systems (by default, one per core) are run at once. Each saves a
+  checkpoint every 'checkpoint_timesteps' timesteps (by default 100000) to
+  system_file.checkpoint.snapshot, and if run_dem.py is stopped and started
+  again it carries on from there. Systems which finished are marked with a
+  system_file.done file, and skipped.
 """
 
+CHECKPOINT_SUFFIX = '.checkpoint' + snapshot.EXTENSION
+DONE_SUFFIX = '.done'
+
+def system_files(arguments):
+  """the system files named, with directories expanded to the systems in
+  them."""
+  files = []
+  for argument in arguments:
+    if not os.path.isdir(argument):
+      files.append(argument)
+      continue
+    for name in sorted(os.listdir(argument)):
+      if name.startswith('.') or name.endswith(CHECKPOINT_SUFFIX):
+        continue
+      if name.endswith('.json.gz') or name.endswith(snapshot.EXTENSION):
+        files.append(os.path.join(argument, name))
+  return files
+
+def run_system(filename, checkpoint_every):
+  """runs one system file to equilibrium, resuming from its checkpoint if
+  there is one, and saves the result back to the file."""
+  checkpoint = filename + CHECKPOINT_SUFFIX
+  data = None
+  if not os.path.exists(checkpoint):
+    data = pydem.open_system(filename)
+  
+  new_data, stats = l.run_simulation(
+    data,
+    endpoint=pydem.Endpoint.EQUILIBRIUM,
+    checkpoint=checkpoint,
+    checkpoint_every=checkpoint_every
+  )
+  
+  # replace the file in one go, so it is never left half written.
+  directory, name = os.path.split(filename)
+  partial = os.path.join(directory, '.' + name)
+  pydem.save_system(new_data, partial)
+  os.rename(partial, filename)
+  
+  done = open(filename + DONE_SUFFIX, 'w')
+  done.write(cjson.encode(stats))
+  done.close()
+  if os.path.exists(checkpoint):
+    os.remove(checkpoint)
+  return stats
+
 if __name__ == "__main__":
   
-  if len(sys.argv) < 2:
+  try:
+    options, arguments = getopt.getopt(sys.argv[1:], 'j:c:')
+  except getopt.GetoptError:
+    print_usage()
+    exit()
+  if len(arguments) < 1:
     print_usage()
     exit()
   
-  data = pydem.open_system(sys.argv[1])
+  jobs = None
+  checkpoint_every = 100000
+  for option, value in options:
+    if option == '-j':
+      jobs = int(value)
+    elif option == '-c':
+      checkpoint_every = int(value)
   
-  new_data = l.run_simulation(
-    data,
-    endpoint=pydem.Endpoint.EQUILIBRIUM
-  )
+  files = []
+  for filename in system_files(arguments):
+    if os.path.exists(filename + DONE_SUFFIX):
+      print filename, "already finished, skipping."
+    else:
+      files.append(filename)
   
-  pydem.save_system(new_data, sys.argv[1])
+  failures = 0
+  run = lambda filename: run_system(filename, checkpoint_every)
+  for k, result in ensemble.run_ensemble(files, run, jobs):
+    if isinstance(result, ensemble.JobFailed):
+      failures += 1
+      print files[k], "failed:", result
+    else:
+      print files[k], "ran", result['timesteps'], "timesteps in", result['wall_time'], "s, final kinetic energy", result['kinetic_energy']
   
-  
\ No newline at end of file
+  if failures > 0:
+    sys.exit(1)
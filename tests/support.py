@@ -0,0 +1,66 @@
+#
+# tests/support.py : what the tests share.
+#
+# Copyright (C) 2012  Joe Jordan
+# <joe.jordan@imperial.ac.uk>
+# <tehwalrus@h2j9k.org>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or (at
+# your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
+#
+#
+# The tests run against the in-memory lammps in benchmarks/fake_lammps.py, so
+# they need no lammps build:
+#   python -m unittest discover tests
+#
+
+import os, sys
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+sys.path.insert(0, os.path.join(root, 'benchmarks'))
+import fake_lammps
+fake_lammps.install()
+
+import numpy
+import pydem, pydem.granular as g, pydem.packing as packing
+
+def small_system(count=200, dimension=3, seed=1):
+  """a system of count grains, spread out on a lattice in a box."""
+  side = 2.0 * count ** (1.0 / dimension) + 2.0
+  simulation_params = {'dimension' : dimension, 'x_limit' : side, 'y_limit' : side, 'max_particles_guess' : count}
+  if dimension == 3:
+    simulation_params['z_limit'] = side
+  params = g.generate_params({
+    'simulation_params' : simulation_params,
+    'force_model_params' : {},
+    'element_generation_params' : {'min_radius' : 0.4, 'max_radius' : 0.5}
+  })
+  rng = numpy.random.RandomState(seed)
+  radii = 0.4 + 0.1 * rng.random_sample(count)
+  positions = packing.lattice_pack(radii, numpy.zeros(dimension), numpy.ones(dimension) * side, rng)
+  return {
+    'params' : params,
+    'elements' : pydem.ParticleStore.from_columns(dimension, {
+      'position' : positions,
+      'velocity' : rng.standard_normal((count, dimension)),
+      'radius' : radii,
+      'mass' : numpy.pi * radii ** 2
+    })
+  }
+
+def lammps_by_tag(simulation, name):
+  """lammps' per-atom array name, in tag order."""
+  lmp = simulation.lmp
+  order = numpy.argsort(lmp._live('id'))
+  return lmp._live(name)[order]
@@ -0,0 +1,77 @@
+#
+# tests/test_ensemble.py : running simulations side by side.
+#
+# Copyright (C) 2012  Joe Jordan
+# <joe.jordan@imperial.ac.uk>
+# <tehwalrus@h2j9k.org>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or (at
+# your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
+#
+
+import os, unittest
+import support
+import numpy
+import pydem, pydem.dem as l
+from pydem import ensemble
+
+def run_briefly(seed):
+  data = support.small_system(count=20, seed=seed)
+  simulation = l.Simulation(data)
+  simulation.run_time(10)
+  simulation.close()
+  return data, seed
+
+def job(task):
+  """runs task = (what, seed): 'run' a system, 'raise' an exception, or 'die'
+  outright."""
+  what, seed = task
+  if what == 'raise':
+    raise ValueError("job " + str(seed) + " went wrong")
+  if what == 'die':
+    os._exit(3)
+  return run_briefly(seed)
+
+class EnsembleTest(unittest.TestCase):
+  
+  def assert_ran(self, result, seed):
+    self.assertFalse(isinstance(result, ensemble.JobFailed))
+    system, returned_seed = result
+    self.assertEqual(returned_seed, seed)
+    self.assertTrue(isinstance(system['params'], pydem.SimulationParams))
+    expected, _ = run_briefly(seed)
+    self.assertTrue(numpy.allclose(system['elements'].position, expected['elements'].position))
+    self.assertEqual(system['params'].to_json(), expected['params'].to_json())
+  
+  def test_run_all(self):
+    results = ensemble.run_all([('run', 1), ('raise', 2), ('run', 3), ('die', 4)], job, processes=2)
+    self.assertEqual(len(results), 4)
+    self.assert_ran(results[0], 1)
+    self.assert_ran(results[2], 3)
+    
+    self.assertTrue(isinstance(results[1], ensemble.JobFailed))
+    self.assertTrue("job 2 went wrong" in str(results[1]))
+    self.assertTrue(isinstance(results[3], ensemble.JobFailed))
+    self.assertTrue("exit code 3" in str(results[3]))
+  
+  def test_run_ensemble(self):
+    tasks = [('die', 0), ('run', 1), ('raise', 2)]
+    results = dict(ensemble.run_ensemble(tasks, job, processes=3))
+    self.assertEqual(sorted(results.keys()), [0, 1, 2])
+    self.assertTrue(isinstance(results[0], ensemble.JobFailed))
+    self.assert_ran(results[1], 1)
+    self.assertTrue(isinstance(results[2], ensemble.JobFailed))
+
+if __name__ == '__main__':
+  unittest.main()
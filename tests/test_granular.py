@@ -0,0 +1,45 @@
+#
+# tests/test_granular.py : generating granular systems.
+#
+# Copyright (C) 2012  Joe Jordan
+# <joe.jordan@imperial.ac.uk>
+# <tehwalrus@h2j9k.org>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or (at
+# your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
+#
+
+import unittest
+import support
+import pydem, pydem.granular as g
+
+class GenerateElementsTest(unittest.TestCase):
+  
+  def generate(self, method):
+    options = {'min_radius' : 0.5, 'max_radius' : 1.0, 'deposition_method' : method, 'separation_scaling' : 1.0, 'seed' : 1}
+    simulation_options = {'dimension' : 2, 'x_limit' : 20.0, 'y_limit' : 20.0}
+    return g.generate_elements(options, simulation_options, [])
+  
+  def test_methods(self):
+    self.assertTrue(len(self.generate(g.DepositionMethod.RANDOM_SPACED_SHEETS)) > 0)
+    self.assertTrue(len(self.generate(g.DepositionMethod.GEOMETRIC_PACK)) > 0)
+  
+  def test_pour(self):
+    self.assertRaises(pydem.InvalidArgumentError, self.generate, g.DepositionMethod.CONTINUOUS_POUR)
+  
+  def test_unknown(self):
+    self.assertRaises(pydem.InvalidArgumentError, self.generate, 99)
+
+if __name__ == '__main__':
+  unittest.main()
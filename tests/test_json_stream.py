@@ -0,0 +1,113 @@
+#
+# tests/test_json_stream.py : reading saved systems a piece at a time.
+#
+# Copyright (C) 2012  Joe Jordan
+# <joe.jordan@imperial.ac.uk>
+# <tehwalrus@h2j9k.org>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or (at
+# your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
+#
+
+import gzip, os, shutil, tempfile, unittest
+import support
+import cjson
+import pydem
+from pydem import json_stream
+
+def legacy_open_system(filename):
+  """the json as open_system read it before json_stream - the whole file
+  decoded by cjson in one go."""
+  json_file = gzip.open(filename, 'rb')
+  json_string = json_file.read()
+  json_file.close()
+  if json_string.find('\'') != -1:
+    json_string = json_string.replace('\'', '\"')
+  return cjson.decode(json_string)
+
+def types(value):
+  """value's structure, with every leaf replaced by its type."""
+  if isinstance(value, dict):
+    return dict([((type(k).__name__, k), types(v)) for k, v in value.items()])
+  if isinstance(value, list):
+    return [types(v) for v in value]
+  return type(value).__name__
+
+class RoundTripTest(unittest.TestCase):
+  """json_stream reads back what the whole-file decode used to."""
+  
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.chunk_size = json_stream.chunk_size
+    self.batch_size = json_stream.batch_size
+  
+  def tearDown(self):
+    json_stream.chunk_size = self.chunk_size
+    json_stream.batch_size = self.batch_size
+    shutil.rmtree(self.directory)
+  
+  def write(self, text):
+    filename = os.path.join(self.directory, 'system.json.gz')
+    json_file = gzip.open(filename, 'wb')
+    json_file.write(text)
+    json_file.close()
+    return filename
+  
+  def saved_system(self):
+    data = support.small_system(count=50)
+    data['params']['label'] = 'test'
+    data['params']['note'] = u'caf\xe9'
+    data['elements'][4]['colour'] = 'red'
+    data['elements'][4]['different'] = True
+    filename = os.path.join(self.directory, 'system.json.gz')
+    pydem.save_system(data, filename)
+    return filename
+  
+  def assert_matches_legacy(self, filename):
+    legacy = legacy_open_system(filename)
+    opened = pydem.open_system(filename)
+    
+    params = opened['params'].to_json()
+    self.assertEqual(params, legacy['params'])
+    self.assertEqual(types(params), types(legacy['params']))
+    
+    self.assertEqual(len(opened['elements']), len(legacy['elements']))
+    for particle, json in zip(opened['elements'], legacy['elements']):
+      particle_json = particle.to_json()
+      for key, value in json.items():
+        self.assertEqual(particle_json[key], value)
+        self.assertEqual(types(particle_json[key]), types(value))
+  
+  def test_round_trip(self):
+    self.assert_matches_legacy(self.saved_system())
+  
+  def test_small_chunks(self):
+    # every element decoded on its own, by the fallback decoder.
+    json_stream.chunk_size = 64
+    json_stream.batch_size = 7
+    self.assert_matches_legacy(self.saved_system())
+  
+  def test_params_last(self):
+    legacy = legacy_open_system(self.saved_system())
+    text = '{"elements" : ' + cjson.encode(legacy['elements']) + ', "params" : ' + cjson.encode(legacy['params']) + '}'
+    self.assert_matches_legacy(self.write(text))
+  
+  def test_legacy_quotes(self):
+    legacy = legacy_open_system(self.saved_system())
+    text = cjson.encode(legacy).replace('"', '\'')
+    json_stream.chunk_size = 256
+    self.assert_matches_legacy(self.write(text))
+
+if __name__ == '__main__':
+  unittest.main()
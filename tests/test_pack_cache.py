@@ -0,0 +1,110 @@
+#
+# tests/test_pack_cache.py : the cache of generated stable packs.
+#
+# Copyright (C) 2012  Joe Jordan
+# <joe.jordan@imperial.ac.uk>
+# <tehwalrus@h2j9k.org>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or (at
+# your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
+#
+
+import os, shutil, tempfile, threading, time, unittest
+import support
+import numpy
+import pydem, pydem.granular as g
+from pydem.pack_cache import PackCache
+
+def pack_params(seed=3):
+  return {
+    'simulation_params' : {'dimension' : 2, 'x_limit' : 20.0, 'y_limit' : 20.0, 'max_particles_guess' : 100},
+    'force_model_params' : {},
+    'element_generation_params' : {
+      'min_radius' : 0.5,
+      'max_radius' : 1.0,
+      'deposition_method' : g.DepositionMethod.GEOMETRIC_PACK,
+      'packing_fraction' : 0.5,
+      'seed' : seed
+    }
+  }
+
+class PackCacheTest(unittest.TestCase):
+  
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+  
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+  
+  def test_miss_and_hit(self):
+    cache = PackCache(self.directory)
+    self.assertFalse(pack_params() in cache)
+    missed = cache.stable_pack(pack_params())
+    self.assertTrue(pack_params() in cache)
+    hit = cache.stable_pack(pack_params())
+    
+    self.assertEqual(type(missed['elements']), type(hit['elements']))
+    self.assertEqual(missed['params'].to_json(), hit['params'].to_json())
+    self.assertTrue(numpy.array_equal(missed['elements'].position, hit['elements'].position))
+    self.assertTrue(numpy.array_equal(missed['elements'].radius, hit['elements'].radius))
+  
+  def locks(self):
+    return sorted([name for name in os.listdir(self.directory) if name.endswith('.lock') and not name.startswith('.')])
+  
+  def test_evict_removes_locks(self):
+    cache = PackCache(self.directory)
+    cache.stable_pack(pack_params(1))
+    cache.max_bytes = os.path.getsize(cache.path(cache.key(pack_params(1)))) + 1
+    cache.stable_pack(pack_params(2))
+    self.assertFalse(pack_params(1) in cache)
+    self.assertTrue(pack_params(2) in cache)
+    self.assertEqual(self.locks(), [cache.key(pack_params(2)) + '.lock'])
+    
+    cache.clear()
+    self.assertEqual(self.locks(), [])
+    self.assertEqual(cache.entries(), [])
+  
+  def test_held_lock_kept(self):
+    cache = PackCache(self.directory)
+    name = cache.key(pack_params()) + '.lock'
+    held = cache._lock(name)
+    cache.clear()
+    self.assertEqual(self.locks(), [name])
+    cache._unlock(held)
+    cache.clear()
+    self.assertEqual(self.locks(), [])
+  
+  def test_lock_deleted_while_waiting(self):
+    cache = PackCache(self.directory)
+    name = cache.key(pack_params()) + '.lock'
+    path = os.path.join(self.directory, name)
+    held = cache._lock(name)
+    got = []
+    waiter = threading.Thread(target=lambda: got.append(cache._lock(name)))
+    waiter.start()
+    time.sleep(0.2)
+    # deleted, as _remove_locks does, while the waiter waits on it.
+    os.remove(path)
+    cache._unlock(held)
+    waiter.join(5.0)
+    self.assertEqual(os.fstat(got[0].fileno()).st_ino, os.stat(path).st_ino)
+    cache._unlock(got[0])
+  
+  def test_needs_seed(self):
+    params = pack_params()
+    params['element_generation_params']['rng'] = numpy.random.RandomState(1)
+    self.assertRaises(pydem.InvalidArgumentError, PackCache(self.directory).stable_pack, params)
+
+if __name__ == '__main__':
+  unittest.main()
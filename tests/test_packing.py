@@ -0,0 +1,51 @@
+#
+# tests/test_packing.py : geometric packing.
+#
+# Copyright (C) 2012  Joe Jordan
+# <joe.jordan@imperial.ac.uk>
+# <tehwalrus@h2j9k.org>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or (at
+# your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
+#
+
+import unittest
+import support
+import numpy
+import pydem, pydem.packing as packing
+
+class GeometricPackTest(unittest.TestCase):
+  
+  def assert_separated(self, positions, radii, lower, upper, tolerance):
+    i, j = packing.near_pairs(positions, radii, 0.0, lower, upper)
+    distance = numpy.sqrt(((positions[j] - positions[i]) ** 2).sum(axis=1))
+    self.assertTrue((radii[i] + radii[j] - distance <= tolerance).all())
+    self.assertTrue((positions - radii[:, None] >= lower - 1.0e-9).all())
+    self.assertTrue((positions + radii[:, None] <= upper + 1.0e-9).all())
+  
+  def test_pack(self):
+    rng = numpy.random.RandomState(0)
+    radii = 0.5 + 0.5 * rng.random_sample(300)
+    lower, upper = numpy.zeros(2), numpy.ones(2) * 30.0
+    positions = packing.geometric_pack(radii, lower, upper, tolerance=0.01, rng=rng)
+    self.assertEqual(positions.shape, (300, 2))
+    self.assert_separated(positions, radii, lower, upper, 0.01)
+  
+  def test_too_dense(self):
+    rng = numpy.random.RandomState(0)
+    radii = 0.5 + 0.5 * rng.random_sample(700)
+    self.assertRaises(pydem.InvalidArgumentError, packing.geometric_pack, radii, numpy.zeros(2), numpy.ones(2) * 30.0, rng=rng)
+
+if __name__ == '__main__':
+  unittest.main()
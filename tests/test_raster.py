@@ -0,0 +1,126 @@
+#
+# tests/test_raster.py : drawing frames without a display.
+#
+# Copyright (C) 2012  Joe Jordan
+# <joe.jordan@imperial.ac.uk>
+# <tehwalrus@h2j9k.org>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or (at
+# your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
+#
+
+import os, shutil, struct, tempfile, unittest, zlib
+import support
+import numpy
+import pydem
+from pydem import raster
+
+white = [255, 255, 255]
+black = [0, 0, 0]
+red = [255, 0, 0]
+
+def read_png(filename):
+  """the (width, height) and (height, width, 3) pixels of an RGB PNG written by
+  write_png, checking its structure on the way."""
+  text = open(filename, 'rb').read()
+  assert text[:8] == '\x89PNG\r\n\x1a\n'
+  position = 8
+  chunks = []
+  while position < len(text):
+    length, = struct.unpack('>I', text[position:position + 4])
+    kind = text[position + 4:position + 8]
+    body = text[position + 8:position + 8 + length]
+    crc, = struct.unpack('>I', text[position + 8 + length:position + 12 + length])
+    assert crc == zlib.crc32(kind + body) & 0xffffffff
+    chunks.append((kind, body))
+    position += 12 + length
+  assert [kind for kind, body in chunks] == ['IHDR', 'IDAT', 'IEND']
+  width, height, depth, colour_type, compression, filtering, interlace = struct.unpack('>IIBBBBB', chunks[0][1])
+  assert (depth, colour_type, interlace) == (8, 2, 0)
+  rows = numpy.frombuffer(zlib.decompress(chunks[1][1]), dtype=numpy.uint8).reshape(height, width * 3 + 1)
+  assert (rows[:, 0] == 0).all()
+  return (width, height), rows[:, 1:].reshape(height, width, 3)
+
+def box(dimension):
+  params = {'dimension' : dimension, 'x_limit' : 10.0, 'y_limit' : 8.0}
+  if dimension == 3:
+    params['z_limit'] = 10.0
+  return params
+
+class RasteriserTest(unittest.TestCase):
+  
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+  
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+  
+  def test_circle(self):
+    rasteriser = raster.Rasteriser(box(2), pixel_density=10)
+    image = rasteriser.draw([[5.0, 3.0]], [1.0])
+    self.assertEqual(image.shape, (80, 100, 3))
+    # centred at pixel (50, 50) - y counts down from the top - 10 pixels across.
+    for x, y in [(60, 50), (40, 50), (50, 40), (50, 60)]:
+      self.assertEqual(image[y, x].tolist(), black)
+    for x, y in [(50, 50), (55, 50), (62, 50), (0, 0)]:
+      self.assertEqual(image[y, x].tolist(), white)
+    self.assertEqual((image == 0).all(axis=2).sum(), (raster._ring(10)[0]).size)
+  
+  def test_angle_and_different(self):
+    rasteriser = raster.Rasteriser(box(2), pixel_density=10)
+    image = rasteriser.draw([[5.0, 3.0], [2.0, 6.0]], [1.0, 0.5], thetas=[0.0, 0.0], different=[False, True])
+    for x in range(50, 61):
+      self.assertEqual(image[50, x].tolist(), black)
+    self.assertEqual(image[20, 25].tolist(), red)
+    self.assertEqual(image[20, 20].tolist(), red)
+  
+  def test_slices(self):
+    rasteriser = raster.Rasteriser(box(3), pixel_density=10, slices=[5.0, 5.6, 9.0])
+    images = rasteriser.images(numpy.array([[5.0, 3.0, 5.0]]), numpy.array([1.0]))
+    self.assertEqual(len(images), 3)
+    self.assertEqual(images[0][50, 60].tolist(), black)
+    # cut 0.6 from the centre, the circle has radius 0.8.
+    self.assertEqual(images[1][50, 58].tolist(), black)
+    self.assertEqual(images[1][50, 60].tolist(), white)
+    self.assertTrue((images[2] == 255).all())
+  
+  def test_write_png(self):
+    image = numpy.zeros((3, 5, 3), dtype=numpy.uint8)
+    image[1, 2] = [10, 20, 30]
+    image[2, 4] = [255, 0, 255]
+    filename = os.path.join(self.directory, 'image.png')
+    raster.write_png(filename, image)
+    size, pixels = read_png(filename)
+    self.assertEqual(size, (5, 3))
+    self.assertTrue(numpy.array_equal(pixels, image))
+  
+  def test_save(self):
+    data = support.small_system(count=10, dimension=2)
+    data['elements'][0]['different'] = True
+    rasteriser = raster.Rasteriser(data['params'], pixel_density=4)
+    name = os.path.join(self.directory, 'frame')
+    self.assertEqual(rasteriser.save(data, name), [name + '.png'])
+    size, pixels = read_png(name + '.png')
+    self.assertEqual(size, (rasteriser.width, rasteriser.height))
+    self.assertTrue((pixels == red).all(axis=2).any())
+    self.assertTrue((pixels == black).all(axis=2).any())
+  
+  def test_save_slices(self):
+    data = support.small_system(count=10, dimension=3)
+    rasteriser = raster.Rasteriser(data['params'], pixel_density=4, slices=2)
+    name = os.path.join(self.directory, 'frame')
+    self.assertEqual(rasteriser.save(data, name), [name + '_slice00.png', name + '_slice01.png'])
+
+if __name__ == '__main__':
+  unittest.main()
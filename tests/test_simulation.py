@@ -0,0 +1,314 @@
+#
+# tests/test_simulation.py : Simulation's bookkeeping between python and lammps.
+#
+# Copyright (C) 2012  Joe Jordan
+# <joe.jordan@imperial.ac.uk>
+# <tehwalrus@h2j9k.org>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or (at
+# your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
+#
+
+import os, shutil, tempfile, unittest
+import support
+import numpy
+import pydem, pydem.dem as l
+from pydem.trajectory import TrajectoryRecorder, Trajectory
+
+class SimulationTest(unittest.TestCase):
+  
+  def assert_in_lammps(self, simulation, data):
+    """lammps holds the particles in data, in the same (tag) order."""
+    elements = data['elements']
+    dimension = data['params']['dimension']
+    self.assertEqual(simulation.lmp.nlocal, len(elements))
+    self.assertTrue(numpy.allclose(support.lammps_by_tag(simulation, 'x')[:, :dimension], elements.position))
+    self.assertTrue(numpy.allclose(support.lammps_by_tag(simulation, 'v')[:, :dimension], elements.velocity))
+    self.assertTrue(numpy.allclose(support.lammps_by_tag(simulation, 'radius'), elements.radius))
+
+class SyncTest(SimulationTest):
+  """changes made on either side reach the other."""
+  
+  def check_sync(self, **options):
+    data = support.small_system()
+    for option, value in options.items():
+      data['params'][option] = value
+    simulation = l.Simulation(data)
+    self.assert_in_lammps(simulation, data)
+    simulation.run_time(10)
+    self.assert_in_lammps(simulation, data)
+    
+    elements = data['elements']
+    elements[5]['position'] = [1.5, 2.5, 3.5]
+    elements[7]['velocity'][0] = 4.0
+    elements[9]['radius'] = 0.45
+    simulation.particles_modified()
+    self.assert_in_lammps(simulation, data)
+    
+    elements.position[:, 0] += 0.01
+    simulation.particles_modified(everything=True)
+    self.assert_in_lammps(simulation, data)
+    simulation.run_time(10)
+    self.assert_in_lammps(simulation, data)
+    simulation.close()
+  
+  def test_sync(self):
+    self.check_sync()
+  
+  def test_sync_per_particle(self):
+    self.check_sync(bulk_sync=False)
+  
+  def test_sync_copying(self):
+    self.check_sync(zero_copy=False)
+
+class Watched:
+  """an AtomArrays, noting which per-atom views are looked up."""
+  
+  def __init__(self, atoms, viewed):
+    self.atoms = atoms
+    self.viewed = viewed
+  
+  def __getitem__(self, name):
+    if name != 'id':
+      self.viewed.append(name)
+    return self.atoms[name]
+
+class WithoutSubsetTest(SimulationTest):
+  """with only the whole-system scatter_atoms, and zero_copy off, changes go
+  through scatter_atoms rather than the zero-copy views."""
+  
+  def setUp(self):
+    self.subset = support.fake_lammps.lammps.scatter_atoms_subset
+    del support.fake_lammps.lammps.scatter_atoms_subset
+  
+  def tearDown(self):
+    support.fake_lammps.lammps.scatter_atoms_subset = self.subset
+  
+  def test_few_changed(self):
+    data = support.small_system()
+    data['params']['zero_copy'] = False
+    simulation = l.Simulation(data)
+    simulation.run_time(10)
+    
+    scattered = []
+    scatter = simulation.lmp.scatter_atoms
+    def record(name, type, count, values):
+      scattered.append(name)
+      return scatter(name, type, count, values)
+    simulation.lmp.scatter_atoms = record
+    viewed = []
+    atoms = simulation.atoms
+    simulation.atoms = Watched(atoms, viewed)
+    
+    data['elements'][3]['position'] = [1.5, 2.5, 3.5]
+    simulation.particles_modified()
+    self.assertEqual(scattered, ['x'])
+    self.assertEqual(viewed, [])
+    simulation.atoms = atoms
+    self.assert_in_lammps(simulation, data)
+    simulation.close()
+
+class TagTest(SimulationTest):
+  """particles keep their lammps tags as others come and go."""
+  
+  def test_tags(self):
+    data = support.small_system(count=20)
+    elements = data['elements']
+    simulation = l.Simulation(data)
+    self.assertEqual(elements.tag.tolist(), range(1, 21))
+    
+    removed = elements[3:6]
+    kept = dict([(p.tag, p['position']) for p in elements if p not in removed])
+    simulation.remove_particles(removed)
+    self.assertEqual(len(elements), 17)
+    for tag, position in kept.items():
+      self.assertEqual(elements.by_tag(tag)['position'], position)
+    
+    simulation.add_particles([pydem.Particle({'position' : [1.0, 1.0, 1.0 + i], 'radius' : 0.5, 'mass' : 0.8}) for i in range(3)])
+    self.assertEqual(sorted(elements.tag.tolist()), range(1, 4) + range(7, 24))
+    self.assertEqual(elements.by_tag(23)['position'], [1.0, 1.0, 3.0])
+    self.assert_in_lammps(simulation, data)
+    simulation.close()
+
+class CallbackTest(SimulationTest):
+  """runs are split exactly where callbacks are due, and no more."""
+  
+  def setUp(self):
+    self.data = support.small_system(count=20)
+    self.simulation = l.Simulation(self.data)
+    self.runs = []
+    command = self.simulation.lmp.command
+    def record_runs(text):
+      if text.startswith('run '):
+        self.runs.append(int(text.split()[1]))
+      return command(text)
+    self.simulation.lmp.command = record_runs
+    self.calls = []
+  
+  def tearDown(self):
+    self.simulation.close()
+  
+  def callback(self, name):
+    return lambda simulation, state: self.calls.append((name, state['step']))
+  
+  def test_segments(self):
+    self.simulation.add_callback(self.callback('a'), every_steps=30)
+    self.simulation.add_callback(self.callback('b'), every_steps=45)
+    self.simulation.run_time(100)
+    self.assertEqual(self.runs, [30, 15, 15, 30, 10])
+    self.assertEqual(self.calls, [('a', 30), ('b', 45), ('a', 60), ('a', 90), ('b', 90)])
+    self.assertEqual(self.simulation.steps_run, 100)
+  
+  def test_across_runs(self):
+    self.simulation.add_callback(self.callback('a'), every_steps=15)
+    self.simulation.run_time(20)
+    self.simulation.run_time(20)
+    self.assertEqual(self.runs, [15, 5, 10, 10])
+    self.assertEqual(self.calls, [('a', 15), ('a', 30)])
+  
+  def test_every_time(self):
+    timestep = self.data['params']['force_model']['timestep']
+    self.simulation.add_callback(self.callback('a'), every_time=7.4 * timestep)
+    self.simulation.run_time(20)
+    self.assertEqual(self.runs, [7, 7, 6])
+    self.assertEqual(self.calls, [('a', 7), ('a', 14)])
+  
+  def test_removed(self):
+    callback = self.simulation.add_callback(self.callback('a'), every_steps=5)
+    self.simulation.remove_callback(callback)
+    self.simulation.run_time(20)
+    self.assertEqual(self.runs, [20])
+    self.assertEqual(self.calls, [])
+  
+  def test_needs(self):
+    elements = self.data['elements']
+    stale = []
+    def check(simulation, state):
+      stale.append(set(elements.stale))
+      self.assertTrue(numpy.array_equal(state['position'], support.lammps_by_tag(simulation, 'x')[:, :3]))
+    self.simulation.add_callback(check, every_steps=10, needs=['position'])
+    self.simulation.run_time(10)
+    everything = set(pydem.ParticleStore.lammps_names.keys())
+    self.assertEqual(stale, [everything - set(['position'])])
+  
+  def test_energy(self):
+    elements = self.data['elements']
+    seen = []
+    def check(simulation, state):
+      seen.append((set(elements.stale), state['kinetic_energy']))
+    self.simulation.add_callback(check, every_steps=10, needs=[l.Callback.ENERGY])
+    self.simulation.run_time(10)
+    self.assertEqual(seen, [(set(pydem.ParticleStore.lammps_names.keys()), self.simulation.compute_energy(l.Simulation.KINETIC))])
+  
+  def test_bad_callbacks(self):
+    self.assertRaises(pydem.InvalidArgumentError, self.simulation.add_callback, self.callback('a'))
+    self.assertRaises(pydem.InvalidArgumentError, self.simulation.add_callback, self.callback('a'), every_steps=1, every_time=1.0)
+    self.assertRaises(pydem.InvalidArgumentError, self.simulation.add_callback, self.callback('a'), every_steps=1, needs=['colour'])
+
+class ReuseTest(SimulationTest):
+  """a system which has been run can be run again, in a new Simulation."""
+  
+  def test_rerun(self):
+    data = support.small_system()
+    first = l.Simulation(data)
+    first.run_time(20)
+    first.close()
+    
+    second = l.Simulation(data)
+    self.assert_in_lammps(second, data)
+    second.run_time(5)
+    self.assert_in_lammps(second, data)
+    second.close()
+  
+  def test_rerun_after_removal(self):
+    data = support.small_system()
+    first = l.Simulation(data)
+    first.run_time(20)
+    first.remove_particles(data['elements'][::10])
+    first.run_time(5)
+    first.close()
+    
+    second = l.Simulation(data)
+    self.assert_in_lammps(second, data)
+    self.assertEqual(sorted(data['elements'].tag.tolist()), range(1, len(data['elements']) + 1))
+    second.run_time(5)
+    second.remove_particles(data['elements'][:2])
+    self.assert_in_lammps(second, data)
+    second.close()
+  
+  def test_rerun_2d(self):
+    data = support.small_system(dimension=2)
+    first = l.Simulation(data)
+    first.run_time(20)
+    first.close()
+    
+    second = l.Simulation(data)
+    self.assert_in_lammps(second, data)
+    second.close()
+
+class RecorderTest(unittest.TestCase):
+  """a recorder is given to the constructor, and kept out of the params."""
+  
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+  
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+  
+  def test_record(self):
+    data = support.small_system()
+    filename = os.path.join(self.directory, 'run.trajectory')
+    simulation = l.Simulation(data, recorder=TrajectoryRecorder(filename, every_steps=5))
+    simulation.run_time(20)
+    simulation.close()
+    self.assertFalse('recorder' in data['params'].json)
+    
+    trajectory = Trajectory(filename)
+    self.assertTrue(len(trajectory.steps) > 1)
+    self.assertTrue(numpy.allclose(trajectory[len(trajectory.steps) - 1]['position'], data['elements'].position))
+    trajectory.close()
+    
+    system_file = os.path.join(self.directory, 'system.json.gz')
+    pydem.save_system(data, system_file)
+    self.assertEqual(len(pydem.open_system(system_file)['elements']), len(data['elements']))
+
+class CheckpointTest(unittest.TestCase):
+  """a run killed part way through carries on from its checkpoint."""
+  
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+  
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+  
+  def test_resume(self):
+    checkpoint = os.path.join(self.directory, 'run.snapshot')
+    whole, stats = l.run_simulation(support.small_system(), pydem.Endpoint.TIMESTEP_LIMIT, timestep_limit=300)
+    self.assertEqual(stats['timesteps'], 300)
+    
+    # 'killed' after 200 timesteps, its last checkpoint at 100.
+    l.run_simulation(support.small_system(), pydem.Endpoint.TIMESTEP_LIMIT, timestep_limit=200, checkpoint=checkpoint, checkpoint_every=100)
+    self.assertTrue(os.path.exists(checkpoint))
+    resumed, stats = l.run_simulation(None, pydem.Endpoint.TIMESTEP_LIMIT, timestep_limit=300, checkpoint=checkpoint, checkpoint_every=100)
+    self.assertEqual(stats['timesteps'], 300)
+    self.assertTrue(numpy.allclose(resumed['elements'].position, whole['elements'].position))
+    self.assertTrue(numpy.allclose(resumed['elements'].velocity, whole['elements'].velocity))
+    self.assertEqual(resumed['params'].to_json(), whole['params'].to_json())
+  
+  def test_nothing_to_run(self):
+    checkpoint = os.path.join(self.directory, 'run.snapshot')
+    self.assertRaises(pydem.InvalidArgumentError, l.run_simulation, None, pydem.Endpoint.TIMESTEP_LIMIT, timestep_limit=10, checkpoint=checkpoint)
+
+if __name__ == '__main__':
+  unittest.main()
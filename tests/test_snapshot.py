@@ -0,0 +1,68 @@
+#
+# tests/test_snapshot.py : binary snapshots of systems.
+#
+# Copyright (C) 2012  Joe Jordan
+# <joe.jordan@imperial.ac.uk>
+# <tehwalrus@h2j9k.org>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or (at
+# your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
+#
+
+import os, shutil, tempfile, unittest
+import support
+import numpy
+import pydem
+from pydem import snapshot
+
+class SnapshotTest(unittest.TestCase):
+  
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+  
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+  
+  def check_round_trip(self, dimension, mmap):
+    data = support.small_system(count=30, dimension=dimension)
+    data['elements'][2]['colour'] = 'red'
+    filename = os.path.join(self.directory, 'system' + snapshot.EXTENSION)
+    pydem.save_system(data, filename)
+    self.assertTrue(snapshot.is_snapshot(filename))
+    
+    opened = snapshot.open_snapshot(filename, mmap=mmap)
+    self.assertEqual(opened['params'].to_json(), data['params'].to_json())
+    self.assertEqual(len(opened['elements']), len(data['elements']))
+    for name in ['position', 'velocity', 'force', 'omega', 'radius', 'mass']:
+      self.assertTrue(numpy.array_equal(opened['elements'].column(name), data['elements'].column(name)))
+    self.assertEqual(opened['elements'][2]['colour'], 'red')
+    self.assertEqual([p.to_json() for p in opened['elements']], [p.to_json() for p in data['elements']])
+  
+  def test_3d(self):
+    self.check_round_trip(3, True)
+  
+  def test_2d(self):
+    self.check_round_trip(2, True)
+  
+  def test_copied(self):
+    self.check_round_trip(3, False)
+  
+  def test_open_system(self):
+    data = support.small_system(count=10)
+    filename = os.path.join(self.directory, 'system' + snapshot.EXTENSION)
+    pydem.save_system(data, filename)
+    self.assertTrue(numpy.array_equal(pydem.open_system(filename)['elements'].position, data['elements'].position))
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,84 @@
+#
+# tests/test_store.py : ParticleStore, and the Particles it hands out.
+#
+# Copyright (C) 2012  Joe Jordan
+# <joe.jordan@imperial.ac.uk>
+# <tehwalrus@h2j9k.org>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or (at
+# your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
+#
+
+import unittest
+import support
+import cjson
+
+class ParticleAccessTest(unittest.TestCase):
+  """particles read and write as the plain json dicts they replaced."""
+  
+  def setUp(self):
+    self.store = support.small_system(count=10)['elements']
+    self.store.take_dirty()
+    self.particle = self.store[3]
+  
+  def test_lists(self):
+    for key in ['position', 'velocity', 'force', 'angular_velocity']:
+      self.assertTrue(isinstance(self.particle[key], list))
+    self.assertEqual(self.particle['position'], self.store.position[3].tolist())
+    self.assertEqual(cjson.decode(cjson.encode(self.particle['position'])), self.particle['position'])
+  
+  def test_set_item(self):
+    self.particle['position'][1] = 2.5
+    self.assertEqual(self.store.position[3, 1], 2.5)
+    self.assertEqual(self.particle['position'][1], 2.5)
+    self.assertEqual(self.store.take_dirty()['position'].tolist(), [3])
+  
+  def test_set_angular_velocity(self):
+    self.particle['angular_velocity'][0] = 1.5
+    self.assertEqual(self.store.omega[3, 0], 1.5)
+    self.assertEqual(self.store.take_dirty()['omega'].tolist(), [3])
+  
+  def test_copy(self):
+    position = self.particle['position']
+    position.append(1.0)
+    self.assertEqual(len(self.particle['position']), 3)
+    self.assertEqual(self.store.take_dirty(), {})
+  
+  def test_json(self):
+    json = self.particle.to_json()
+    self.assertTrue(isinstance(json['position'], list))
+    self.assertEqual(cjson.decode(cjson.encode(json)), json)
+
+class RemoveTest(unittest.TestCase):
+  
+  def setUp(self):
+    self.store = support.small_system(count=10)['elements']
+  
+  def test_remove(self):
+    particle = self.store[3]
+    position = particle['position']
+    following = self.store[4]
+    self.store.remove(particle)
+    self.assertEqual(len(self.store), 9)
+    self.assertEqual(particle['position'], position)
+    self.assertTrue(self.store[3] is following)
+    self.assertRaises(ValueError, self.store.remove, particle)
+  
+  def test_remove_rows(self):
+    radii = self.store.radius.tolist()
+    self.store.remove_rows([0, 2, 9])
+    self.assertEqual(self.store.radius.tolist(), [r for i, r in enumerate(radii) if i not in [0, 2, 9]])
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,222 @@
+#
+# tests/test_timing.py : counting where the time goes.
+#
+# Copyright (C) 2012  Joe Jordan
+# <joe.jordan@imperial.ac.uk>
+# <tehwalrus@h2j9k.org>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or (at
+# your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
+#
+
+import unittest
+import support
+import pydem.dem as l
+from pydem import timing
+
+class Clock:
+  """a stand-in for the time module, whose time only moves when told to."""
+  
+  def __init__(self):
+    self.now = 100.0
+  
+  def time(self):
+    return self.now
+
+class TimingsTest(unittest.TestCase):
+  
+  def setUp(self):
+    self.clock = Clock()
+    self.time = timing.time
+    timing.time = self.clock
+    self.timings = timing.Timings()
+  
+  def tearDown(self):
+    timing.time = self.time
+  
+  def at(self, seconds):
+    self.clock.now = 100.0 + seconds
+  
+  def test_nesting(self):
+    t = self.timings
+    t.begin('run')
+    self.at(2)
+    t.begin('read')
+    self.at(5)
+    t.end()
+    self.at(6)
+    t.end()
+    # time between phases is counted against nothing.
+    self.at(10)
+    t.begin('run')
+    self.at(11)
+    t.end()
+    
+    self.assertEqual(t.seconds('run'), 4.0)
+    self.assertEqual(t.calls('run'), 2)
+    self.assertEqual(t.seconds('read'), 3.0)
+    self.assertEqual(t.calls('read'), 1)
+    self.assertEqual(t.seconds('render'), 0.0)
+    self.assertEqual(t.total(), 7.0)
+    self.assertEqual(t.to_json()['phases'], {
+      'run' : {'seconds' : 4.0, 'calls' : 2},
+      'read' : {'seconds' : 3.0, 'calls' : 1}
+    })
+    lines = t.report().splitlines()
+    self.assertTrue(lines[1].startswith('run'))
+    self.assertTrue(lines[2].startswith('read'))
+  
+  def test_reset(self):
+    t = self.timings
+    t.begin('run')
+    self.at(4)
+    t.reset()
+    self.at(6)
+    t.end()
+    self.assertEqual(t.seconds('run'), 2.0)
+    self.assertEqual(t.total(), 2.0)
+  
+  def test_timed(self):
+    t = self.timings
+    clock = self.clock
+    
+    @timing.timed('outer', t)
+    def outer():
+      clock.now += 1.0
+      inner()
+      clock.now += 1.0
+    
+    @timing.timed('inner', t)
+    def inner():
+      clock.now += 5.0
+      raise ValueError()
+    
+    self.assertRaises(ValueError, outer)
+    # the phases are closed even though inner raised.
+    self.assertEqual(t.stack, [])
+    self.assertEqual(t.seconds('inner'), 5.0)
+    self.assertEqual(t.seconds('outer'), 1.0)
+  
+  def test_timed_method(self):
+    class Counted:
+      def __init__(self, clock):
+        self.timings = timing.Timings()
+        self.clock = clock
+      
+      @timing.timed('work')
+      def work(self):
+        self.clock.now += 3.0
+        return 'done'
+    
+    counted = Counted(self.clock)
+    self.assertEqual(counted.work(), 'done')
+    self.assertEqual(counted.timings.seconds('work'), 3.0)
+    self.assertEqual(counted.timings.calls('work'), 1)
+  
+  def test_add_lammps(self):
+    t = self.timings
+    t.add_lammps({'loop' : 1.0, 'pair' : 0.5})
+    t.add_lammps({'loop' : 2.0, 'pair' : 1.5, 'neighbor' : 0.25})
+    self.assertEqual(t.lammps, {'loop' : 3.0, 'pair' : 2.0, 'neighbor' : 0.25})
+    self.assertEqual(t.lammps_runs, 2)
+    self.assertTrue('lammps, over 2 runs:' in t.report())
+
+# as lammps prints them, new style (with several MPI tasks) and old.
+new_style_log = """
+Step Temp E_pair E_mol TotEng Press
+       0            0            0            0            0            0
+    1000    1.2345678            0            0    1.2333333    0.0123456
+Loop time of 1.23456 on 4 procs for 1000 steps with 2000 atoms
+
+Performance: 699829.345 tau/day, 809.987 timesteps/s
+99.5% CPU use with 4 MPI tasks x 1 OpenMP threads
+
+MPI task timing breakdown:
+Section |  min time  |  avg time  |  max time  |%varavg| %total
+---------------------------------------------------------------
+Pair    | 0.51234    | 0.53456    | 0.55678    |   1.2 | 43.30
+Neigh   | 0.12345    | 0.12456    | 0.12567    |   0.1 | 10.09
+Comm    | 0.2        | 0.22       | 0.24       |   2.0 | 17.82
+Output  | 0.001      | 0.0011     | 0.0012     |   0.0 |  0.09
+Modify  | 0.3        | 0.31       | 0.32       |   0.5 | 25.11
+Other   |            | 0.04333    |            |       |  3.51
+
+Nlocal:    500 ave 512 max 488 min
+Histogram: 1 0 0 1 0 0 1 0 0 1
+Total # of neighbors = 7654
+Ave neighs/atom = 3.827
+Neighbor list builds = 12
+Dangerous builds = 0
+"""
+
+old_style_log = """
+Loop time of 0.5 on 1 procs for 100 steps with 50 atoms
+
+Pair  time (%) = 0.2 (40)
+Neigh time (%) = 0.1 (20)
+Comm  time (%) = 0.05 (10)
+Outpt time (%) = 0.01 (2)
+Other time (%) = 0.14 (28)
+
+Nlocal:    50 ave 50 max 50 min
+Loop time of 0.25 on 1 procs for 50 steps with 50 atoms
+"""
+
+class ParseTest(unittest.TestCase):
+  
+  def test_new_style(self):
+    self.assertEqual(timing.parse_lammps_timing(new_style_log), [{
+      'loop' : 1.23456,
+      'pair' : 0.53456,
+      'neighbor' : 0.12456,
+      'comm' : 0.22,
+      'output' : 0.0011,
+      'modify' : 0.31,
+      'other' : 0.04333
+    }])
+  
+  def test_old_style(self):
+    # the second run was finished without its statistics ('post no').
+    self.assertEqual(timing.parse_lammps_timing(old_style_log), [{
+      'loop' : 0.5,
+      'pair' : 0.2,
+      'neighbor' : 0.1,
+      'comm' : 0.05,
+      'output' : 0.01,
+      'other' : 0.14
+    }, {
+      'loop' : 0.25
+    }])
+  
+  def test_nothing(self):
+    self.assertEqual(timing.parse_lammps_timing("Pair  time (%) = 0.2 (40)\n"), [])
+
+class SimulationTimingTest(unittest.TestCase):
+  
+  def test_phases(self):
+    data = support.small_system(count=20)
+    simulation = l.Simulation(data)
+    simulation.time_lammps()
+    simulation.run_time(10)
+    data['elements'].position
+    simulation.run_time(10)
+    t = simulation.timings
+    self.assertEqual(t.calls('run'), 2)
+    self.assertEqual(t.lammps_runs, 2)
+    self.assertTrue('pair' in t.lammps)
+    self.assertEqual(t.stack, [])
+    simulation.close()
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,144 @@
+#
+# tests/test_visualiser.py : what simple_visualiser draws.
+#
+# Copyright (C) 2012  Joe Jordan
+# <joe.jordan@imperial.ac.uk>
+# <tehwalrus@h2j9k.org>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or (at
+# your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
+#
+
+import threading, unittest
+import support
+import numpy
+import pydem
+
+try:
+  import pygame
+  from pydem import simple_visualiser as v
+except ImportError:
+  pygame = None
+
+class _Surface:
+  def fill(self, colour):
+    pass
+
+def _bare(cls):
+  """an instance of cls, without running its constructor (which opens a
+  display.)"""
+  class Bare(cls):
+    def __init__(self):
+      pass
+  return Bare()
+
+@unittest.skipIf(pygame is None, "needs pygame")
+class DrawTest(unittest.TestCase):
+  """orientation lines are drawn only for particles with an angle."""
+  
+  def setUp(self):
+    # draw onto nothing, counting the lines.
+    self.lines = []
+    self.patched = []
+    self.patch(pygame.gfxdraw, 'aacircle', lambda *args: None)
+    self.patch(pygame.gfxdraw, 'line', lambda surface, x0, y0, x1, y1, colour: self.lines.append((x0, y0, x1, y1)))
+    self.patch(pygame.draw, 'line', lambda *args: None)
+    self.patch(pygame.display, 'flip', lambda: None)
+    self.patch(pygame.time, 'get_ticks', lambda: 0)
+    self.renderer = _bare(v.SimulationRenderer)
+    self.renderer.pixel_density = 10
+    self.renderer.mode = {'x' : 400, 'y' : 400}
+    self.renderer.render_surface = _Surface()
+    self.renderer.white = self.renderer.black = self.renderer.red = None
+  
+  def patch(self, module, name, replacement):
+    self.patched.append((module, name, getattr(module, name)))
+    setattr(module, name, replacement)
+  
+  def tearDown(self):
+    for module, name, original in self.patched:
+      setattr(module, name, original)
+    v.SimulationRenderer.vertical = ['y_limit', 1]
+  
+  def test_2d_store(self):
+    data = support.small_system(count=10, dimension=2)
+    frame = v.take_snapshot(data)
+    self.assertEqual(len(frame['theta']), 10)
+    self.renderer.draw(frame)
+    self.assertEqual(len(self.lines), 10)
+  
+  def test_3d_store(self):
+    data = support.small_system(count=10, dimension=3)
+    v.SimulationRenderer.vertical = ['z_limit', 2]
+    frame = v.take_snapshot(data)
+    self.assertTrue(frame['theta'] is None)
+    self.renderer.draw(frame)
+    self.assertEqual(self.lines, [])
+  
+  def test_particles(self):
+    data = support.small_system(count=4, dimension=2)
+    data['elements'] = [pydem.Particle({'position' : [1.0 + 2.0 * i, 1.0], 'radius' : 0.5, 'mass' : 0.8}) for i in range(4)]
+    self.assertTrue(v.take_snapshot(data)['theta'] is None)
+    
+    data['elements'][1]['theta'] = 0.5
+    frame = v.take_snapshot(data)
+    self.assertTrue(numpy.isnan(frame['theta'][0]))
+    self.assertEqual(frame['theta'][1], 0.5)
+    self.renderer.draw(frame)
+    self.assertEqual(len(self.lines), 1)
+
+@unittest.skipIf(pygame is None, "needs pygame")
+class FrameBufferTest(unittest.TestCase):
+  """frames the renderer hasn't got to are replaced, not queued."""
+  
+  def setUp(self):
+    self.data = support.small_system(count=5, dimension=2)
+    self.frames = v.FrameBuffer()
+  
+  def publish(self, x):
+    self.data['elements'][0]['position'] = [x, 1.0]
+    self.frames.publish(self.data)
+  
+  def test_latest_only(self):
+    for x in [1.0, 2.0, 3.0]:
+      self.publish(x)
+    self.assertEqual(self.frames.frames_published, 3)
+    self.assertEqual(self.frames.frames_dropped, 2)
+    self.assertEqual(self.frames.take()['position'][0, 0], 3.0)
+    
+    # nothing newer, so the next take waits (until the buffer is closed.)
+    self.frames.close()
+    self.assertTrue(self.frames.take() is None)
+  
+  def test_while_drawing(self):
+    self.publish(1.0)
+    drawing = self.frames.take()
+    for x in [2.0, 3.0, 4.0]:
+      self.publish(x)
+    # the frame being drawn is never written over.
+    self.assertEqual(drawing['position'][0, 0], 1.0)
+    self.assertEqual(self.frames.frames_dropped, 2)
+    self.assertEqual(self.frames.take()['position'][0, 0], 4.0)
+  
+  def test_waits(self):
+    taken = []
+    taker = threading.Thread(target=lambda: taken.append(self.frames.take()))
+    taker.start()
+    self.publish(5.0)
+    taker.join(5.0)
+    self.assertEqual(taken[0]['position'][0, 0], 5.0)
+    self.assertEqual(self.frames.frames_dropped, 0)
+
+if __name__ == '__main__':
+  unittest.main()